@@ -21,6 +21,9 @@ from .settings import PYLIE_MASTER_CONFIG
 # Initiate an instance of the py-lie master configuration file
 pylie_config = MetaConfigHandler(PYLIE_MASTER_CONFIG)
 
+# Initiate the result cache shared module wide
+from .cache import pylie_cache
+
 from .info import info
 from .model.liemdframe import LIEMDFrame
 from .model.liedataframe import LIEDataFrame
@@ -34,7 +37,8 @@ modulepath = os.path.dirname(__file__)
 if modulepath not in sys.path:
     sys.path.insert(0, modulepath)
 
-__all__ = ['LIEDataFrame', 'LIESeries', 'LIEModelBuilder', 'LIEScanDataFrame', 'LIEMDFrame', 'LIEContactFrame', 'pylie_config']
+__all__ = ['LIEDataFrame', 'LIESeries', 'LIEModelBuilder', 'LIEScanDataFrame', 'LIEMDFrame', 'LIEContactFrame', 'pylie_config',
+           'pylie_cache']
 __doc__ = info.format(version=__version__, author=__author__)
 
 # Configure logger
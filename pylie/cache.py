@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+"""
+package: pylie
+file   : cache
+
+Content addressed cache for expensive intermediate results shared by all
+pylie classes and workflows.
+"""
+
+import copy
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import types
+import numpy
+
+from collections import OrderedDict
+from pandas import DataFrame, Series
+
+from pylie import pylie_config
+
+# Python 2 os.rename replaces existing files on POSIX systems only
+if sys.version_info[0] < 3:
+    from os import rename as replace
+else:
+    from os import replace
+
+logger = logging.getLogger('pylie')
+
+_MISSING = object()
+
+
+def _update_hash(sha, obj):
+    """
+    Feed the content of an object to a hashlib hash object.
+
+    Numpy arrays and pandas objects are hashed by their data type, shape and
+    raw data. Containers are hashed recursively, dictionaries in sorted key
+    order. All other objects are hashed by their representation.
+    """
+
+    if isinstance(obj, (DataFrame, Series)):
+        _update_hash(sha, obj.values)
+        _update_hash(sha, obj.index.values)
+        if isinstance(obj, DataFrame):
+            sha.update(repr(list(obj.columns)).encode('utf-8'))
+    elif isinstance(obj, numpy.ndarray):
+        if obj.dtype == object:
+            sha.update(repr(obj.tolist()).encode('utf-8'))
+        else:
+            sha.update('{0}{1}'.format(obj.dtype.str, obj.shape).encode('utf-8'))
+            sha.update(numpy.ascontiguousarray(obj).view(numpy.uint8))
+    elif isinstance(obj, (list, tuple)):
+        sha.update('{0}{1}'.format(type(obj).__name__, len(obj)).encode('utf-8'))
+        for item in obj:
+            _update_hash(sha, item)
+    elif isinstance(obj, dict):
+        sha.update('dict{0}'.format(len(obj)).encode('utf-8'))
+        for key in sorted(obj, key=repr):
+            sha.update(repr(key).encode('utf-8'))
+            _update_hash(sha, obj[key])
+    else:
+        sha.update(repr(obj).encode('utf-8'))
+
+
+def _contents(obj):
+    """
+    Iterate over an object and all objects it refers to: the items of
+    containers and the attributes of instances. Arrays and pandas objects
+    are not descended into. Every object is visited once.
+    """
+
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        yield obj
+
+        if isinstance(obj, (numpy.ndarray, DataFrame, Series, type, types.ModuleType, types.FunctionType,
+                            types.MethodType)):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.extend(vars(obj).values())
+
+
+def _memory_mapped(array):
+    """
+    Check if the data of a numpy array is a memory-mapped file
+    """
+
+    while array is not None:
+        if isinstance(array, (numpy.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+
+    return False
+
+
+def _sizeof(obj):
+    """
+    Estimate the memory size of an object in bytes without serializing it.
+    Numpy arrays count by the size of their data, memory-mapped arrays not
+    at all, pandas objects by their deep memory usage and all other objects
+    by sys.getsizeof.
+    """
+
+    size = 0
+    for item in _contents(obj):
+        if isinstance(item, numpy.ndarray):
+            if not _memory_mapped(item):
+                size += item.nbytes
+        elif isinstance(item, (DataFrame, Series)):
+            size += int(numpy.sum(item.memory_usage(deep=True)))
+        else:
+            size += sys.getsizeof(item)
+
+    return size
+
+
+def _copy(obj):
+    """
+    Deep copy of a cached result. Read-only numpy arrays, such as
+    memory-mapped model artifacts, cannot be changed and are shared with
+    the copy.
+    """
+
+    memo = dict([(id(item), item) for item in _contents(obj)
+                 if isinstance(item, numpy.ndarray) and not item.flags.writeable])
+
+    return copy.deepcopy(obj, memo)
+
+
+class ResultCache(object):
+    """
+    Two tier least-recently-used cache of intermediate results.
+
+    Results are stored under a key derived from the content of the input
+    data and the settings that define the result (see `key`). The memory
+    tier keeps results up to a total size of `maxsize` MB evicting the
+    least recently used results first. If a cache `directory` is defined,
+    results are also pickled to disk up to a total of `disk_maxsize` MB
+    and results evicted from memory are reloaded from there.
+
+    The cache is opt-in: it is disabled until a memory tier size or a disk
+    directory is configured (see `configure`). Results are returned as
+    copies, changing a returned result does not change the cached one.
+
+    The shared `pylie_cache` instance is consulted by the LIEModelBuilder
+    for optimizer runs and Boltzmann weighted deltaG values, serving all
+    workflows building models on the same data.
+    """
+
+    def __init__(self, **kwargs):
+
+        self.settings = pylie_config.get(instance=type(self).__name__)
+        self.settings.update(kwargs)
+
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+
+        return key in self._memory or os.path.isfile(self._diskpath(key) or '')
+
+    def __len__(self):
+
+        return len(self._memory)
+
+    @property
+    def enabled(self):
+        """
+        True if a memory tier size or a disk tier directory is configured
+        """
+
+        return bool(self.settings.maxsize or self.settings.directory)
+
+    @staticmethod
+    def key(*args):
+        """
+        Build a cache key from the content of the arguments.
+
+        :return: sha1 hex digest
+        :rtype:  :py:str
+        """
+
+        sha = hashlib.sha1()
+        _update_hash(sha, args)
+        return sha.hexdigest()
+
+    def configure(self, **kwargs):
+        """
+        Update the cache settings and evict results until within the new
+        size limits.
+
+        :param maxsize:      memory tier size in MB, 0 disables the memory tier
+        :param directory:    disk tier directory, None disables the disk tier
+        :param disk_maxsize: disk tier size in MB
+        """
+
+        self.settings.update(kwargs)
+        self._evict_memory()
+        self._evict_disk()
+
+    def clear(self, disk=False):
+        """
+        Remove all results from the memory tier and optionally the disk tier
+        """
+
+        self._memory.clear()
+        self._memory_size = 0
+
+        if disk and self.settings.directory and os.path.isdir(self.settings.directory):
+            for filename in os.listdir(self.settings.directory):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.settings.directory, filename))
+
+    def get(self, key, default=None):
+        """
+        Return the result stored under key from memory or disk.
+
+        :param key:     cache key
+        :param default: returned if the key is not in the cache
+        """
+
+        if key in self._memory:
+            self._memory[key] = self._memory.pop(key)
+            self.hits += 1
+            return _copy(self._memory[key][0])
+
+        path = self._diskpath(key)
+        if path and os.path.isfile(path):
+            with open(path, 'rb') as stream:
+                data = stream.read()
+            os.utime(path, None)
+            value = pickle.loads(data)
+            self._store_memory(key, value, len(data))
+            self.hits += 1
+            return _copy(value)
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, size=None):
+        """
+        Store a result under key in the memory and disk tier
+
+        :param key:   cache key
+        :param value: result, needs to be picklable for the disk tier
+        :param size:  memory size of the result in bytes, estimated from the
+                      size of its arrays and other objects if not given
+        """
+
+        if not self.enabled:
+            return
+
+        self._store_memory(key, value, _sizeof(value) if size is None else size)
+
+        path = self._diskpath(key)
+        if path:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.settings.disk_maxsize * 1024 ** 2:
+                return
+
+            if not os.path.isdir(self.settings.directory):
+                os.makedirs(self.settings.directory)
+            handle, tmpfile = tempfile.mkstemp(dir=self.settings.directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as stream:
+                stream.write(data)
+            replace(tmpfile, path)
+            self._evict_disk()
+
+    def cached(self, key, func, *args, **kwargs):
+        """
+        Return the result stored under key, or call func with the arguments
+        and keyword arguments and store its result under key.
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(*args, **kwargs)
+            if self.enabled:
+                self.set(key, value)
+                value = _copy(value)
+
+        return value
+
+    def _diskpath(self, key):
+
+        if self.settings.directory:
+            return os.path.join(self.settings.directory, '{0}.pkl'.format(key))
+
+    def _store_memory(self, key, value, size):
+
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key)[1]
+        if size > self.settings.maxsize * 1024 ** 2:
+            return
+
+        self._memory[key] = (value, size)
+        self._memory_size += size
+        self._evict_memory()
+
+    def _evict_memory(self):
+
+        while self._memory and self._memory_size > self.settings.maxsize * 1024 ** 2:
+            key, (value, size) = self._memory.popitem(last=False)
+            self._memory_size -= size
+            logger.debug('Evict cached result {0} from memory ({1} bytes)'.format(key, size))
+
+    def _evict_disk(self):
+
+        if not self.settings.directory or not os.path.isdir(self.settings.directory):
+            return
+
+        # Least recently used first by modification time, touched on every get
+        paths = [os.path.join(self.settings.directory, f) for f in os.listdir(self.settings.directory)
+                 if f.endswith('.pkl')]
+        stats = sorted([(os.path.getmtime(path), os.path.getsize(path), path) for path in paths])
+        total = sum(size for mtime, size, path in stats)
+        for mtime, size, path in stats:
+            if total <= self.settings.disk_maxsize * 1024 ** 2:
+                break
+            os.remove(path)
+            total -= size
+            logger.debug('Evict cached result {0} from disk ({1} bytes)'.format(path, size))
+
+
+# Cache instance shared module wide
+pylie_cache = ResultCache()
@@ -71,6 +71,10 @@ class ConfigHandler(object):
         :return:    attribute
         """
 
+        # Private attributes are not yet set when unpickling
+        if key.startswith('_'):
+            raise AttributeError(key)
+
         if key in self._config:
             return self._get(key)
         return object.__getattr__(self, key)
@@ -10,15 +10,262 @@ interaction energy-based simulations" Journal of Cheminformatics, 2017, 9, 58.
 http://doi.org/10.1186/s13321-017-0243-x
 """
 
+import io
+import mmap
+import os
 import pandas
 import re
 import logging
+import struct
+import zipfile
 import numpy
 
 from sklearn.covariance import EmpiricalCovariance
 
+from pylie.cache import pylie_cache
 from pylie.model.liemdframe import LIEMDFrame
 
+# eTOX ALLIES model artifact format identifier and version
+ADAN_MODEL_FORMAT = 'pylie.adan'
+ADAN_MODEL_VERSION = 1
+
+ADAN_PCA_ARRAYS = ('mean', 'scale', 'pca_mean', 'components', 'whiten', 'sdev', 'crit')
+
+# Local file header signature starting the content of a .npz (zip) archive
+NPZ_SIGNATURE = b'PK\x03\x04'
+
+
+def _pca_arrays(pca):
+    """
+    Plain array representation of an eTOX ALLIES PCA model
+
+    Converts a PCA model dictionary with a trained sklearn StandardScaler
+    ('scaler') and PCA ('pca') instance to the arrays used by
+    `ad_residue_decomp`. Dictionaries with arrays only, as returned by
+    `load_adan_model`, are returned as is.
+
+    :param pca: PCA model
+    :type pca:  :py:dict
+
+    :return:    scaler mean and scale, PCA mean, the first `n_pc` principal
+                components and their whitening scale, standard deviation and
+                the critical SD and OD values
+    :rtype:     :py:dict
+    """
+
+    if 'components' in pca:
+        return pca
+
+    # Older sklearn StandardScaler instances store the scale as std_
+    scaler = pca['scaler']
+    n_features = len(pca['pca'].mean_)
+    scale = getattr(scaler, 'scale_', None)
+    if scale is None:
+        scale = getattr(scaler, 'std_', None)
+
+    n_pc = pca['n_pc']
+    whiten = numpy.ones(n_pc)
+    if pca['pca'].whiten:
+        whiten = numpy.sqrt(pca['pca'].explained_variance_[:n_pc])
+
+    return {'mean': numpy.asarray(scaler.mean_ if scaler.with_mean else numpy.zeros(n_features), dtype=float),
+            'scale': numpy.asarray(scale if scaler.with_std and scale is not None else numpy.ones(n_features),
+                                   dtype=float),
+            'pca_mean': numpy.asarray(pca['pca'].mean_, dtype=float),
+            'components': numpy.asarray(pca['pca'].components_[:n_pc], dtype=float),
+            'whiten': whiten,
+            'sdev': numpy.asarray(pca['sdev'], dtype=float),
+            'crit': numpy.array([pca['critSD'], pca['critOD']], dtype=float)}
+
+
+def _covariance_arrays(cov):
+    """
+    Plain array representation of an sklearn EmpiricalCovariance instance:
+    the location and the precision (covariance inverse) matrix.
+    """
+
+    return {'location': numpy.asarray(cov.location_, dtype=float),
+            'precision': numpy.asarray(cov.get_precision(), dtype=float)}
+
+
+def save_adan_model(model, path):
+    """
+    Store an eTOX ALLIES model as model artifact
+
+    The artifact is an uncompressed numpy .npz archive of plain arrays:
+    the LIE model parameters, the scaler, PCA and critical SD/OD values of
+    the VdW and Elec residue decomposition PCA models and the location and
+    precision matrix of the deltaG VdW/Elec covariance model.
+    It is loaded by `load_adan_model` without unpickling any object.
+
+    :param model: eTOX ALLIES model as dictionary with 'LIE' parameters and
+                  'AD' decVdw, decEle and Dene models. This is the layout of
+                  the pickled models used by earlier versions.
+    :type model:  :py:dict
+    :param path:  file path or file-like object to write to
+    :type path:   :py:str
+    """
+
+    arrays = {'format': numpy.array(ADAN_MODEL_FORMAT),
+              'version': numpy.array(ADAN_MODEL_VERSION),
+              'params': numpy.asarray(model['LIE']['params'], dtype=float)}
+
+    for prefix, key in (('vdw', 'decVdw'), ('ele', 'decEle')):
+        for name, array in _pca_arrays(model['AD'][key]).items():
+            arrays['{0}_{1}'.format(prefix, name)] = array
+
+    for name, array in _covariance_arrays(model['AD']['Dene']['CovMatrix']).items():
+        arrays['dene_{0}'.format(name)] = array
+
+    numpy.savez(path, **arrays)
+
+
+def _read_npz(stream, buffer):
+    """
+    Read the arrays in an uncompressed numpy .npz archive as read-only views
+    on the archive buffer.
+
+    Only the array headers are parsed, the array data is not copied. Object
+    arrays, that need unpickling, unknown .npy format versions and arrays
+    extending beyond their archive member are refused.
+
+    :param stream: seekable file-like object of the archive
+    :param buffer: archive content, bytes or memory map
+    :return:       arrays by name
+    :rtype:        :py:dict
+    """
+
+    arrays = {}
+    for info in zipfile.ZipFile(stream).infolist():
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError('Compressed arrays are not supported: {0}'.format(info.filename))
+
+        # Skip the local file header: fixed 30 bytes, file name and extra field
+        stream.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', stream.read(4))
+        start = info.header_offset + 30 + name_length + extra_length
+        stream.seek(start)
+
+        version = numpy.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(stream)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(stream)
+        else:
+            raise ValueError('Unsupported .npy format version {0}: {1}'.format(version, info.filename))
+        if dtype.hasobject:
+            raise ValueError('Object arrays are not allowed: {0}'.format(info.filename))
+
+        count = int(numpy.prod(shape))
+        if stream.tell() + count * dtype.itemsize > start + info.file_size:
+            raise ValueError('Array data extends beyond its archive member: {0}'.format(info.filename))
+
+        name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+        array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=stream.tell())
+        arrays[name] = array.reshape(shape, order='F' if fortran_order else 'C')
+
+    return arrays
+
+
+def _read_adan_model(source, mmap_file=False):
+    """
+    Read and validate the arrays of a model artifact, see `load_adan_model`
+    """
+
+    if mmap_file:
+        with open(source, 'rb') as stream:
+            arrays = _read_npz(stream, mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+    else:
+        arrays = _read_npz(io.BytesIO(source), source)
+
+    # Validate format, version, array names and shapes
+    if 'format' not in arrays or str(arrays['format']) != ADAN_MODEL_FORMAT:
+        raise ValueError('Not an eTOX ALLIES model artifact')
+    if 'version' not in arrays or arrays['version'].shape != () or \
+            not 0 < int(arrays['version']) <= ADAN_MODEL_VERSION:
+        raise ValueError('Unsupported eTOX ALLIES model artifact version: {0}'.format(arrays.get('version')))
+
+    required = ['params', 'dene_location', 'dene_precision']
+    for prefix in ('vdw', 'ele'):
+        required.extend(['{0}_{1}'.format(prefix, name) for name in ADAN_PCA_ARRAYS])
+    missing = [name for name in required if name not in arrays]
+    if missing:
+        raise ValueError('eTOX ALLIES model artifact misses arrays: {0}'.format(', '.join(missing)))
+
+    model = {'version': int(arrays['version']), 'params': arrays['params']}
+    for prefix, key in (('vdw', 'decVdw'), ('ele', 'decEle')):
+        pca = dict([(name, arrays['{0}_{1}'.format(prefix, name)]) for name in ADAN_PCA_ARRAYS])
+        if pca['components'].ndim != 2:
+            raise ValueError('Array shape mismatch in {0} PCA model'.format(key))
+        n_pc, n_features = pca['components'].shape
+        if not (pca['mean'].shape == pca['scale'].shape == pca['pca_mean'].shape == (n_features,) and
+                pca['whiten'].shape == pca['sdev'].shape == (n_pc,) and pca['crit'].shape == (2,)):
+            raise ValueError('Array shape mismatch in {0} PCA model'.format(key))
+        model[key] = pca
+
+    model['Dene'] = {'location': arrays['dene_location'], 'precision': arrays['dene_precision']}
+    n_features = len(model['Dene']['location'])
+    if model['Dene']['precision'].shape != (n_features, n_features):
+        raise ValueError('Array shape mismatch in Dene covariance model')
+
+    return model
+
+
+def load_adan_model(source, mmap_file=False):
+    """
+    Load an eTOX ALLIES model artifact stored by `save_adan_model`
+
+    Only plain arrays are read, pickled objects are refused, making it safe
+    to load artifacts from untrusted sources. The format and version of the
+    artifact and the shapes of the arrays are validated, invalid artifacts
+    raise a ValueError. The arrays are read-only.
+
+    If the shared `pylie_cache` is enabled, loaded artifacts are kept there
+    by file path and modification time or by content so repeated loads of
+    the same model are served from memory.
+
+    :param source:    file path, file-like object or artifact content as
+                      bytes
+    :type source:     :py:str
+    :param mmap_file: memory map the artifact file rather than reading it,
+                      requires a file path
+    :type mmap_file:  :py:bool
+
+    :return:          LIE model parameters ('params'), decVdw and decEle PCA
+                      models and Dene covariance model as dictionaries of
+                      arrays
+    :rtype:           :py:dict
+    """
+
+    # File paths are text. Under Python 2 bytes content is a str as well,
+    # artifact content is recognized by its archive signature.
+    is_path = isinstance(source, (str, type(u''))) and not (
+        isinstance(source, bytes) and source.startswith(NPZ_SIGNATURE))
+
+    key = None
+    if is_path:
+        if pylie_cache.enabled:
+            stat = os.stat(source)
+            key = pylie_cache.key('adan_model', os.path.abspath(source), stat.st_mtime, stat.st_size, mmap_file)
+            if key in pylie_cache:
+                return pylie_cache.get(key)
+        if not mmap_file:
+            with open(source, 'rb') as stream:
+                source = stream.read()
+    else:
+        if mmap_file:
+            raise ValueError('Memory mapping requires a model artifact file path')
+        if hasattr(source, 'read'):
+            source = source.read()
+        source = bytes(source)
+        if pylie_cache.enabled:
+            key = pylie_cache.key('adan_model', numpy.frombuffer(source, dtype=numpy.uint8))
+
+    if key is None:
+        return _read_adan_model(source, mmap_file=mmap_file)
+
+    return pylie_cache.cached(key, _read_adan_model, source, mmap_file=mmap_file)
+
 
 def parse_gromacs_decomp(ene_file, parse_rest=True):
     """
@@ -68,7 +315,8 @@ def ad_residue_decomp(decomp_df_list, pca_vdw, pca_ele, cases=None):
     - Note:
     The `pca_*` argument needs to be a dictionary of a trained eTOX ALLIES
     PCA model for the VdW and Elec component of the residue decomposition
-    energie profile.
+    energie profile, either with sklearn scaler and PCA instances or as
+    plain arrays as loaded by `load_adan_model`.
 
     :param decomp_df_list: list of DataFrames with average per-residue
                            decomposition energy values
@@ -95,19 +343,15 @@ def ad_residue_decomp(decomp_df_list, pca_vdw, pca_ele, cases=None):
     columns = ('vdw', 'ele')
     for i, pca in enumerate((pca_vdw, pca_ele)):
 
+        pca = _pca_arrays(pca)
         data_collection = []
         for df in decomp_df_list:
             data_collection.append(df[columns[i]].values)
 
-        if 'scale_' not in dir(pca['scaler']):
-            pca['scaler'].scale_ = None
-        if 'std_' not in dir(pca['scaler']):
-            pca['scaler'].std_ = None
-
-        x_sc = pca['scaler'].transform(numpy.array(data_collection))
-        p = pca['pca'].components_[:pca['n_pc']]
-        transform = pca['pca'].transform(x_sc)
-        transform = numpy.array(transform)[:, :pca['n_pc']]
+        # Scale the data and project on the first principal components
+        x_sc = (numpy.array(data_collection) - pca['mean']) / pca['scale']
+        p = pca['components']
+        transform = numpy.dot(x_sc - pca['pca_mean'], p.T) / pca['whiten']
 
         sd = numpy.sqrt(numpy.sum(numpy.divide(transform**2, pca['sdev']**2), axis=1))
         od = numpy.sqrt(numpy.sum(numpy.subtract(numpy.dot(transform, p), x_sc)**2, axis=1))
@@ -116,8 +360,9 @@ def ad_residue_decomp(decomp_df_list, pca_vdw, pca_ele, cases=None):
         results['{0}_od'.format(columns[i])] = od
 
         # Calculate applicability domain CI value
-        results['{0}_CI'.format(columns[i])] = ((results['{0}_od'.format(columns[i])] > pca['critOD']) | (
-                results['{0}_sd'.format(columns[i])] > pca['critSD'])).astype(int)
+        crit_sd, crit_od = pca['crit']
+        results['{0}_CI'.format(columns[i])] = ((results['{0}_od'.format(columns[i])] > crit_od) | (
+                results['{0}_sd'.format(columns[i])] > crit_sd)).astype(int)
 
     return results
 
@@ -138,13 +383,14 @@ def ad_dene(ene_df, cov, center=None, ci_cutoff=None, columns=['w_vdw', 'w_coul'
 
     - Note:
     The `cov` argument needs to be a Sklearn EmpiricalCovariance instance that
-    is pre-trained using the training data.
+    is pre-trained using the training data or its location and precision
+    arrays as loaded by `load_adan_model`.
 
     :param ene_df:    pandas DataFrame with energy values
     :type ene_df:     :pandas:DataFrame
     :param cov:       the emperical covariance matrix used to calculate the
                       Mahalanobis distance
-    :type cov:        :sklearn:covariance:EmpiricalCovariance
+    :type cov:        :sklearn:covariance:EmpiricalCovariance or :py:dict
     :param center:    Center each VdW/Elec value pair by subtracting a fixed
                       [VdW, Elec] value pair from it.
     :type center:     :py:list
@@ -167,10 +413,13 @@ def ad_dene(ene_df, cov, center=None, ci_cutoff=None, columns=['w_vdw', 'w_coul'
         assert len(center) == 2, ValueError('Center should be list of length 2')
         ene_df[columns] = ene_df[columns] - center
 
-    # Calculate Mahalanobis distance
-    assert isinstance(cov, EmpiricalCovariance),\
+    # Calculate (squared) Mahalanobis distance
+    assert isinstance(cov, (EmpiricalCovariance, dict)),\
         AssertionError('cov not of type EmpiricalCovariance: {0}'.format(type(cov)))
-    ene_df['mahal'] = cov.mahalanobis(ene_df[columns])
+    if isinstance(cov, EmpiricalCovariance):
+        cov = _covariance_arrays(cov)
+    centered = ene_df[columns].values - cov['location']
+    ene_df['mahal'] = numpy.sum(numpy.dot(centered, cov['precision']) * centered, axis=1)
 
     # Calculate applicability domain CI value if ci_cutoff defined
     if ci_cutoff:
@@ -8,7 +8,7 @@ import getpass
 import StringIO
 
 from pylie import LIEModelBuilder, pylie_config
-from pylie.methods.methods import cv_set_partitioner
+from pylie.methods.methods import cv_partitions
 from pylie.model.liemodelframe import RLMregression, OLSregression
 
 logger = logging.getLogger('pylie')
@@ -61,13 +61,14 @@ class StochasticOptimizer(object):
             start_index = self._cluster_matrix.shape[1]
 
             # Stochastic iterations
-            cv = cv_set_partitioner(cluster_set, cvtype='RAND', p=0.9, maxpartitions=50)
+            partitions = cv_partitions(cluster_set, cvtype='RAND', p=0.9, maxpartitions=50,
+                                       seed=self.settings.get('seed'))
 
             # Random reintroduce outliers from previous iteration
             if outliers:
                 pass
 
-            modeller.batchmodel(cv,
+            modeller.batchmodel(partitions=partitions, cases=cluster_set,
                                 rmodel=RLMregression(),
                                 minclustersize=self.settings['minclustersize'])
 
@@ -13,6 +13,7 @@ import itertools
 import matplotlib.pyplot as plt
 
 from scipy import stats
+from scipy.special import comb
 from matplotlib.patches import Ellipse
 from pandas import DataFrame
 
@@ -189,45 +190,47 @@ def hlinkage_to_treematrix(linkage_matrix):
     return results
 
 
-def cv_set_partitioner(cases, cvtype='LOO', p=2, maxpartitions=200):
+def cv_partitions(cases, cvtype='LOO', p=2, maxpartitions=200, seed=None, strata=None, bins=5):
     """
-    Creates test and train sets for cross-validation
-
-    Given a list of observations, the function will create an identity matrix with
-    different partitions of the input. A partition contains observations marked as
-    training set (1) and validation set (0). Each column of the matrix is one
-    partition. The number of columns is defined by the number of observations and
-    the choosen partition method (cvtype). Supported methods are:
-
-    LOO:  Leave-On-Out cross-validation. Exhaustive cross-validation in which all
-          permutations of one observation as the validation set and the remaining
-          observations as the training set are generated.
-          Permutation combinations equals C\ :sup:`n` \ :sub: `1` \ = n where n
-          equals the number of observations.
-    LPO:  Leave-p-Out cross-validation. Exhausitive cross-validation in which p
-          observations as the validation set and the remaining observations as the
-          training set. This is repeated on all ways to cut the original sample on
-          a validation set of p' observations and a training set.
-          Permutation combinations equals C\ :sup:`n` \ :sub: `p` \ times where n
-          equals the number of observations and p the partition count. With larger
-          values of n this becomes impossible to calculateb efficiently. To
-          prevent combinatorial explosions a maxpartitions count is enforces.
-    RAND: Select random but unique subsets from the dataset with partition p and
-          maxpartitions numer of times.
-    KFOLD:
+    Generate test and train sets for cross-validation
+
+    Lazy alternative to `cv_set_partitioner` yielding for every partition a
+    tuple of integer arrays with the positions in cases of the training and
+    the validation observations. Supported methods are:
+
+    LOO:   Leave-One-Out cross-validation, every observation is the
+           validation set once.
+    LPO:   Leave-p-Out cross-validation. All combinations of p observations as
+           validation set if there are no more than maxpartitions of them,
+           else maxpartitions unique combinations are sampled without
+           enumerating all combinations.
+    RAND:  maxpartitions random but unique training sets of p observations.
+    KFOLD: p folds of consecutive observations, each the validation set once.
+
+    RAND and KFOLD partitions may be stratified on strata, for instance the
+    reference affinities: observations are binned in quantile bins of the
+    strata values and each training set (RAND) or fold (KFOLD) draws from
+    every bin in proportion to its size.
+    Random sampling (LPO, RAND and stratified KFOLD) is reproducible given
+    the seed.
 
     :param cases:  List of observation ID's
     :ptype cases:  List or array of int's
-    :param cvtype: Cross-validation method. Either LOO, LPO or KFOLD
+    :param cvtype: Cross-validation method. Either LOO, LPO, RAND or KFOLD
     :ptype cvtype: string
-    :param p:      Partition count or fraction for LPO cross-validation.
-                   Set to 1 for LOO.
+    :param p:      Partition count or fraction. Ignored for LOO.
     :ptype p:      int or float
-    :param maxpartitions: Maximum number of permutations returned to prevent
-                   combinatorial explosions. Defaults to 200
+    :param maxpartitions: Maximum number of LPO and RAND partitions
     :ptype maxpartitions: int
-
-    :return:       DataFrame with the partition identity matrix
+    :param seed:   Seed for the random number generator
+    :ptype seed:   int
+    :param strata: Values to stratify RAND and KFOLD partitions on, one for
+                   every observation.
+    :ptype strata: List or array of float's
+    :param bins:   Number of quantile bins of the strata values
+    :ptype bins:   int
+
+    :return:       Generator of (train, test) index array tuples
     """
 
     nr = len(cases)
@@ -239,46 +242,113 @@ def cv_set_partitioner(cases, cvtype='LOO', p=2, maxpartitions=200):
     else:
         p = 1
 
-    # Leave one-out cross-validation (LOO)
-    if cvtype in ('LOO', 'LPO'):
-        if cvtype == 'LOO':
-            p = 1
-        permutations = [n for n in itertools.permutations(range(0, len(cases)), p)]
-        perm_matrix = numpy.ones((nr, len(permutations)))
-        for i, t in enumerate(permutations):
-            perm_matrix[t, i] = 0
-            if i == maxpartitions:
-                logger.warn("maxpartitions ({0}) reached. Return current set only".format(maxpartitions))
-                break
-
-    if cvtype == 'KFOLD':
+    assert cvtype in ('LOO', 'LPO', 'RAND', 'KFOLD'), "Unknown cross-validation method: {0}".format(cvtype)
+    rng = numpy.random.RandomState(seed)
+    index = numpy.arange(nr)
+
+    # Stratum of every observation from quantile bins of the strata values
+    stratum = numpy.zeros(nr, dtype=int)
+    if strata is not None:
+        assert len(strata) == nr, "Stratify on one value for every observation"
+        edges = numpy.percentile(strata, numpy.linspace(0, 100, bins + 1)[1:-1])
+        stratum = numpy.digitize(strata, edges)
 
+    def partition(test):
+        test = numpy.sort(test)
+        return numpy.delete(index, test), test
+
+    # Leave one-out cross-validation (LOO)
+    if cvtype == 'LOO':
+        for i in index:
+            yield partition([i])
+
+    # Leave p-out cross-validation (LPO), enumerate or sample combinations
+    elif cvtype == 'LPO':
+        if comb(nr, p, exact=True) <= maxpartitions:
+            for test in itertools.combinations(index, p):
+                yield partition(list(test))
+        else:
+            drawn = set()
+            while len(drawn) < maxpartitions:
+                test = tuple(sorted(rng.choice(nr, size=p, replace=False)))
+                if test not in drawn:
+                    drawn.add(test)
+                    yield partition(list(test))
+
+    # Random training sets (RAND) of p observations, p / nr of each stratum
+    elif cvtype == 'RAND':
+        groups = [index[stratum == s] for s in numpy.unique(stratum)]
+        shares = numpy.array([len(group) for group in groups]) * p / float(nr)
+        sizes = numpy.floor(shares).astype(int)
+        sizes[numpy.argsort(sizes - shares)[:p - sizes.sum()]] += 1
+
+        drawn = set()
+        for attempt in range(maxpartitions):
+            train = tuple(sorted(numpy.concatenate([rng.choice(group, size=size, replace=False)
+                                                    for group, size in zip(groups, sizes)])))
+            if train not in drawn:
+                drawn.add(train)
+                train = numpy.array(train, dtype=int)
+                yield train, numpy.setdiff1d(index, train)
+
+    # K-fold cross-validation (KFOLD), stratified folds deal the observations
+    # of every stratum in random order over the folds
+    elif cvtype == 'KFOLD':
         assert 2 <= p < nr, "K-folds fold partition needs to be between 2 and {0}. Got {1}".format(nr, p)
 
-        fold_sizes = (nr // p) * numpy.ones(p, dtype=numpy.int)
-        fold_sizes[:nr % p] += 1
-        perm_matrix = numpy.ones((nr, len(fold_sizes)))
-        current = 0
-        for i, fold_size in enumerate(fold_sizes):
-            start, stop = current, current + fold_size
-            perm_matrix[start:stop, i] = 0
-            current = stop
-
-    if cvtype == 'RAND':
-
-        partitions = []
-        case_id = range(nr)
-        for n in range(maxpartitions):
-            part = numpy.random.permutation(case_id)
-            part = part.tolist()[0:p]
-            if part not in partitions:
-                partitions.append(part)
-
-        perm_matrix = numpy.zeros((nr, len(partitions)))
-        for i, partition in enumerate(partitions):
-            perm_matrix[partition, i] = 1
-
-    dataframe = DataFrame(perm_matrix)
+        if strata is None:
+            fold_sizes = (nr // p) * numpy.ones(p, dtype=int)
+            fold_sizes[:nr % p] += 1
+            folds = numpy.repeat(numpy.arange(p), fold_sizes)
+        else:
+            order = numpy.lexsort((rng.permutation(nr), stratum))
+            folds = numpy.empty(nr, dtype=int)
+            folds[order] = numpy.arange(nr) % p
+
+        for fold in range(p):
+            yield partition(index[folds == fold])
+
+
+def cv_partition_matrix(cases, partitions):
+    """
+    Identity matrix of cross-validation partitions
+
+    :param cases:      List of observation ID's
+    :ptype cases:      List or array of int's
+    :param partitions: (train, test) index arrays of every partition as
+                       generated by `cv_partitions`
+    :ptype partitions: iterable
+
+    :return:           DataFrame with for every partition a column marking
+                       the training set (1) and validation set (0)
+    """
+
+    columns = [numpy.in1d(numpy.arange(len(cases)), train).astype(float) for train, test in partitions]
+
+    dataframe = DataFrame(numpy.array(columns).T if columns else numpy.zeros((len(cases), 0)))
     dataframe['case'] = cases
 
     return dataframe
+
+
+def cv_set_partitioner(cases, cvtype='LOO', p=2, maxpartitions=200, seed=None, strata=None, bins=5):
+    """
+    Creates test and train sets for cross-validation
+
+    Given a list of observations, the function will create an identity matrix with
+    different partitions of the input. A partition contains observations marked as
+    training set (1) and validation set (0). Each column of the matrix is one
+    partition. The partitions are those generated by `cv_partitions`, see there
+    for the supported methods (cvtype) and arguments.
+
+    :param cases:  List of observation ID's
+    :ptype cases:  List or array of int's
+    :param cvtype: Cross-validation method. Either LOO, LPO, RAND or KFOLD
+    :ptype cvtype: string
+
+    :return:       DataFrame with the partition identity matrix
+    """
+
+    partitions = cv_partitions(cases, cvtype=cvtype, p=p, maxpartitions=maxpartitions, seed=seed, strata=strata,
+                               bins=bins)
+    return cv_partition_matrix(cases, partitions)
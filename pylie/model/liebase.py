@@ -2,6 +2,7 @@
 
 import logging
 import re
+import numpy
 
 from pandas import DataFrame, Series
 
@@ -298,7 +299,7 @@ class LIEDataFrameBase(_Common, DataFrame):
         for item in cases:
 
             # Item is a case
-            if isinstance(item, int):
+            if isinstance(item, (int, numpy.integer)):
                 if item in df_cases:
                     selected_indices.extend(self.loc[self['case'] == item].index.values)
                 else:
@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import logging
+import multiprocessing
 import numpy
 
-from numpy.random import choice
-from collections import defaultdict
-from pandas import DataFrame, Series, pivot_table, isnull
+from pandas import DataFrame, Index, Series, concat, pivot_table, isnull
 from statsmodels import api as sm
 from sklearn import mixture
 
-from pylie.methods.methods import cv_set_partitioner
+from pylie.cache import pylie_cache
+from pylie.methods.methods import cv_partitions
 from pylie.methods.stats import *
 from pylie.model.liebase import LIEDataFrameBase
 from pylie.model.liedataframe import LIEDataFrame, lie_deltag
@@ -20,6 +21,10 @@ GREEK_ALPHABET = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', '
                   'lambda', 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 'phi',
                   'chi', 'psi', 'omega']
 
+# Settings that define the outcome of a LIE parameter optimizer run
+MODEL_CONTENT_SETTINGS = ('def_params', 'conv_cutoff', 'maxiter', 'window_size', 'optimizer', 'lm_damping',
+                          'acceleration', 'acceleration_depth', 'kBt')
+
 DEFAULT_MODEL_COLUMN_NAMES = {'L0': 'L0',
                               'L1': 'L1',
                               'iteration': 'iteration',
@@ -33,18 +38,69 @@ DEFAULT_MODEL_COLUMN_NAMES = {'L0': 'L0',
                               'converge': 'converge'}
 
 
+class LeastSquaresResults(object):
+    """
+    Lightweight closed-form (weighted) least-squares regression results.
+
+    Parameters, fitted values and residuals are solved directly from the
+    design matrix using numpy.linalg.lstsq. All other attributes such as
+    covariance, summary and diagnostics are taken from the equivalent
+    statsmodels results object that is only build on first access.
+    """
+
+    def __init__(self, smmodel, endog, exog, **kwargs):
+
+        self._smmodel = smmodel
+        self._smparams = kwargs
+        self._results = None
+        self.endog = numpy.asarray(endog, dtype=float)
+        self.exog = numpy.asarray(exog, dtype=float)
+
+        # Scale rows by the square root of the weights for WLS
+        sqrt_weights = numpy.sqrt(numpy.ones(len(self.endog)) * kwargs.get('weights', 1.0))
+        self.params = numpy.linalg.lstsq(self.exog * sqrt_weights[:, numpy.newaxis], self.endog * sqrt_weights,
+                                         rcond=None)[0]
+        self.fittedvalues = self.exog.dot(self.params)
+
+    def __getattr__(self, key):
+
+        if key.startswith('_'):
+            raise AttributeError(key)
+        if self._results is None:
+            self._results = self._smmodel(self.endog, exog=self.exog, **self._smparams).fit()
+        return getattr(self._results, key)
+
+    @property
+    def resid(self):
+
+        return self.endog - self.fittedvalues
+
+    def predict(self, exog=None):
+
+        if exog is None:
+            return self.fittedvalues
+        return numpy.dot(exog, self.params)
+
+
 class OLSregression(object):
     rmodeltype = 'OLS'
+    smmodel = sm.OLS
 
     def __init__(self, **kwargs):
         self.rmodelparams = kwargs
-        self.model = None
+        self.endog = None
+        self.exog = None
+
+    @property
+    def model(self):
+        return self.smmodel(self.endog, exog=self.exog, **self.rmodelparams)
 
     def set(self, endog, exog=None):
-        self.model = sm.OLS(endog, exog=exog, **self.rmodelparams)
+        self.endog = endog
+        self.exog = exog
 
     def fit(self):
-        return self.model.fit()
+        return LeastSquaresResults(self.smmodel, self.endog, self.exog, **self.rmodelparams)
 
 
 class GLSregression(object):
@@ -61,18 +117,9 @@ class GLSregression(object):
         return self.model.fit()
 
 
-class WLSregression(object):
+class WLSregression(OLSregression):
     rmodeltype = 'WLS'
-
-    def __init__(self, **kwargs):
-        self.rmodelparams = kwargs
-        self.model = None
-
-    def set(self, endog, exog=None):
-        self.model = sm.WLS(endog, exog=exog, **self.rmodelparams)
-
-    def fit(self):
-        return self.model.fit()
+    smmodel = sm.WLS
 
 
 class GLSARregression(object):
@@ -103,22 +150,132 @@ class QRregression(object):
         return self.model.fit()
 
 
+class RobustResults(LeastSquaresResults):
+    """
+    Lightweight robust linear regression results of the stacked IRLS solver.
+
+    Parameters, final IRLS weights and MAD scale are those computed by
+    `stacked_irls`. All other attributes are taken from the equivalent
+    statsmodels RLM results object that is only build on first access.
+    """
+
+    def __init__(self, endog, exog, params, weights, scale, **kwargs):
+
+        self._smmodel = sm.RLM
+        self._smparams = kwargs
+        self._results = None
+        self.endog = numpy.asarray(endog, dtype=float)
+        self.exog = numpy.asarray(exog, dtype=float)
+        self.params = params
+        self.weights = weights
+        self.scale = scale
+        self.fittedvalues = self.exog.dot(self.params)
+
+    @property
+    def sresid(self):
+
+        return self.resid / self.scale
+
+
 class RLMregression(object):
     rmodeltype = 'RLM'
 
     def __init__(self, norm='AndrewWave', **kwargs):
         self.rmodelparams = kwargs
-        self.model = None
+        self.endog = None
+        self.exog = None
         self.norm = norm
         if type(norm) == str:
             self.norm = getattr(sm.robust.norms, norm, None)
             assert self.norm is not None, "No valid M-estimator of type {0} available".format(norm)
 
+    @property
+    def model(self):
+        return sm.RLM(self.endog, exog=self.exog, M=self.norm(), **self.rmodelparams)
+
     def set(self, endog, exog=None):
-        self.model = sm.RLM(endog, exog=exog, M=self.norm(), **self.rmodelparams)
+        self.endog = endog
+        self.exog = exog
 
     def fit(self):
-        return self.model.fit()
+        params, weights, scale = stacked_irls(self.endog, self.exog, norm=self.norm)
+        return RobustResults(self.endog, self.exog, params[0], weights[0], scale[0], M=self.norm(),
+                             **self.rmodelparams)
+
+
+def stacked_irls(endog, exog, mask=None, norm=sm.robust.norms.AndrewWave, maxiter=50, tol=1.0e-8):
+    """
+    Robust linear regression of many subsets of observations at once using
+    iteratively reweighted least-squares (IRLS).
+
+    Follows the statsmodels RLM algorithm using a MAD scale estimate and the
+    deviance as convergence criterion. The weighted normal equations of all
+    subsets are build and solved together. Subsets drop out of the iteration
+    as soon as they converge.
+
+    :param endog:   response as (subsets x observations) or (observations) array
+    :type endog:    :numpy:ndarray
+    :param exog:    design matrices as (subsets x observations x parameters) or
+                    (observations x parameters) array
+    :type exog:     :numpy:ndarray
+    :param mask:    boolean (subsets x observations) array of the observations
+                    in each subset. All observations by default
+    :type mask:     :numpy:ndarray
+    :param norm:    M-estimator norm class
+    :param maxiter: maximum number of IRLS iterations
+    :type maxiter:  :py:int
+    :param tol:     convergence tolerance of the deviance
+    :type tol:      :py:float
+
+    :return:        parameters (subsets x parameters), final weights
+                    (subsets x observations, 0 outside of the subset) and scale
+                    (subsets) arrays
+    :rtype:         :py:tuple
+    """
+
+    exog = numpy.asarray(exog, dtype=float)
+    if exog.ndim == 2:
+        exog = exog[numpy.newaxis, :, :]
+    n_sets, n_obs, n_params = exog.shape
+    endog = numpy.broadcast_to(numpy.asarray(endog, dtype=float), (n_sets, n_obs))
+    if mask is None:
+        mask = numpy.ones((n_sets, n_obs), dtype=bool)
+    mask = numpy.broadcast_to(numpy.asarray(mask, dtype=bool), (n_sets, n_obs))
+    norm = norm()
+
+    def wls(idx, weights):
+        weights = numpy.where(mask[idx], weights, 0.0)
+        xtwx = numpy.einsum('snp,sn,snq->spq', exog[idx], weights, exog[idx])
+        xtwy = numpy.einsum('snp,sn,sn->sp', exog[idx], weights, endog[idx])
+        params = numpy.einsum('spq,sq->sp', numpy.linalg.pinv(xtwx), xtwy)
+        resid = numpy.where(mask[idx], endog[idx] - numpy.einsum('snp,sp->sn', exog[idx], params), 0.0)
+        wls_scale = numpy.einsum('sn,sn->s', weights, resid ** 2) / (mask[idx].sum(axis=1) - n_params)
+        deviance = numpy.where(mask[idx], norm(resid / wls_scale[:, numpy.newaxis]), 0.0).sum(axis=1)
+        return params, weights, resid, deviance
+
+    def mad(idx, resid):
+        if mask[idx].all():
+            return numpy.median(numpy.abs(resid), axis=1) / MAD_NORMALIZATION
+        return numpy.nanmedian(numpy.where(mask[idx], numpy.abs(resid), numpy.nan), axis=1) / MAD_NORMALIZATION
+
+    # Start with the ordinary least-squares solution
+    idx = numpy.arange(n_sets)
+    params, weights, resid, deviance = wls(idx, numpy.ones((n_sets, n_obs)))
+    scale = mad(idx, resid)
+
+    iteration = 1
+    active = scale != 0
+    while active.any() and iteration < maxiter:
+        idx = numpy.flatnonzero(active)
+        norm_weights = norm.weights(resid[idx] / scale[idx, numpy.newaxis])
+        params[idx], weights[idx], resid[idx], new_deviance = wls(idx, norm_weights)
+        scale[idx] = mad(idx, resid[idx])
+
+        active[idx] = (numpy.abs(new_deviance - deviance[idx]) > tol) & (scale[idx] != 0)
+        deviance[idx] = new_deviance
+        iteration += 1
+
+    return params, weights, scale
 
 
 REGRESS_METHODS = {
@@ -130,6 +287,623 @@ REGRESS_METHODS = {
     'RLM': RLMregression
 }
 
+LIE_OPTIMIZERS = ('iterative', 'lm', 'gn')
+
+MAD_NORMALIZATION = 0.6744897501960817  # scipy.stats.norm.ppf(0.75)
+
+
+class NLSResults(object):
+    """
+    Regression results of a nonlinear least-squares LIE model fit.
+
+    Wraps the results of the regression model fitted to the Gauss-Newton
+    linearisation of the Boltzmann weighted LIE equation at the optimum.
+    Covariance, robust weights and summary are taken from the linearised
+    fit. Parameters are those of the nonlinear optimum. Fitted values,
+    predictions, residuals and R-squared are those of the Boltzmann
+    weighted deltaG values.
+    """
+
+    def __init__(self, results, endog, fittedvalues, params):
+
+        self._results = results
+        self.endog = endog
+        self.fittedvalues = fittedvalues
+        self.params = params
+
+    def __getattr__(self, key):
+
+        if key.startswith('_'):
+            raise AttributeError(key)
+        return getattr(self._results, key)
+
+    @property
+    def resid(self):
+
+        return self.endog - self.fittedvalues
+
+    @property
+    def rsquared(self):
+
+        return rsquared(self.endog, self.fittedvalues)
+
+    def predict(self, exog=None):
+
+        if exog is None:
+            return self.fittedvalues
+        return self._results.predict(exog)
+
+
+def _lie_jacobian(dataset, params, kBt=2.49):
+    """
+    Boltzmann weighted LIE deltaG values and their derivatives with respect
+    to the scaling parameters.
+
+    The derivative of the Boltzmann weighted energy term k to scaling
+    parameter m equals minus the Boltzmann weighted covariance between energy
+    terms k and m over the poses of a case divided by kBt.
+    Scaling parameters in excess of the number of energy terms are treated as
+    intercept (gamma).
+
+    :param dataset: energy terms as (cases x poses) arrays, NaN for missing poses
+    :type dataset:  :py:list
+    :param params:  scaling parameters
+    :type params:   :py:list
+    :param kBt:     Boltzmann constant at given temperature
+    :type kBt:      :py:float
+
+    :return:        deltaG values and (cases x parameters) Jacobian
+    :rtype:         :py:tuple
+    """
+
+    data = numpy.array([numpy.asarray(d, dtype=float) for d in dataset])
+    params = numpy.asarray(params, dtype=float)
+    k = data.shape[0]
+
+    # Pose probabilities, shift energies to the lowest pose for numerical stability
+    energy = numpy.einsum('k,knp->np', params[:k], data)
+    exponent = numpy.nan_to_num(numpy.exp(-(energy - numpy.nanmin(energy, axis=1)[:, numpy.newaxis]) / kBt))
+    prob = exponent / exponent.sum(axis=1)[:, numpy.newaxis]
+
+    data = numpy.nan_to_num(data)
+    weighted = numpy.einsum('np,knp->kn', prob, data)
+    covariance = numpy.einsum('np,knp,mnp->kmn', prob, data, data) - weighted[:, numpy.newaxis] * weighted
+
+    dg_calc = params[:k].dot(weighted) + params[k:].sum()
+    jacobian = weighted.T - numpy.einsum('k,kmn->nm', params[:k], covariance) / kBt
+    if len(params) > k:
+        jacobian = numpy.column_stack((jacobian, numpy.ones((jacobian.shape[0], len(params) - k))))
+
+    return dg_calc, jacobian
+
+
+def _pack_case_sets(cases, sets):
+    """
+    Pack the case membership of case sets into a bit array.
+
+    :param cases: sorted case ID's, one bit for every case
+    :type cases:  :numpy:ndarray
+    :param sets:  list of case ID lists
+    :type sets:   :py:list
+    :return:      (sets x ceil(cases / 8)) uint8 array with bit j of row i set
+                  if case j is in set i
+    :rtype:       :numpy:ndarray
+    """
+
+    lengths = [len(case_set) for case_set in sets]
+    members = numpy.zeros((len(sets), len(cases)), dtype=bool)
+    if sum(lengths):
+        flat = numpy.concatenate([numpy.asarray(case_set, dtype=int) for case_set in sets if len(case_set)])
+        positions = numpy.minimum(numpy.searchsorted(cases, flat), len(cases) - 1)
+        assert numpy.all(cases[positions] == flat), "Cases {0} not in the LIEDataFrame".format(
+            numpy.setdiff1d(flat, cases))
+        members[numpy.repeat(numpy.arange(len(sets)), lengths), positions] = True
+
+    return numpy.packbits(members, axis=1)
+
+
+def _unpack_case_sets(bits, count):
+    """
+    Unpack bit arrays of `_pack_case_sets` into boolean case membership.
+    Equivalent to numpy.unpackbits with count, which requires numpy 1.17.
+
+    :param bits:  (sets x ceil(cases / 8)) or ceil(cases / 8) uint8 array
+    :type bits:   :numpy:ndarray
+    :param count: number of cases
+    :type count:  int
+    :return:      (sets x cases) or (cases) boolean array
+    :rtype:       :numpy:ndarray
+    """
+
+    return numpy.unpackbits(bits, axis=-1)[..., :count].astype(bool)
+
+
+def _boltzmann_weighted(data, params, kBt=2.49):
+    """
+    Boltzmann weighted energy terms of all cases for many parameter sets at once.
+
+    :param data:   energy terms as (terms x cases x poses) array, NaN for
+                   missing poses
+    :type data:    :numpy:ndarray
+    :param params: scaling parameters as (sets x parameters) array. Parameters
+                   in excess of the number of energy terms (intercept) are
+                   not used
+    :type params:  :numpy:ndarray
+    :param kBt:    Boltzmann constant at given temperature
+    :type kBt:     :py:float
+
+    :return:       weighted energies as (sets x cases x terms) array
+    :rtype:        :numpy:ndarray
+    """
+
+    # Pose probabilities, shift energies to the lowest pose for numerical stability
+    energy = numpy.einsum('sk,knp->snp', params[:, :data.shape[0]], data)
+    exponent = numpy.nan_to_num(numpy.exp(-(energy - numpy.nanmin(energy, axis=2)[:, :, numpy.newaxis]) / kBt))
+    prob = exponent / exponent.sum(axis=2)[:, :, numpy.newaxis]
+
+    return numpy.einsum('snp,knp->snk', prob, numpy.nan_to_num(data))
+
+
+def _optimizer_worker(task):
+    """
+    Run an LIEModelBuilder optimizer for the pivoted energy arrays of one
+    cluster of cases in a worker process.
+
+    :param task: optimizer run function (`_iterative_lie_run` or
+                 `_nls_lie_run`), settings, energy arrays, reference affinity
+                 and regression model.
+    :type task:  :py:tuple
+    :return:     optimizer run outcome
+    """
+
+    run, settings, dataset, ref, rmodel = task
+    return run(settings, dataset, ref, rmodel)
+
+
+def _filter_pass(settings, params, stats):
+    """
+    Evaluate the LIEModelBuilder filter criteria for the parameters and
+    statistics of a model.
+
+    :param settings: LIEModelBuilder settings
+    :type settings:  ConfigHandler
+    :param params:   model parameters
+    :type params:    :py:list
+    :param stats:    model statistics (e.g. rmsd, rsquared) by name. Filter
+                     criteria for other statistics are not evaluated
+    :type stats:     :py:dict
+    :return:         True if all filter criteria are met
+    :rtype:          :py:bool
+    """
+
+    # Check if model parameters are within acceptable range
+    filter_settings = settings.filter
+    for i, param in enumerate(settings.param_labels):
+        if params[i] < filter_settings['param_ltol'][i] or params[i] > filter_settings['param_utol'][i]:
+            return False
+
+    for key, value in filter_settings.items():
+        if key in stats:
+
+            if type(value) in (int, float):
+                if stats[key] != value:
+                    return False
+
+            if type(value) == list:
+                if not (value[0] < stats[key] < value[1]):
+                    return False
+
+    return True
+
+
+def _oscillation(param_trace):
+    """
+    Mean alpha and beta gradient over the last four iterations of an
+    iterative optimizer run.
+
+    :param param_trace: parameters of all iterations
+    :type param_trace:  :numpy:ndarray
+    :rtype:             :py:tuple
+    """
+
+    tail = param_trace[max(0, len(param_trace) - 4):]
+    return numpy.mean(numpy.gradient(tail[:, 0])), numpy.mean(numpy.gradient(tail[:, 1]))
+
+
+def _mcresample_chain(task):
+    """
+    Run a Monte Carlo resampling chain of `LIEModelBuilder.mcresample`.
+
+    The state of the chain is kept in arrays over all cases: boolean case
+    inclusion masks of the base- and superset, the outlier count of every
+    case and, for every accepted move, the model statistics, the robust
+    regression weights and the selected (highest probability) pose of every
+    case. Moves are optimized without adding them to the DataFrame, only the
+    optimizer run of the last accepted move is returned.
+
+    :param task: optimizer run function, settings, energy terms as
+                 (terms x cases x poses) array, reference affinity, base- and
+                 superset masks, initial rmsd and r-squared cutoff and seed
+    :type task:  :py:tuple
+    :return:     chain state
+    :rtype:      :py:dict
+    """
+
+    run, settings, data, ref, base, superset, cutoffs, seed = task
+    settings = copy.deepcopy(settings)
+    rng = numpy.random.RandomState(seed)
+    rmodel = RLMregression()
+
+    orig_rmsd_filter = settings.filter['rmsd']
+    orig_rsquared_filter = settings.filter['rsquared']
+    settings.filter['rmsd'] = [orig_rmsd_filter[0], cutoffs[0]]
+    settings.filter['rsquared'] = [cutoffs[1], orig_rsquared_filter[1]]
+
+    def fit(mask):
+        # Optimize the model for the cases in mask, None if not converged
+        dataset = [d[:, ~numpy.isnan(d).all(axis=0)] for d in data[:, mask]]
+        outcome = run(settings, dataset, ref[mask], rmodel)
+        if run is _iterative_lie_run:
+            converged, results = outcome[0] is not None, outcome[1]
+        else:
+            converged, results = outcome[1], outcome[2]
+        if not converged:
+            return
+
+        downweighted = numpy.zeros(len(ref), dtype=bool)
+        downweighted[numpy.flatnonzero(mask)[results.weights <= settings.rlm_outlier_cutoff]] = True
+        rmsd = sdec(ref[mask], results.predict())
+        r2 = 1 - (sum(numpy.square(results.resid)) / tss(ref[mask]))
+
+        return outcome, results, mask, downweighted, rmsd, r2
+
+    def filterpass(outcome, results, mask, downweighted, rmsd, r2):
+        # Filter rules as applied when adding the model to the DataFrame
+        if run is _iterative_lie_run and not settings.acceleration:
+            alpha_gradient, beta_gradient = _oscillation(outcome[2])
+            if abs(alpha_gradient) > 0.001 or abs(beta_gradient) > 0.001:
+                return False
+        if not settings.usefilter:
+            return True
+        return _filter_pass(settings, results.params, {'rmsd': rmsd, 'rsquared': r2, 'N': mask.sum()})
+
+    # Statistics, weights and selected poses of accepted moves
+    maxmoves = settings.max_iter_steps
+    nparams = len(settings.def_params)
+    stats = numpy.full((maxmoves, 2 + nparams), numpy.nan)
+    weights = numpy.full((maxmoves, len(ref)), numpy.nan)
+    poses = numpy.zeros((maxmoves, len(ref)), dtype=int)
+    energy_missing = numpy.isnan(data).all(axis=(0, 2))
+
+    superset = superset & ~base
+    removed = numpy.zeros(len(ref))
+    accepted = 0
+    last = None
+    iteration = 0
+    no_model_count = 0
+    while superset.any() and iteration < settings.max_iter_steps:
+
+        iteration += 1
+
+        # - Adjust propensity for drawing new sample based on outlier count
+        candidates = numpy.flatnonzero(superset)
+        propensities = numpy.ones(len(candidates))
+        if removed.sum():
+            propensities = 1 - removed[candidates] / removed.sum()
+            if not propensities.sum():
+                propensities = numpy.ones(len(candidates))
+        propensities /= propensities.sum()
+
+        # - Draw random sample
+        sample_size = min(max(int(base.sum() * settings.mc_rand_sample_draw), 1), numpy.count_nonzero(propensities))
+        sample = numpy.zeros(len(ref), dtype=bool)
+        sample[rng.choice(candidates, size=sample_size, p=propensities, replace=False)] = True
+
+        # - RLM model using the new baseset
+        move = fit(base | sample)
+        if move is None:
+            continue
+
+        # - If all are downweighted, continue
+        adjusted = sample & ~move[3]
+        if not adjusted.any():
+            removed += sample
+            continue
+
+        # - If there are down-weighted cases in the sample, rerun RLM without them.
+        if (adjusted != sample).any():
+            move = fit(base | adjusted)
+            if move is None:
+                continue
+
+        outcome, results, mask, downweighted, rmsd, r2 = move
+        if filterpass(*move):
+
+            # - Register the move, cases with the highest pose probability
+            #   have the lowest energy
+            energy = numpy.einsum('k,knp->np', results.params[:len(data)], data)
+            stats[accepted] = [rmsd, r2] + list(results.params)
+            weights[accepted, mask] = results.weights
+            poses[accepted] = numpy.where(energy_missing, 0,
+                                          numpy.argmin(numpy.where(numpy.isnan(energy), numpy.inf, energy), axis=1) + 1)
+            last = (outcome, mask, [list(settings.filter['rmsd']), list(settings.filter['rsquared'])])
+            accepted += 1
+            no_model_count = 0
+            if settings.warm_start:
+                settings['def_params'] = [float(param) for param in results.params]
+
+            # - Model passed, register new baseset and correct removed
+            removed += downweighted
+            base = base | adjusted
+            superset = superset & ~base
+            removed[base] = 0
+
+            # - Adjust filter criteria
+            new_rmsd_cutoff = rmsd * (2 - settings.mc_filter_tol)
+            if new_rmsd_cutoff >= orig_rmsd_filter[1]:
+                new_rmsd_cutoff = orig_rmsd_filter[1]
+            elif new_rmsd_cutoff <= settings.filter['rmsd'][1]:
+                new_rmsd_cutoff = settings.filter['rmsd'][1]
+
+            new_rsquared_cutoff = r2 * settings.mc_filter_tol
+            if new_rsquared_cutoff <= orig_rsquared_filter[0]:
+                new_rsquared_cutoff = orig_rsquared_filter[0]
+            elif new_rsquared_cutoff >= settings.filter['rsquared'][0]:
+                new_rsquared_cutoff = settings.filter['rsquared'][0]
+
+            settings.filter['rmsd'] = [orig_rmsd_filter[0], new_rmsd_cutoff]
+            settings.filter['rsquared'] = [new_rsquared_cutoff, orig_rsquared_filter[1]]
+            logger.warn("New filter criteria for rmsd ({0:.3f}-{1:.3f}) and r-squared ({2:.3f}-{3:.3f})".format(
+                orig_rmsd_filter[0], new_rmsd_cutoff, new_rsquared_cutoff, orig_rsquared_filter[1]))
+
+            logger.warn(
+                "MonteCarlo optimize: iteration {0}, rmsd: {1:.3f}, r-squared: {2:.3f}. Baseset: {3}, superset: {4} sample size: {5}".format(
+                    iteration, rmsd, r2, base.sum(), superset.sum(), sample_size))
+
+        else:
+            removed += adjusted
+            no_model_count += 1
+            if no_model_count >= 20:
+                logger.warn("Unable to improve model after {0} unsuccessful sample additions. Stopping".format(
+                    no_model_count))
+                break
+
+    return {'base': base, 'superset': superset, 'iterations': iteration, 'stats': stats[:accepted],
+            'weights': weights[:accepted], 'poses': poses[:accepted], 'last': last}
+
+
+def _accelerate(method, inputs, outputs, depth=3):
+    """
+    Extrapolate the next parameter set of the fixed-point iteration
+    theta = G(theta) in the iterative LIE optimizer.
+
+    anderson: Anderson mixing using the last `depth` differences of the
+              parameter sets and fixed-point residuals G(theta) - theta.
+    aitken:   Aitken's delta-squared extrapolation of each parameter after
+              two plain fixed-point steps. The history is reset after each
+              extrapolation (Steffensen iteration).
+
+    Falls back to the plain fixed-point step G(theta) if the extrapolation
+    is not finite.
+
+    :param method:  acceleration method, 'anderson' or 'aitken'
+    :type method:   :py:str
+    :param inputs:  parameter sets used for Boltzmann weighting, updated in place
+    :type inputs:   :py:list
+    :param outputs: regression parameters G(theta) for the inputs, updated in place
+    :type outputs:  :py:list
+    :param depth:   Anderson mixing history depth
+    :type depth:    :py:int
+
+    :return:        parameter set for the next iteration
+    :rtype:         :numpy:ndarray
+    """
+
+    accelerated = outputs[-1]
+    if method == 'aitken' and len(outputs) >= 2:
+        theta0, theta1, theta2 = inputs[-2], outputs[-2], outputs[-1]
+        denominator = theta2 - 2 * theta1 + theta0
+        safe = numpy.abs(denominator) > 1.0e-12
+        accelerated = theta2.copy()
+        accelerated[safe] = theta0[safe] - (theta1[safe] - theta0[safe]) ** 2 / denominator[safe]
+        del inputs[:], outputs[:]
+
+    elif method == 'anderson' and len(outputs) >= 2:
+        del inputs[:-(depth + 1)], outputs[:-(depth + 1)]
+        residuals = numpy.array(outputs) - numpy.array(inputs)
+        coefficients = numpy.linalg.lstsq(numpy.diff(residuals, axis=0).T, residuals[-1], rcond=None)[0]
+        accelerated = outputs[-1] - coefficients.dot(numpy.diff(numpy.array(outputs), axis=0))
+
+    if not numpy.all(numpy.isfinite(accelerated)):
+        return outputs[-1]
+    return accelerated
+
+
+def _iterative_lie_run(settings, dataset, ref, rmodel):
+    """
+    Fixed-point iteration of `LIEModelBuilder._iterative_lie_optimizer`.
+    A function of the settings only, so it runs in worker processes.
+
+    :param settings: LIEModelBuilder settings
+    :return:         iteration of the selected model or None if not
+                     converged, its regression results and the parameter,
+                     rmsd and r-squared traces
+    :rtype:          :py:tuple
+    """
+
+    # Determine model params
+    intercept = True
+    if len(settings.def_params) <= len(dataset):
+        intercept = False
+    weighted_data_labels = ['w_{0}'.format(l) for l in settings.model_cols]
+
+    # Parameters used for Boltzmann weighting and regression results since
+    # the last restart of the convergence acceleration
+    assert settings.acceleration in (None, 'anderson', 'aitken'), \
+        "Unknown convergence acceleration: {0}".format(settings.acceleration)
+    theta = numpy.array(settings.def_params, dtype=float)
+    inputs = []
+    outputs = []
+
+    # Iteration history buffers, iteration 0 is the start situation.
+    # Regression results are only kept for the convergence window.
+    maxiter = settings.maxiter
+    window_size = settings.window_size
+    param_trace = numpy.full((maxiter + 1, len(theta)), numpy.nan)
+    rmsd_trace = numpy.full(maxiter + 1, numpy.nan)
+    r2_trace = numpy.full(maxiter + 1, numpy.nan)
+    fits = [None] * (maxiter + 1)
+    param_trace[0] = theta
+
+    # Start iteration
+    best = None
+    for i in range(1, maxiter + 1):
+
+        # Get weighted energies using active theta.
+        Wenergies = lie_deltag(dataset, params=theta, data_labels=settings.model_cols, kBt=settings.kBt)
+
+        # Calculate the regression model
+        if intercept:
+            variables = numpy.column_stack((Wenergies[weighted_data_labels].values, numpy.ones((len(ref), 1))))
+        else:
+            variables = Wenergies[weighted_data_labels].values
+
+        rmodel.set(ref, variables)
+        results = rmodel.fit()
+        results.intercept = intercept
+
+        param_trace[i] = results.params
+        rmsd_trace[i] = sdec(ref, results.predict())
+        r2_trace[i] = 1 - (sum(numpy.square(results.resid)) / tss(ref))
+        fits[i] = results
+        if i > window_size:
+            fits[i - window_size] = None
+        logger.debug("Iteration {0}: param {1}, SDEC {2:.3f}, R2 {3:.3f}".format(i, ' '.join(
+            ['{0:.3f}'.format(p) for p in results.params]), rmsd_trace[i], r2_trace[i]))
+
+        # Accelerated fixed-point iteration: converged when the regression
+        # parameters reproduce the parameters used for Boltzmann weighting.
+        if settings.acceleration:
+            if numpy.sum((param_trace[i] - theta) ** 2) >= settings.conv_cutoff:
+                inputs.append(theta)
+                outputs.append(param_trace[i])
+                theta = _accelerate(settings.acceleration, inputs, outputs,
+                                    depth=settings.acceleration_depth)
+                continue
+
+            best = i
+
+        # Check for convergence in regression parameters using a rolling window
+        # average over the last X iterations.
+        # On convergence, pick the last iteration with lowest RSD in the window
+        else:
+            theta = param_trace[i]
+            if i < window_size:
+                continue
+            window_diff = (param_trace[i].sum() - param_trace[i - window_size].sum()) / window_size
+            if not window_diff ** 2 < settings.conv_cutoff:
+                continue
+
+            best = i - numpy.nanargmin(rmsd_trace[i - window_size + 1:i + 1][::-1])
+
+        break
+
+    fit = fits[i] if best is None else fits[best]
+    return best, fit, param_trace[:i + 1], rmsd_trace[:i + 1], r2_trace[:i + 1]
+
+
+def _nls_lie_run(settings, dataset, ref, rmodel):
+    """
+    Nonlinear least-squares fit of `LIEModelBuilder._nls_lie_optimizer`.
+    A function of the settings only, so it runs in worker processes.
+
+    :param settings: LIEModelBuilder settings
+    :return:         number of iterations, convergence, regression results
+                     and the parameter, rmsd and r-squared traces
+    :rtype:          :py:tuple
+    """
+
+    # Determine model params
+    intercept = True
+    if len(settings.def_params) <= len(dataset):
+        intercept = False
+    dataset = [numpy.asarray(data, dtype=float) for data in dataset]
+
+    # Loss function: robust M-estimator weights for RLM or case weights for WLS
+    norm = None
+    weights = numpy.ones(len(ref))
+    if rmodel.rmodeltype == 'RLM':
+        norm = rmodel.norm()
+    elif rmodel.rmodeltype == 'WLS':
+        weights = weights * rmodel.rmodelparams.get('weights', 1.0)
+
+    # Gauss-Newton is Levenberg-Marquardt without initial damping
+    damping = settings.lm_damping
+    if settings.optimizer == 'gn':
+        damping = 0.0
+
+    theta = numpy.array(settings.def_params, dtype=float)
+    dg_calc, jacobian = _lie_jacobian(dataset, theta, kBt=settings.kBt)
+
+    # Iteration history buffers, iteration 0 is the start situation
+    maxiter = settings.maxiter
+    param_trace = numpy.full((maxiter + 1, len(theta)), numpy.nan)
+    rmsd_trace = numpy.full(maxiter + 1, numpy.nan)
+    r2_trace = numpy.full(maxiter + 1, numpy.nan)
+    param_trace[0] = theta
+
+    # Robust fits are iteratively reweighted: the M-estimator weights are
+    # fixed while the damped steps converge for them, then updated from
+    # the residuals until the parameters no longer change.
+    converged = False
+    reweight = norm is not None
+    outer_theta = theta
+    for i in range(1, maxiter + 1):
+
+        resid = ref - dg_calc
+        if reweight:
+            scale = sm.robust.scale.mad(resid, center=0)
+            if scale > 0:
+                weights = norm.weights(resid / scale)
+            reweight = False
+
+        cost = numpy.sum(weights * resid ** 2)
+        hessian = jacobian.T.dot(jacobian * weights[:, numpy.newaxis])
+        gradient = jacobian.T.dot(weights * resid)
+
+        # Increase damping until the step lowers the cost or vanishes
+        while True:
+            step = numpy.linalg.lstsq(hessian + damping * numpy.diag(numpy.diag(hessian)), gradient, rcond=None)[0]
+            trial_dg, trial_jacobian = _lie_jacobian(dataset, theta + step, kBt=settings.kBt)
+            if numpy.sum(weights * (ref - trial_dg) ** 2) <= cost or numpy.sum(step ** 2) < settings.conv_cutoff:
+                break
+            damping = max(damping * 10, settings.lm_damping)
+
+        theta = theta + step
+        dg_calc, jacobian = trial_dg, trial_jacobian
+        damping /= 10
+
+        param_trace[i] = theta
+        rmsd_trace[i] = sdec(ref, dg_calc)
+        r2_trace[i] = rsquared(ref, dg_calc)
+        logger.debug("Iteration {0}: param {1}, SDEC {2:.3f}, R2 {3:.3f}".format(i, ' '.join(
+            ['{0:.3f}'.format(p) for p in theta]), rmsd_trace[i], r2_trace[i]))
+
+        if numpy.sum(step ** 2) < settings.conv_cutoff:
+            if norm is None or numpy.sum((theta - outer_theta) ** 2) < settings.conv_cutoff:
+                converged = True
+                break
+            outer_theta = theta
+            reweight = True
+
+    # Fit the regression model to the linearised LIE equation at the optimum
+    rmodel.set(ref - dg_calc + jacobian.dot(theta), jacobian)
+    linear = rmodel.fit()
+    results = NLSResults(linear, ref, dg_calc, theta)
+    results.intercept = intercept
+
+    return i, converged, results, param_trace[:i + 1], rmsd_trace[:i + 1], r2_trace[:i + 1]
+
 
 class LIEModelFrame(LIEDataFrameBase):
     _class_name = 'model'
@@ -156,7 +930,43 @@ class LIEModelFrame(LIEDataFrameBase):
 
         return LIEModelFrame
 
-    def crossvalidate(self, cvtype='LOO', p=1, maxpartitions=200):
+    def crossvalidate(self, cvtype='LOO', p=1, maxpartitions=200, fast=False, exact=False, seed=None, stratify=False,
+                      **kwargs):
+        """
+        Cross-validate the model by refitting it for partitions of the
+        training set and predicting the cases left out.
+
+        The fast LOO alternative does not refit the model but keeps the
+        Boltzmann weights fixed at the model solution. The leave-one-out
+        residuals then follow in closed form from the residuals and the
+        leverage (hat matrix diagonal) of the regression. Only available
+        for OLS and WLS models.
+
+        With the warm_start setting (off by default), every fold is refitted
+        starting from the parameters of the full model rather than the
+        default start parameters.
+
+        :param cvtype:        cross-validation type, see cv_partitions
+        :param p:             partition size
+        :param maxpartitions: maximum number of partitions
+        :param seed:          seed for random partitions
+        :ptype seed:          :py:int
+        :param stratify:      stratify RAND and KFOLD partitions on reference
+                              affinity bins
+        :ptype stratify:      :py:bool
+        :param fast:          hat matrix LOO without refitting
+        :ptype fast:          :py:bool
+        :param exact:         also refit to report the deviation of the fast
+                              LOO Q2 and SDEP from the refitted ones
+        :ptype exact:         :py:bool
+        :return:              LIEModelBuilder with the models of the
+                              partitions, without models for fast LOO. The
+                              statistics are in its _metadata: q2 and sdep
+                              of the refitted models, or of the fast LOO
+                              without exact. Fast LOO statistics are also
+                              stored as q2_fast and sdep_fast.
+        :rtype:               LIEModelBuilder
+        """
 
         # Current trainset
         trainset = self.trainset.cases
@@ -165,33 +975,89 @@ class LIEModelFrame(LIEDataFrameBase):
         dfcopy = self.source.copy()
         dfcopy.trainset = trainset
 
-        # Get default parameter set
-        def_params = [0.5] * len(self.model.params)
-        if len(def_params) > 2:
-            def_params[-1] = 0
-
-        # Create Cross-validation partition table
-        cvmatrix = cv_set_partitioner(trainset, cvtype=cvtype, p=p, maxpartitions=maxpartitions)
-
-        # Run a new batch modelling using the cross-validation matrix as input
+        # Additional keyword arguments, like nproc, are LIEModelBuilder settings
         cmodel = LIEModelBuilder(dataframe=dfcopy)
-        cmodel.batchmodel(cvmatrix, rmodel=REGRESS_METHODS[self.rmodel](), usefilter=False, def_params=def_params)
-
-        # Collect cross-validated deltaG values
-        response = self.trainset['ref_affinity'].values
+        cmodel.settings.update(kwargs)
+
+        if fast:
+            assert cvtype == 'LOO', "Fast cross-validation only available for LOO, not {0}".format(cvtype)
+            assert self.rmodel in ('OLS', 'WLS'), "Fast LOO requires an OLS or WLS model, not {0}".format(self.rmodel)
+
+            response = self.model.endog
+            test_observed = response - self._loo_residuals()
+            fast_stats = {'n': len(trainset), 'p': p, 'cvtype': cvtype, 'fast': True,
+                          'sdep_fast': sdep(response, test_observed), 'q2_fast': qsquared(response, test_observed)}
+            if not exact:
+                fast_stats.update({'sdep': fast_stats['sdep_fast'], 'q2': fast_stats['q2_fast']})
+                cmodel._metadata.update(fast_stats)
+                return cmodel
+            cmodel._metadata.update(fast_stats)
+
+        # Start parameters: the converged model parameters differ little from
+        # those of each fold (warm_start), else the default parameter set.
+        if cmodel.settings.warm_start:
+            def_params = [float(param) for param in self.model.params]
+        else:
+            def_params = [0.5] * len(self.model.params)
+            if len(def_params) > 2:
+                def_params[-1] = 0
+
+        # Create Cross-validation partitions
+        strata = None
+        if stratify:
+            strata = Series(self['ref_affinity'].values, index=self['case'].values)[trainset].values
+        partitions = list(cv_partitions(trainset, cvtype=cvtype, p=p, maxpartitions=maxpartitions, seed=seed,
+                                        strata=strata))
+
+        # Run a new batch modelling of the training sets of the partitions
+        cmodel.batchmodel(partitions=partitions, cases=trainset, rmodel=REGRESS_METHODS[self.rmodel](),
+                          usefilter=False, def_params=def_params)
+
+        # Collect cross-validated deltaG values of the validation cases of
+        # every partition, one model per partition in partition order.
+        response = []
         test_observed = []
-        for i, index in enumerate(cmodel.inliers.index):
-            testset = cvmatrix[cvmatrix[i] == 0]['case']
-            m = cmodel.getmodel(index)
-            test_observed.extend(m.get_cases(testset.values)['dg_calc'].values)
-
-        if len(test_observed) == len(response):
+        stats = {}
+        if len(cmodel) == len(partitions):
+            for (train, test), index in zip(partitions, cmodel.index):
+                if index in cmodel.inliers.index:
+                    testset = cmodel.getmodel(index).get_cases(numpy.asarray(trainset)[test])
+                    response.extend(testset['ref_affinity'].values)
+                    test_observed.extend(testset['dg_calc'].values)
+
+        if response and len(response) == sum(len(test) for train, test in partitions):
+            response = numpy.array(response)
             stats = {'n': len(trainset), 'p': p, 'cvtype': cvtype, 'sdep': sdep(response, test_observed),
                      'q2': qsquared(response, test_observed)}
             cmodel._metadata.update(stats)
 
+        # Deviation of the fast LOO statistics from the refitted ones
+        if fast and 'q2' in stats:
+            cmodel._metadata.update({'q2_deviation': fast_stats['q2_fast'] - stats['q2'],
+                                     'sdep_deviation': fast_stats['sdep_fast'] - stats['sdep']})
+            logger.info("Fast LOO deviation from refitted LOO: Q2 {0:.4f}, SDEP {1:.4f}".format(
+                cmodel._metadata['q2_deviation'], cmodel._metadata['sdep_deviation']))
+
         return cmodel
 
+    def _loo_residuals(self):
+        """
+        Leave-one-out residuals of the training cases for the regression with
+        fixed Boltzmann weights: e / (1 - h) with h the diagonal of the
+        (weighted) hat matrix of the regression design.
+
+        :rtype: :numpy:ndarray
+        """
+
+        exog = numpy.asarray(self.model.exog, dtype=float)
+        weights = numpy.ones(len(exog)) * getattr(self.model.model, 'weights', 1.0)
+
+        # Hat matrix diagonal from the orthonormal basis of the weighted design
+        q = numpy.linalg.qr(exog * numpy.sqrt(weights)[:, numpy.newaxis])[0]
+        leverage = numpy.sum(q ** 2, axis=1)
+
+        return self.model.resid / (1 - leverage)
+
     def fitstats_to_table(self):
         # Set the residual weights. Default to 1 for non-weighted regression methods
         # Check for a 'weights' attribute in the regression results. If found, set
@@ -331,34 +1197,10 @@ class LIEModelBuilder(LIEDataFrameBase):
         filter results. Determines if filter_mask will be set to 0
         """
 
-        passed = True
         idx = model.index.values[0]
+        stats = dict([(key, model.at[idx, key]) for key in self.settings.filter if key in self.columns])
 
-        # Check if model parameters are within acceptable range
-        params = model.at[idx, 'fit'].params
-        filter_settings = self.settings.filter
-        for i, param in enumerate(self.settings.param_labels):
-            if params[i] < filter_settings['param_ltol'][i] or params[i] > filter_settings['param_utol'][i]:
-                passed = False
-                break
-
-        if not passed:
-            return passed
-
-        for key, value in filter_settings.items():
-            if key in self.columns:
-
-                if type(value) in (int, float):
-                    if model.at[idx, key] != value:
-                        passed = False
-                        break
-
-                if type(value) == list:
-                    if not (value[0] < model.at[idx, key] < value[1]):
-                        passed = False
-                        break
-
-        return passed
+        return _filter_pass(self.settings, model.at[idx, 'fit'].params, stats)
 
     @staticmethod
     def _pivot_data(dataframe, column):
@@ -379,7 +1221,224 @@ class LIEModelBuilder(LIEDataFrameBase):
 
         return pivot
 
-    def _iterative_lie_optimizer(self, dataset, ref, rmodel=None, cases=None, L0=None):
+    def _pivot_cases(self, column, cases=None):
+        """
+        Pivot table of a column of the source dataframe with the values for
+        every pose (columns) of every case (rows).
+
+        Every column is pivoted once into a cached (cases x poses) array and
+        only pivoted again if the case, pose or column data changed. A subset
+        of cases is taken from the cached array by integer indexing, a
+        KeyError is raised for cases not in the source dataframe. Poses
+        without data for any of these cases are dropped as in a pivot table
+        of those cases alone.
+
+        :param column: source dataframe column name
+        :ptype column: string
+        :param cases:  case ID's, all cases by default
+        :ptype cases:  list
+        :return:       Pivot table as new Pandas DataFrame
+        """
+
+        dataframe = self.dataframe
+        case = dataframe['case'].values.astype(int)
+        poses = dataframe['poses'].values
+
+        store = self._metadata.get('pivots')
+        layout = pylie_cache.key(case, poses)
+        if store is None or store['layout'] != layout:
+            case_ids, rows = numpy.unique(case, return_inverse=True)
+            pose_ids, cols = numpy.unique(poses, return_inverse=True)
+            store = {'layout': layout, 'cases': case_ids, 'poses': pose_ids, 'rows': rows, 'cols': cols, 'arrays': {}}
+            self._metadata['pivots'] = store
+
+        values = dataframe[column].values.astype(float)
+        fingerprint = pylie_cache.key(values)
+        if store['arrays'].get(column, (None,))[0] != fingerprint:
+
+            # Mean of the values of every case and pose, NaN if none. Missing
+            # train and filter mask values are 0 as in LIEDataFrames.
+            valid = ~numpy.isnan(values)
+            where = (store['rows'][valid], store['cols'][valid])
+            total = numpy.zeros((len(store['cases']), len(store['poses'])))
+            count = numpy.zeros(total.shape)
+            numpy.add.at(total, where, values[valid])
+            numpy.add.at(count, where, 1)
+            pivot = numpy.full(total.shape, 0.0 if column in ('train_mask', 'filter_mask') else numpy.nan)
+            numpy.divide(total, count, out=pivot, where=count > 0)
+            store['arrays'][column] = (fingerprint, pivot, count > 0)
+
+        pivot, present = store['arrays'][column][1:]
+        index = store['cases']
+        if cases is not None:
+            cases = numpy.asarray(cases, dtype=int)
+            rows = numpy.searchsorted(index, cases)
+            found = rows < len(index)
+            found[found] = index[rows[found]] == cases[found]
+            if not found.all():
+                raise KeyError('Cases not in the source dataframe: {0}'.format(
+                    ', '.join([str(case) for case in cases[~found]])))
+            pivot = pivot[rows]
+            present = present[rows]
+            index = index[rows]
+
+        keep = present.any(axis=0)
+        return DataFrame(pivot[:, keep], index=Index(index, name='case'),
+                         columns=Index(store['poses'][keep], name='poses'))
+
+    def _commit_iteration(self, L0, run, cases, iteration, params, **kwargs):
+        """
+        Add the state of an optimizer iteration as new row to the DataFrame.
+        Additional column values are set using keyword arguments.
+
+        :return: DataFrame index of the new row
+        :rtype:  int
+        """
+
+        index = self.index.max()
+        if isnull(index):
+            index = -1
+
+        rowdict = {'L0': L0,
+                   'L1': run,
+                   'iteration': iteration,
+                   'set': cases,
+                   'N': len(cases),
+                   'converge': 1,
+                   'filter_mask': 1}
+        rowdict.update(kwargs)
+        rowdict.update(dict([(self.settings.param_labels[n], param) for n, param in enumerate(params)]))
+        self.loc[index + 1] = Series(rowdict)
+
+        return index + 1
+
+    def _commit_trace(self, index, params, rmsd, r2):
+        """
+        Store the parameter, rmsd and r-squared history of an optimizer run as
+        compact trace for the model at index if the keep_trace setting is True.
+        Otherwise a trace of a dropped model with the same index is removed.
+        """
+
+        traces = self._metadata.setdefault('traces', {})
+        if self.settings.keep_trace:
+            trace = DataFrame(params, columns=self.settings.param_labels)
+            trace.insert(0, 'iteration', range(len(trace)))
+            trace['rmsd'] = rmsd
+            trace['rsquared'] = r2
+            traces[index] = trace
+        else:
+            traces.pop(index, None)
+
+    def gettrace(self, index):
+        """
+        Return the optimizer iteration history of a model as DataFrame with
+        the iteration number, parameters, rmsd and r-squared for every iteration.
+        Only available for models build with the keep_trace setting enabled.
+
+        :param index: DataFrame index of the model
+        :ptype index: int
+        :return:      Iteration history or None
+        :rtype:       DataFrame
+        """
+
+        assert index in self.index.values, "No model with index {0} in LIEModelBuilder instance".format(index)
+        return self._metadata.get('traces', {}).get(index)
+
+    def _cached_run(self, optimizer, dataset, ref, rmodel, *args):
+        """
+        Return the outcome of an optimizer run from the shared result cache
+        or run the optimizer and cache the outcome.
+
+        The cache key is derived from the content of the input arrays, the
+        regression model and its parameters and the optimizer settings
+        (MODEL_CONTENT_SETTINGS). The cache is not used if the use_cache
+        setting is False or the cache is not enabled.
+
+        :param optimizer: optimizer run method called as
+                          optimizer(dataset, ref, rmodel, *args)
+        """
+
+        if not self.settings.use_cache or not pylie_cache.enabled:
+            return optimizer(dataset, ref, rmodel, *args)
+
+        key = self._run_key(optimizer.__name__, dataset, ref, rmodel, *args)
+        return pylie_cache.cached(key, optimizer, dataset, ref, rmodel, *args)
+
+    def _run_key(self, optimizer, dataset, ref, rmodel, *args):
+        """
+        Shared result cache key of an optimizer run
+
+        :param optimizer: name of the optimizer run method
+        :type optimizer:  :py:str
+        """
+
+        regressor = (rmodel.rmodeltype, getattr(rmodel, 'rmodelparams', None),
+                     getattr(getattr(rmodel, 'norm', None), '__name__', None))
+        return pylie_cache.key(optimizer, [numpy.asarray(data, dtype=float) for data in dataset], ref, args,
+                               regressor, [self.settings.get(setting) for setting in MODEL_CONTENT_SETTINGS])
+
+    def _finalize_run(self, L0, cases, best, fit, regressor, param_trace, rmsd_trace, r2_trace,
+                      check_oscillation=True):
+        """
+        Add the selected model of an iterative optimizer run to the DataFrame
+        as new run for label L0, run it through the filter and check the last
+        four iterations for oscillation.
+
+        :param best:        iteration of the selected model or None if the
+                            optimizer did not converge. The last iteration is
+                            added in that case.
+        :param fit:         regression results of the selected iteration
+        :param param_trace: parameters of all iterations, including the start
+                            parameters as iteration 0
+        :param rmsd_trace:  rmsd of all iterations
+        :param r2_trace:    r-squared of all iterations
+        :param check_oscillation: check the last four iterations for oscillation
+        :return:            DataFrame index of the model or None if not converged
+        """
+
+        # Init a new run
+        run = self.loc[self['L0'] == L0, 'L1'].max()
+        if isnull(run):
+            run = 0
+        run += 1
+
+        # Maximum number of iterations reached. Report, do not set filter_mask to 0
+        last = len(param_trace) - 1
+        if best is None:
+            last_index = self._commit_iteration(L0, run, cases, last, param_trace[last], fit=fit,
+                                                rmsd=rmsd_trace[last], rsquared=r2_trace[last], regressor=regressor,
+                                                converge=0)
+            self._commit_trace(last_index, param_trace, rmsd_trace, r2_trace)
+            logger.warn('not converged within {0} iterations'.format(self.settings.maxiter))
+            return
+
+        best_index = self._commit_iteration(L0, run, cases, best, param_trace[best], fit=fit, rmsd=rmsd_trace[best],
+                                            rsquared=r2_trace[best], regressor=regressor)
+        self._commit_trace(best_index, param_trace, rmsd_trace, r2_trace)
+
+        # Run through filter
+        if self.settings.usefilter:
+            if self._filter_result(self.loc[[best_index]]):
+                self.loc[best_index, 'filter_mask'] = 0
+                logger.info("Run {0}: iterations {1}, param {2}, SDEC {3:.3f}, R2 {4:.3f}".format(run, best,
+                    ' '.join(['{0:.3f}'.format(p) for p in fit.params]), rmsd_trace[best], r2_trace[best]))
+        else:
+            self.loc[best_index, 'filter_mask'] = 0
+
+        # Check for oscillation over the last 4 iterations and report.
+        if check_oscillation:
+            alpha_gradient, beta_gradient = _oscillation(param_trace)
+            if abs(alpha_gradient) > 0.001 or abs(beta_gradient) > 0.001:
+                self.loc[best_index, 'converge'] = 0
+                self.loc[best_index, 'filter_mask'] = 1
+                logger.warn(
+                    "Run {0}: oscillation detected over last 4 iterations. alpha gradient {1}, beta gradient {2}".format(
+                        run, alpha_gradient, beta_gradient))
+
+        # Return index of best model
+        return best_index
+
+    def _iterative_lie_optimizer(self, dataset, ref, rmodel=None, cases=None, L0=None, run=None):
         """
         Iteratively optimize the alpha, beta and/or gamma parameters for the LIE
         regression model.
@@ -388,117 +1447,231 @@ class LIEModelBuilder(LIEDataFrameBase):
         value (conv_cutoff) or when the maximum iteration treshold has been reached
         (maxiter). Convergence is always assessed over the last three iterations to
         prevent a false convergence in an oscilating system.
+
+        The fixed-point parameter sequence may be accelerated using Anderson mixing
+        or Aitken's delta-squared extrapolation (acceleration setting). Iteration
+        then stops as soon as the squared difference between the regression
+        parameters and the parameters used for Boltzmann weighting is below the
+        convergence cutoff value, that is when the fixed-point is reached.
+
+        The iteration history is kept in arrays. Only the selected model, or the
+        last iteration if not converged, is added to the DataFrame. The full
+        history is available using `gettrace` if the keep_trace setting is True.
+
+        The optimizer run is taken from the shared result cache if the same
+        data was optimized before using identical settings, or from the run
+        argument if already optimized elsewhere (see `_iterative_lie_run`).
+        """
+
+        # Add parameter columns to dataframe if needed
+        for param in self.settings.param_labels:
+            if not param in self.columns: self[param] = None
+
+        if run is None:
+            run = self._cached_run(self._iterative_lie_run, dataset, ref, rmodel)
+        best, fit, param_trace, rmsd_trace, r2_trace = run
+        return self._finalize_run(L0, cases, best, fit, rmodel.rmodeltype, param_trace, rmsd_trace, r2_trace,
+                                  check_oscillation=not self.settings.acceleration)
+
+    def _iterative_lie_run(self, dataset, ref, rmodel):
+        """
+        Fixed-point iteration of the `_iterative_lie_optimizer`, see the
+        module level `_iterative_lie_run`
+        """
+
+        return _iterative_lie_run(self.settings, dataset, ref, rmodel)
+
+    def _batch_lie_optimizer(self, dataset, ref, masks, rmodel=None, cases=None, labels=None):
+        """
+        Iteratively optimize the alpha, beta and/or gamma parameters for the
+        robust LIE regression models of many case subsets at once.
+
+        Uses the fixed-point iteration and rolling window convergence criterion
+        of `_iterative_lie_optimizer`. In every iteration the Boltzmann weighted
+        energies of all unconverged subsets are calculated together and
+        regressed using `stacked_irls`. Subsets drop out of the iteration as
+        soon as they converge.
+
+        :param dataset: energy terms as (cases x poses) arrays for all cases
+        :type dataset:  :py:list
+        :param ref:     reference affinity for all cases
+        :type ref:      :numpy:ndarray
+        :param masks:   boolean (subsets x cases) array of the cases in each subset
+        :type masks:    :numpy:ndarray
+        :param rmodel:  robust regression model
+        :type rmodel:   RLMregression
+        :param cases:   case ID's of each subset
+        :type cases:    :py:list
+        :param labels:  L0 label of each subset, the next free label (getlabel)
+                        at the time the model is added if not set
+        :type labels:   :py:list
+
+        :return:        DataFrame index of the model for each subset, None if
+                        not converged
+        :rtype:         :py:list
+        """
+
+        # Add parameter columns to dataframe if needed
+        for param in self.settings.param_labels:
+            if not param in self.columns: self[param] = None
+
+        runs = self._cached_run(self._batch_lie_run, dataset, ref, rmodel, masks)
+
+        models = []
+        for n, (best, fit, param_trace, rmsd_trace, r2_trace) in enumerate(runs):
+            label = labels[n] if labels else None
+            if not label:
+                label = self.getlabel()
+            models.append(self._finalize_run(label, cases[n], best, fit, rmodel.rmodeltype, param_trace, rmsd_trace,
+                                             r2_trace))
+
+        return models
+
+    def _batch_lie_run(self, dataset, ref, rmodel, masks):
+        """
+        Stacked fixed-point iteration of the `_batch_lie_optimizer`
+
+        :return: iteration of the selected model or None if not converged,
+                 its regression results and the parameter, rmsd and
+                 r-squared traces for each subset
+        :rtype:  :py:list
         """
 
         # Determine model params
+        data = numpy.array([numpy.asarray(d, dtype=float) for d in dataset])
         intercept = True
         if len(self.settings.def_params) <= len(dataset):
             intercept = False
-        weighted_data_labels = ['w_{0}'.format(l) for l in self.settings.model_cols]
+
+        def design(params, mask):
+            weighted = _boltzmann_weighted(data[:, mask], params, kBt=self.settings.kBt)
+            if intercept:
+                weighted = numpy.concatenate((weighted, numpy.ones(weighted.shape[:-1] + (1,))), axis=-1)
+            return weighted
+
+        # Iteration history buffers for all subsets, iteration 0 is the start situation
+        n_sets = len(masks)
+        maxiter = self.settings.maxiter
+        window_size = self.settings.window_size
+        theta = numpy.tile(numpy.array(self.settings.def_params, dtype=float), (n_sets, 1))
+        param_trace = numpy.full((n_sets, maxiter + 1, theta.shape[1]), numpy.nan)
+        rmsd_trace = numpy.full((n_sets, maxiter + 1), numpy.nan)
+        r2_trace = numpy.full((n_sets, maxiter + 1), numpy.nan)
+        param_trace[:, 0] = theta
+
+        nobs = masks.sum(axis=1)
+        ref_mean = numpy.where(masks, ref, 0).sum(axis=1) / nobs
+        ref_tss = numpy.where(masks, (ref - ref_mean[:, numpy.newaxis]) ** 2, 0).sum(axis=1)
+
+        best = numpy.zeros(n_sets, dtype=int)
+        last = numpy.full(n_sets, maxiter)
+        active = numpy.ones(n_sets, dtype=bool)
+        all_cases = numpy.ones(len(ref), dtype=bool)
+        for i in range(1, maxiter + 1):
+
+            idx = numpy.flatnonzero(active)
+            if not len(idx):
+                break
+
+            variables = design(theta[idx], all_cases)
+            params = stacked_irls(ref, variables, masks[idx], norm=rmodel.norm)[0]
+            resid = numpy.where(masks[idx], ref - numpy.einsum('snp,sp->sn', variables, params), 0)
+            ssr = (resid ** 2).sum(axis=1)
+
+            param_trace[idx, i] = params
+            rmsd_trace[idx, i] = numpy.sqrt(ssr / nobs[idx])
+            r2_trace[idx, i] = 1 - ssr / ref_tss[idx]
+            theta[idx] = params
+
+            # Rolling window convergence check for each subset
+            if i < window_size:
+                continue
+            window_diff = (params.sum(axis=1) - param_trace[idx, i - window_size].sum(axis=1)) / window_size
+            for n in idx[window_diff ** 2 < self.settings.conv_cutoff]:
+                best[n] = i - numpy.nanargmin(rmsd_trace[n, i - window_size + 1:i + 1][::-1])
+                last[n] = i
+                active[n] = False
+
+        # Regression results for the selected iteration of each subset
+        runs = []
+        for n in range(n_sets):
+            iteration = best[n] or last[n]
+            rmodel.set(ref[masks[n]], design(param_trace[n, iteration - 1][numpy.newaxis], masks[n])[0])
+            results = rmodel.fit()
+            results.intercept = intercept
+
+            runs.append((best[n] or None, results, param_trace[n, :last[n] + 1], rmsd_trace[n, :last[n] + 1],
+                         r2_trace[n, :last[n] + 1]))
+
+        return runs
+
+    def _nls_lie_optimizer(self, dataset, ref, rmodel=None, cases=None, L0=None, run=None):
+        """
+        Optimize the alpha, beta and/or gamma parameters for the LIE regression
+        model by direct nonlinear least-squares.
+
+        Rather than alternating Boltzmann reweighting and linear regression,
+        the Boltzmann weighted LIE equation is fitted directly using the
+        Levenberg-Marquardt ('lm') or Gauss-Newton ('gn') algorithm with an
+        analytical Jacobian. A step is only accepted when it lowers the sum of
+        squared residuals so the optimizer can not oscillate.
+
+        The regression model defines the loss: RLM uses robust weights of its
+        M-estimator recomputed at every step from a MAD scale estimate, WLS
+        uses its case weights and all others ordinary least-squares.
+        At convergence the regression model is fitted to the Gauss-Newton
+        linearisation of the LIE equation at the optimum to obtain the
+        regression results for the final model.
+
+        Iteration stops when the squared parameter step is below the
+        convergence cutoff value (conv_cutoff) or when the maximum iteration
+        threshold has been reached (maxiter).
+
+        The optimizer run is taken from the shared result cache if the same
+        data was optimized before using identical settings, or from the run
+        argument if already optimized elsewhere (see `_nls_lie_run`).
+        """
 
         # Add parameter columns to dataframe if needed
         for param in self.settings.param_labels:
             if not param in self.columns: self[param] = None
 
+        if run is None:
+            run = self._cached_run(self._nls_lie_run, dataset, ref, rmodel)
+        i, converged, results, param_trace, rmsd_trace, r2_trace = run
+
         # Init a new run
         run = self.loc[self['L0'] == L0, 'L1'].max()
         if isnull(run):
             run = 0
         run += 1
 
-        # Add iteration 0 to the DataFrame, this is the start situation
-        index = self.index.max()
-        if str(index) == 'nan':
-            index = -1
-        rowdict = {'L0': L0,
-                   'L1': run,
-                   'iteration': 0,
-                   'set': cases,
-                   'N': len(cases),
-                   'converge': 0,
-                   'filter_mask': 1}
-        rowdict.update(dict([(self.settings.param_labels[i], param) for i, param in enumerate(self.settings.def_params)]))
-        self.loc[index + 1] = Series(rowdict)
-
-        # Start iteration
-        for i in range(1, self.settings.maxiter + 1):
+        best_index = self._commit_iteration(L0, run, cases, i, results.params, fit=results,
+                                            rmsd=sdec(ref, results.predict()), rsquared=results.rsquared,
+                                            regressor=rmodel.rmodeltype, converge=int(converged))
+        self._commit_trace(best_index, param_trace, rmsd_trace, r2_trace)
 
-            # Load state at previous iteration step.
-            prev_theta = self.loc[index + i][self.settings.param_labels].values
+        # Maximum number of iterations reached. Report, do not set filter_mask to 0
+        if not converged:
+            logger.warn('not converged within {0} iterations'.format(self.settings.maxiter))
+            return
 
-            # Get weighted energies using active theta.
-            Wenergies = lie_deltag(dataset, params=prev_theta, data_labels=self.settings.model_cols, kBt=self.settings.kBt)
+        # Run through filter
+        if not self.settings.usefilter or self._filter_result(self.loc[[best_index]]):
+            self.loc[best_index, 'filter_mask'] = 0
+            logger.info("Run {0}: iterations {1}, param {2}, SDEC {3:.3f}, R2 {4:.3f}".format(run, i,
+                ' '.join(['{0:.3f}'.format(p) for p in results.params]), self.loc[best_index, 'rmsd'],
+                self.loc[best_index, 'rsquared']))
 
-            # Calculate the regression model
-            if intercept:
-                variables = numpy.column_stack((Wenergies[weighted_data_labels].values, numpy.ones((len(cases), 1))))
-            else:
-                variables = Wenergies[weighted_data_labels].values
+        return best_index
 
-            rmodel.set(ref, variables)
-            results = rmodel.fit()
-            results.intercept = intercept
-            irmsd = sdec(ref, results.predict())
-            ir2 = 1 - (sum(numpy.square(results.resid)) / tss(ref))
-
-            # Add new iteration to the DataFrame
-            rowdict = {'L0': L0,
-                       'L1': run,
-                       'iteration': i,
-                       'fit': results,
-                       'rmsd': irmsd,
-                       'rsquared': ir2,
-                       'regressor': rmodel.rmodeltype,
-                       'set': cases,
-                       'N': len(cases),
-                       'converge': 1,
-                       'filter_mask': 1}
-            rowdict.update(dict([(self.settings.param_labels[n], param) for n, param in enumerate(results.params)]))
-            self.loc[index + i + 1] = Series(rowdict)
-            logger.debug("Iteration {0}: param {1}, SDEC {2:.3f}, R2 {3:.3f}".format(i, ' '.join(
-                ['{0:.3f}'.format(p) for p in results.params]), irmsd, ir2))
-
-            # Check for convergence in regression parameters usign a rolling window
-            # average over the last X iterations.
-            # On convergence, pick case with lowest RSD
-            # Do check for oscillation and report.
-            window = (self.loc[self['L1'] == run, self.settings.param_labels]).sum(axis=1).rolling(
-                window=self.settings.window_size).mean()
-            if (window.loc[index + i + 1] - window.loc[index + i]) ** 2 < self.settings.conv_cutoff:
-
-                convsel = self.iloc[index + i - self.settings.window_size + 2:index + i + 2]
-                best = convsel[convsel['rmsd'] == convsel['rmsd'].min()].tail(1)
-                best_index = best.index.values[0]
-
-                # Run through filter
-                if self.settings.usefilter:
-                    if self._filter_result(best):
-                        self.loc[best.index.values, 'filter_mask'] = 0
-                        logger.info("Run {0}: iterations {1}, param {2}, SDEC {3:.3f}, R2 {4:.3f}".format(run,
-                            best.at[best_index, 'iteration'], ' '.join(['{0:.3f}'.format(p) for p in
-                            best.at[best_index, 'fit'].params]), best.at[best_index, 'rmsd'],
-                            best.at[best_index, 'rsquared']))
-                else:
-                    self.loc[best.index.values, 'filter_mask'] = 0
-
-                # Check for oscillation over the last 4 iterations
-                tail = self[self['L1'] == run].tail(4)
-                alpha_gradient = numpy.mean(numpy.gradient(tail['alpha']))
-                beta_gradient = numpy.mean(numpy.gradient(tail['beta']))
-                if abs(alpha_gradient) > 0.001 or abs(beta_gradient) > 0.001:
-                    self.loc[best_index, 'converge'] = 0
-                    self.loc[best_index, 'filter_mask'] = 1
-                    logger.warn(
-                        "Run {0}: oscillation detected over last 4 iterations. alpha gradient {1}, beta gradient {2}".format(
-                            run, alpha_gradient, beta_gradient))
-
-                # Return index of best model
-                return best_index
+    def _nls_lie_run(self, dataset, ref, rmodel):
+        """
+        Nonlinear least-squares fit of the `_nls_lie_optimizer`, see the
+        module level `_nls_lie_run`
+        """
 
-        # Maximum number of iterations reached. Report, do not set filter_mask to 0
-        if i == self.settings.maxiter:
-            self.loc[index + i + 1, 'converge'] = 0
-            logger.warn('not converged within {0} iterations'.format(self.settings.maxiter))
+        return _nls_lie_run(self.settings, dataset, ref, rmodel)
 
     def _parse_to_list(self, indexes):
         """
@@ -516,6 +1689,57 @@ class LIEModelBuilder(LIEDataFrameBase):
 
         return indexes
 
+    def case_membership(self, index=None):
+        """
+        Case membership of models as packed bit array
+
+        Bit j of the row of a model is set if case j of the LIEDataFrame, in
+        sorted case ID order, is in the case set of the model. Use
+        `_unpack_case_sets` with the number of cases to obtain the boolean
+        membership matrix. Packed rows are kept by case set, so
+        a new model reusing the index of a dropped one is packed again.
+
+        :param index: model index or list of model indexes, all models by
+                      default
+        :type index:  int or list of ints
+        :return:      sorted case ID's and (models x ceil(cases / 8)) uint8
+                      array
+        :rtype:       :py:tuple
+        """
+
+        if index is None:
+            index = self.index.values
+        elif not isinstance(index, (list, tuple, numpy.ndarray)):
+            index = [index]
+
+        cases = numpy.asarray(self.dataframe.cases, dtype=int)
+        store = self._metadata.get('case_bits')
+        if store is None or not numpy.array_equal(store['cases'], cases):
+            store = {'cases': cases, 'rows': {}}
+            self._metadata['case_bits'] = store
+
+        sets = [tuple(case_set) for case_set in self.loc[index, 'set']]
+        missing = list(set([case_set for case_set in sets if case_set not in store['rows']]))
+        if missing:
+            store['rows'].update(zip(missing, _pack_case_sets(cases, missing)))
+
+        bits = numpy.array([store['rows'][case_set] for case_set in sets], dtype=numpy.uint8)
+        return cases, bits.reshape(len(index), (len(cases) + 7) // 8)
+
+    def _case_union(self, index):
+        """
+        Packed union of the case sets of the models selected by index, see
+        `_parse_to_list`.
+        """
+
+        cases, bits = self.case_membership(list(self._parse_to_list(index)))
+        return cases, numpy.bitwise_or.reduce(bits, axis=0)
+
+    @staticmethod
+    def _unpack_cases(cases, bits):
+
+        return cases[_unpack_case_sets(bits, len(cases))].tolist()
+
     def get_cases(self, index=None):
         """
         Return cases for one or more models by index as a list
@@ -532,11 +1756,7 @@ class LIEModelBuilder(LIEDataFrameBase):
         :return:      List or None
         """
 
-        superset = []
-        for idx in self._parse_to_list(index):
-            superset.extend(self.loc[idx, 'set'])
-
-        return sorted(set(superset))
+        return self._unpack_cases(*self._case_union(index))
 
     def get_base(self, index):
         """Get the base model for a model derivative"""
@@ -552,18 +1772,18 @@ class LIEModelBuilder(LIEDataFrameBase):
     def issubset(self, first, second):
         """Is every case in the first also in the second (subset)"""
 
-        first = self.get_cases(first)
-        second = self.get_cases(second)
+        first = self._case_union(first)[1]
+        second = self._case_union(second)[1]
 
-        return set(first).issubset(set(second))
+        return not numpy.any(first & ~second)
 
     def issuperset(self, first, second):
         """Is every case in the second also in the first (superset)"""
 
-        first = self.get_cases(first)
-        second = self.get_cases(second)
+        first = self._case_union(first)[1]
+        second = self._case_union(second)[1]
 
-        return set(first).issuperset(set(second))
+        return not numpy.any(second & ~first)
 
     def union(self, collection):
         """Return list of the cases in the input collection combined"""
@@ -573,22 +1793,35 @@ class LIEModelBuilder(LIEDataFrameBase):
     def intersection(self, first, second):
         """Return list with cases common to both first and second"""
 
-        first = self.get_cases(first)
-        second = self.get_cases(second)
+        cases, first = self._case_union(first)
+        second = self._case_union(second)[1]
 
-        return sorted(set(first).intersection(set(second)))
+        return self._unpack_cases(cases, first & second)
 
     def difference(self, first, second, symmetric=False):
         """Return list with cases in first but not in second or with cases in
            either the first or the second but not in both if symmetric equals True
         """
 
-        first = self.get_cases(first)
-        second = self.get_cases(second)
+        cases, first = self._case_union(first)
+        second = self._case_union(second)[1]
 
         if symmetric:
-            return sorted(set(first).symmetric_difference(set(second)))
-        return sorted(set(first).difference(set(second)))
+            return self._unpack_cases(cases, first ^ second)
+        return self._unpack_cases(cases, first & ~second)
+
+    def duplicates(self):
+        """
+        Return indexes of models with a case set identical to that of a model
+        earlier in the DataFrame
+        """
+
+        bits = self.case_membership()[1]
+        first = numpy.unique(bits, axis=0, return_index=True)[1]
+        unique = numpy.zeros(len(bits), dtype=bool)
+        unique[first] = True
+
+        return list(self.index.values[~unique])
 
         # (Re)sampling functions
 
@@ -631,57 +1864,80 @@ class LIEModelBuilder(LIEDataFrameBase):
         """
         MonteCarlo like resampling of a cluster aimed on enlarging the cluster
         within the limits defined by the filter criteria.
+
+        Starting from the robust (RLM) model of the cluster, every move adds a
+        random sample of superset cases to the cluster and accepts the
+        enlarged cluster if the RLM model passes the filter. Cases that are
+        down weighted or rejected are less likely to be drawn again.
+
+        The moves run on arrays of case inclusion masks, case weights and
+        selected poses (see `_mcresample_chain`). Only the model of the last
+        accepted move is added to the DataFrame. The mc_chains setting runs
+        independent chains, seeded from the mc_seed setting, using nproc
+        worker processes.
+
+        With the warm_start setting (off by default), every move is optimized
+        starting from the parameters of the last accepted model. The
+        def_params and filter settings are restored afterwards, also if
+        resampling fails.
+
+        The case weights of all accepted moves are written to
+        tracker_model_<index>.csv and, if posestore, the pose with the
+        highest probability for every case to poses_model_<index>.csv.
+
+        As intermediate moves are not added to the DataFrame as models, these
+        files do not refer to a model index for every move:
+
+        * the tracker has a row for the source model and for every accepted
+          move of every chain, with a 'chain' column and a column for every
+          model parameter. The 'mid' column only identifies the source model
+          and the last accepted model of a chain, it is empty for the other
+          moves.
+        * the pose file is indexed by case and has a '<chain>.<move>' column
+          for every accepted move, rather than a column per model index.
+
+        :param index:     DataFrame index of the model to resample
+        :type index:      int
+        :param superset:  model index(es) defining the cases to draw from, all
+                          cases by default
+        :param posestore: write the selected poses of accepted moves to file
+        :type posestore:  bool
+        :return:          cluster cases of the chain with the largest cluster
+        :rtype:           list
         """
 
         # Update class settings from kwargs dict
         self.settings.update(kwargs)
 
+        def_params = self.settings.def_params
+        rmsd_filter = self.settings.filter['rmsd']
+        rsquared_filter = self.settings.filter['rsquared']
+        try:
+            return self._mcresample(index, superset=superset, posestore=posestore)
+        finally:
+            # Reset filter and start parameters to original values
+            self.settings.filter['rmsd'] = rmsd_filter
+            self.settings.filter['rsquared'] = rsquared_filter
+            self.settings['def_params'] = def_params
+
+    def _mcresample(self, index, superset=None, posestore=True):
+        """
+        Resample the cluster of the model at index, see `mcresample`. Changes
+        the def_params and filter settings.
+        """
+
         # Get cases for source- and superset. If superset equals None, all cases in the dataset are used
         superset = self.get_cases(superset)
         sourceset = self.get_cases(index)
 
-        # DataFrame to keep track of case weights during optimization
-        columns = ['mid', 'rmsd', 'rsquared', 'alpha', 'beta'] + sorted(superset)
-        tracker = DataFrame(columns=columns)
-
-        # Dataframe to keep track of poses with highest weight during optimization
-        if posestore:
-            poserecord = DataFrame(columns=['cases'])
-            poserecord['cases'] = self.dataframe.cases
-
-        def poserecord_update(model):
-
-            selected_poses = []
-            for ida, a in model[model.get_columns('prob-*')].iterrows():
-                m = a.idxmax()
-                selected_poses.append(int(m[-1]))
-
-            poserecord[model.mid] = 0
-            for p in zip(selected_poses, model.cases):
-                poserecord.loc[(poserecord['cases'] == p[1]), model.mid] = p[0]
-
-        def tracker_update(model):
-
-            rowdict = {'mid': model.mid, 'rmsd': model.rmsd, 'rsquared': model.rsquared, 'alpha': model.model.params[0],
-                       'beta': model.model.params[1]}
-            cases = list(model['case'].values)
-            weights = list(model['weights'].values)
-            rowdict.update(dict(zip(cases, weights)))
-
-            if not len(tracker.index):
-                idx = 1
-            else:
-                idx = max(tracker.index) + 1
-
-            tracker.loc[idx] = Series(rowdict)
-
         # First get the RLM weights of the source set
         label = self.loc[index, 'L0']
         if self.loc[index, 'regressor'] != 'RLM':
+            self._warm_start(index)
             rlm_model = self.model(rmodel=RLMregression(), label=label, cases=sourceset)
         else:
             rlm_model = self.getmodel(index)
-        tracker_update(rlm_model)
+        self._warm_start(rlm_model.mid)
 
         # Set the rmsd and rsquare filter rules to match base model stats increased by mc_filter_tol
         # to give room to improve up to original filter cutoff's
@@ -696,8 +1952,6 @@ class LIEModelBuilder(LIEDataFrameBase):
         if new_rsquared_cutoff <= orig_rsquared_filter[0]:
             new_rsquared_cutoff = orig_rsquared_filter[0]
 
-        self.settings.filter['rmsd'] = [orig_rmsd_filter[0], new_rmsd_cutoff]
-        self.settings.filter['rsquared'] = [new_rsquared_cutoff, orig_rsquared_filter[1]]
         logger.warn("Initial filter rules: rmsd = {0:.3f}-{1:.3f}, r-squared = {2:.3f}-{3:.3f}".format(
             orig_rmsd_filter[0], new_rmsd_cutoff, new_rsquared_cutoff, orig_rsquared_filter[1]))
 
@@ -708,125 +1962,90 @@ class LIEModelBuilder(LIEDataFrameBase):
         superset.extend(downweight)
         logger.warn("RLM outlier in source set (<= {0:.2f}): {1}".format(self.settings.rlm_outlier_cutoff, downweight))
 
-        # iterate through superset as long as there are elements in it or max_iter_steps reached
-        baseset = rlm_model[rlm_model['weights'] > self.settings.rlm_outlier_cutoff].cases
-        iteration = 0
-        removed = []
-        latest_model = rlm_model.mid
-        no_model_count = 0
-        while len(superset) and iteration < self.settings.max_iter_steps:
-
-            iteration += 1
-
-            # - Ajust propensity for drawing new sample based on outlier count
-            if len(removed):
-                propensities = [1 - (removed.count(case) / float(len(removed))) for case in superset]
-                prop_sum = sum(propensities)
-                propensities = [p / prop_sum for p in propensities]
-            else:
-                propensities = [1.0 / len(superset)] * len(superset)
-
-            # - Draw random sample
-            sample_size = int(len(baseset) * self.settings.mc_rand_sample_draw)
-            sample = list(choice(superset, size=sample_size, p=propensities, replace=False))
-            logger.debug("Draw sample of {0} cases: {1}".format(sample_size, str(sample).strip('[]')))
-
-            # - RLM model using the new baseset
-            model = self.model(rmodel=RLMregression(), label=label, cases=baseset + sample)
-
-            # - Check if we get a model back
-            if type(model) != type(None):
-                ref = model.trainset['ref_affinity'].values
-                rmsd = sdec(ref, model.model.predict())
-                r2 = 1 - (sum(numpy.square(model.model.resid)) / tss(ref))
-
-                # - Get down weighted cases
-                dw = model.trainset[model.trainset['weights'] <= self.settings.rlm_outlier_cutoff].cases
-                adj_sample = [n for n in sample if not n in dw]
-
-                # - If all are downweighted, continue
-                if not len(adj_sample):
-                    removed.extend(sample)
-                    continue
-
-                # - If there are down-weighted cases in the sample, rerun RLM without them.
-                if len(adj_sample) != len(sample):
-
-                    model = self.model(rmodel=RLMregression(), label=label, cases=baseset + adj_sample)
-                    if type(model) == type(None):
-                        continue
-
-                    dw = model.trainset[model.trainset['weights'] <= self.settings.rlm_outlier_cutoff].cases
-                    ref = model.trainset['ref_affinity'].values
-                    rmsd = sdec(ref, model.model.predict())
-                    r2 = 1 - (sum(numpy.square(model.model.resid)) / tss(ref))
-
-                # - Check if filter rules are passed
-                if model.filterpass == 0:
-
-                    tracker_update(model)
-
-                    # - Track significant poses
-                    if posestore:
-                        poserecord_update(model)
-
-                    # - Register model and reset no_model_count
-                    latest_model = model.mid
-                    no_model_count = 0
-
-                    # - Add down weighted cases to removed
-                    removed.extend(dw)
-
-                    # - Model passed, register new baseset and correct removed
-                    baseset = list(set(baseset + adj_sample))
-                    superset = [c for c in superset if not c in baseset]
-                    removed = [r for r in removed if not r in baseset]
-
-                    # - Adjust filter criteria
-                    new_rmsd_cutoff = rmsd * (2 - self.settings.mc_filter_tol)
-                    if new_rmsd_cutoff >= orig_rmsd_filter[1]:
-                        new_rmsd_cutoff = orig_rmsd_filter[1]
-                    elif new_rmsd_cutoff <= self.settings.filter['rmsd'][1]:
-                        new_rmsd_cutoff = self.settings.filter['rmsd'][1]
-
-                    new_rsquared_cutoff = r2 * self.settings.mc_filter_tol
-                    if new_rsquared_cutoff <= orig_rsquared_filter[0]:
-                        new_rsquared_cutoff = orig_rsquared_filter[0]
-                    elif new_rsquared_cutoff >= self.settings.filter['rsquared'][0]:
-                        new_rsquared_cutoff = self.settings.filter['rsquared'][0]
-
-                    self.settings.filter['rmsd'] = [orig_rmsd_filter[0], new_rmsd_cutoff]
-                    self.settings.filter['rsquared'] = [new_rsquared_cutoff, orig_rsquared_filter[1]]
-                    logger.warn("New filter criteria for rmsd ({0:.3f}-{1:.3f}) and r-squared ({2:.3f}-{3:.3f})".format(
-                        orig_rmsd_filter[0], new_rmsd_cutoff, new_rsquared_cutoff, orig_rsquared_filter[1]))
-
-                    logger.warn(
-                        "MonteCarlo optimize: iteration {0}, rmsd: {1:.3f}, r-squared: {2:.3f}. Baseset: {3}, superset: {4} sample size: {5}".format(
-                            iteration, rmsd, r2, len(baseset), len(superset), sample_size))
+        # Energy terms and reference affinity of all cases in model frame order
+        data = numpy.array([self._pivot_cases(column).values for column in self.settings.model_cols])
+        ref = self._pivot_cases('ref_affinity')
+        cases = ref.index.values
+        ref = ref.mean(axis=1).values
 
-                else:
-                    removed.extend(adj_sample)
-                    no_model_count += 1
-                    if no_model_count >= 20:
-                        logger.warn("Unable to improve model after {0} unsuccessful sample additions. Stopping".format(
-                            no_model_count))
-                        break
-
-        # Reset filter to original values
-        self.settings.filter['rmsd'] = orig_rmsd_filter
-        self.settings.filter['rsquared'] = orig_rsquared_filter
+        baseset = rlm_model[rlm_model['weights'] > self.settings.rlm_outlier_cutoff].cases
+        base = numpy.in1d(cases, baseset)
+        candidates = numpy.in1d(cases, superset)
 
-        logger.warn(
-            "MC optimization finished: baseset {0}, superset {1}, rmsd {2:.3f} r-squared {3:.3f}".format(len(baseset),
-            len(superset), self.loc[latest_model, 'rmsd'], self.loc[latest_model, 'rsquared']))
+        if self.settings.optimizer == 'iterative':
+            run, optimizer = _iterative_lie_run, self._iterative_lie_optimizer
+        else:
+            run, optimizer = _nls_lie_run, self._nls_lie_optimizer
+
+        nchains = self.settings.mc_chains
+        seeds = numpy.random.RandomState(self.settings.mc_seed).randint(2 ** 31 - 1, size=nchains)
+        tasks = [(run, self.settings, data, ref, base, candidates, (new_rmsd_cutoff, new_rsquared_cutoff), seed)
+                 for seed in seeds]
+        if nchains > 1 and self.settings.nproc > 1:
+            logger.info("Run {0} MonteCarlo chains using {1} worker processes".format(nchains, self.settings.nproc))
+            pool = multiprocessing.Pool(min(self.settings.nproc, nchains))
+            try:
+                chains = pool.map(_mcresample_chain, tasks)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            chains = [_mcresample_chain(task) for task in tasks]
+
+        # Add the last accepted model of every chain using the filter rules it
+        # was accepted with
+        trackers = []
+        poserecords = []
+        latest_models = []
+        for n, chain in enumerate(chains):
+
+            latest_model = rlm_model.mid
+            if chain['last'] is not None:
+                outcome, mask, (rmsd_filter, rsquared_filter) = chain['last']
+                self.settings.filter['rmsd'] = rmsd_filter
+                self.settings.filter['rsquared'] = rsquared_filter
+                latest_model = optimizer([d[:, ~numpy.isnan(d).all(axis=0)] for d in data[:, mask]], ref[mask],
+                                         rmodel=RLMregression(), cases=list(cases[mask]), L0=label, run=outcome)
+            latest_models.append(latest_model)
+
+            logger.warn(
+                "MC optimization chain {0} finished: baseset {1}, superset {2}, rmsd {3:.3f} r-squared {4:.3f}".format(
+                    n, chain['base'].sum(), chain['superset'].sum(), self.loc[latest_model, 'rmsd'],
+                    self.loc[latest_model, 'rsquared']))
+
+            # Source model followed by the accepted moves
+            tracker = DataFrame(numpy.vstack([rlm_model['weights'].values, chain['weights']]), columns=cases)
+            stats = numpy.vstack([[rlm_model.rmsd, rlm_model.rsquared] + list(rlm_model.model.params), chain['stats']])
+            for i, column in enumerate(['rmsd', 'rsquared'] + self.settings.param_labels):
+                tracker.insert(i, column, stats[:, i])
+            tracker.insert(0, 'mid', numpy.nan)
+            tracker.loc[0, 'mid'] = rlm_model.mid
+            tracker.iloc[-1, 0] = latest_model
+            tracker.insert(0, 'chain', n)
+            trackers.append(tracker)
+
+            poserecords.append(DataFrame(chain['poses'].T, index=Index(cases, name='cases'),
+                                         columns=['{0}.{1}'.format(n, move + 1) for move in range(len(chain['poses']))]))
 
         logger.info("Safe tracker dataframe to file")
-        tracker.to_csv('tracker_model_{0}.csv'.format(index))
+        concat(trackers, ignore_index=True).to_csv('tracker_model_{0}.csv'.format(index))
 
         if posestore:
-            poserecord.to_csv('poses_model_{0}.csv'.format(index))
+            concat(poserecords, axis=1).to_csv('poses_model_{0}.csv'.format(index))
 
-        return baseset
+        # Cluster of the chain with the largest cluster, lowest rmsd first
+        best = min(range(nchains), key=lambda n: (-chains[n]['base'].sum(), self.loc[latest_models[n], 'rmsd']))
+        return list(cases[chains[best]['base']])
+
+    def _warm_start(self, index):
+        """
+        Use the parameters of the model at index as start parameters for the
+        optimizer if the warm_start setting is True.
+        """
+
+        if self.settings.warm_start:
+            self.settings['def_params'] = [float(param) for param in self.loc[index, 'fit'].params]
 
     def rlm_optimize(self, index, **kwargs):
         """
@@ -872,7 +2091,7 @@ class LIEModelBuilder(LIEDataFrameBase):
         :param index:   DataFrame index of model to resample
         :ptype index:   int
         :param cvtype:  Cross-validation method to use. Default 'LOO' (Leave-One-Out)
-                        For other option see the cv_set_partitioner method.
+                        For other option see the cv_partitions method.
         :ptype cvtype:  string
         :return:        None, resampled moddels added to class dataframe
         """
@@ -882,9 +2101,8 @@ class LIEModelBuilder(LIEDataFrameBase):
         model = self.iloc[index]
         self.settings['label'] = model['L0']
 
-        # Create Cross-validation partition table
-        cvmatrix = cv_set_partitioner(model['set'], cvtype=cvtype)
-        self.batchmodel(cvmatrix)
+        # Model the training sets of the cross-validation partitions
+        self.batchmodel(partitions=cv_partitions(model['set'], cvtype=cvtype), cases=model['set'])
 
     def weight_resample(self, index):
         """
@@ -922,22 +2140,68 @@ class LIEModelBuilder(LIEDataFrameBase):
         return list(clusters[clusters.sum(axis=1) == 0].index.values)
 
     def clusters(self):
-        master_lst = dict([(i, n['set']) for i, n in self.iterrows()])
+        """
+        Subset relations between the case sets of all models
 
-        cluster_list = defaultdict(list)
-        for idd in master_lst:
-            for ids in master_lst:
-                if not idd == ids:
-                    if set(master_lst[ids]).issubset(set(master_lst[idd])):
-                        cluster_list[idd].append(ids)
+        :return: square DataFrame with value 1 in row i, column j if the
+                 case set of model i is a subset of that of model j
+        :rtype:  DataFrame
+        """
+
+        cases, bits = self.case_membership()
+        members = _unpack_case_sets(bits, len(cases)).astype(numpy.float32)
+
+        # Model i is a subset of model j if all of its cases are shared with j
+        shared = members.dot(members.T)
+        subset = shared == members.sum(axis=1)[:, numpy.newaxis]
+        numpy.fill_diagonal(subset, False)
 
-        keys = self.index
-        cluster_matrix = DataFrame(columns=keys, index=keys)
-        for i, n in cluster_list.items():
-            cluster_matrix.loc[n, i] = 1
-        cluster_matrix.fillna(0, inplace=True)
+        return DataFrame(subset.astype(int), index=self.index, columns=self.index)
+
+    def model_similarity(self):
+        """
+        Custom distance metric between all models as used to cluster final
+        models.
+
+        The distance between two models is the mean of three normalized
+        differences:
+
+        - the symmetric difference of the case sets relative to their union,
+          each case weighted by one minus its frequency of occurrence in all
+          models. The frequency assumes that the base set was constructed
+          using a homogeneous sampling.
+        - the alpha and the beta differences, each relative to the sum of
+          the differences of both models with the parameter of the model
+          with the most cases.
+
+        :return: square DataFrame of distances between models in order of
+                 increasing rmsd
+        :rtype:  DataFrame
+        """
 
-        return cluster_matrix
+        order = numpy.argsort(self['rmsd'].values.astype(float), kind='mergesort')
+        cases, bits = self.case_membership(list(self.index.values[order]))
+        members = _unpack_case_sets(bits, len(cases)).astype(float)
+
+        # Case set difference as weighted popcounts of the symmetric difference
+        # and the union of the case sets.
+        case_weight = 1 - members.mean(axis=0)
+        weighted = members.dot(case_weight)
+        shared = (members * case_weight).dot(members.T)
+        symmetric = weighted[:, numpy.newaxis] + weighted - 2 * shared
+        union = symmetric + shared
+        setdiff = numpy.divide(symmetric, union, out=numpy.zeros_like(symmetric), where=symmetric > 0)
+
+        # Alpha and beta differences relative to the model with most cases
+        params = self[['alpha', 'beta']].values.astype(float)[order]
+        parmax = self[['alpha', 'beta']].values.astype(float)[numpy.argmax(self['N'].values)]
+        gdiff = numpy.abs(parmax - params)
+        pardiff = numpy.abs(params[:, numpy.newaxis] - params)
+        total = gdiff[:, numpy.newaxis] + gdiff
+        pardiff = numpy.divide(pardiff, total, out=numpy.zeros_like(pardiff), where=total > 0).sum(axis=2)
+
+        index = self.index.values[order]
+        return DataFrame((setdiff + pardiff) / 3, index=index, columns=index)
 
     def getmodel(self, index, **kwargs):
         assert index in self.index.values, "No model with index {0} in LIEModelBuilder instance".format(index)
@@ -950,13 +2214,17 @@ class LIEModelBuilder(LIEDataFrameBase):
 
         # Recalculate deltaG values for all cases using the model parameters of the
         # current regression model. Create a new LIEModelFrame of the dataset.
-        exog = [self._pivot_data(self.dataframe, column) for column in self.settings.model_cols]
-        dg_calc = lie_deltag(exog, params=modelfit.params, kBt=self.settings.kBt)
+        exog = [self._pivot_cases(column) for column in self.settings.model_cols]
+        if self.settings.use_cache and pylie_cache.enabled:
+            key = pylie_cache.key('lie_deltag', exog, modelfit.params, self.settings.kBt)
+            dg_calc = pylie_cache.cached(key, lie_deltag, exog, params=modelfit.params, kBt=self.settings.kBt)
+        else:
+            dg_calc = lie_deltag(exog, params=modelfit.params, kBt=self.settings.kBt)
         modelframe = LIEModelFrame(dg_calc)
 
         # Add reference affinity, filter mask data and set the training mask
-        modelframe['ref_affinity'] = self._pivot_data(self.dataframe, 'ref_affinity').mean(axis=1).values
-        modelframe['filter_mask'] = self._pivot_data(self.dataframe, 'filter_mask').mean(axis=1).values
+        modelframe['ref_affinity'] = self._pivot_cases('ref_affinity').mean(axis=1).values
+        modelframe['filter_mask'] = self._pivot_cases('filter_mask').mean(axis=1).values
         modelframe['train_mask'] = 0
         modelframe.trainset = model['set']
 
@@ -977,24 +2245,144 @@ class LIEModelBuilder(LIEDataFrameBase):
 
         return modelframe
 
-    def batchmodel(self, clusterset, rmodel=OLSregression(), **kwargs):
+    def batchmodel(self, clusterset=None, rmodel=OLSregression(), partitions=None, cases=None, **kwargs):
+        """
+        Build a model for every cluster of cases in the cluster set or for the
+        training set of every cross-validation partition.
+
+        Robust (RLM) models build using the iterative optimizer without
+        acceleration are optimized together using stacked IRLS regression.
+        Other models are build in parallel by nproc worker processes.
+
+        :param clusterset: DataFrame with a 'case' column and a column for
+                           every cluster with value 1 for the member cases
+        :ptype clusterset: DataFrame
+        :param rmodel:     Class representing the regression algorithm to use.
+        :param partitions: (train, test) index arrays into cases of every
+                           partition as generated by `cv_partitions`, used
+                           instead of a cluster set. The partition number is
+                           the cluster label.
+        :ptype partitions: iterable
+        :param cases:      case ID's the partition indices refer to
+        :ptype cases:      :py:list
+        """
+
         # Update class settings from kwargs dict
         self.settings.update(kwargs)
 
-        for cluster in [col for col in clusterset.columns if not col == 'case']:
+        if partitions is not None:
+            cases = numpy.asarray(cases)
+            members = [(cluster, cases[numpy.sort(train)].tolist()) for cluster, (train, test) in enumerate(partitions)]
+        else:
+            members = [(cluster, clusterset.loc[clusterset[cluster] == 1, 'case'].values.tolist())
+                       for cluster in clusterset.columns if not cluster == 'case']
 
-            cases = clusterset.loc[clusterset[cluster] == 1, 'case']
-            cases = cases.values.tolist()
+        clusters = []
+        for cluster, cases in members:
 
             if len(cases) < self.settings.minclustersize:
                 logger.debug("Cluster {0} has {1} members. Less than minimum clustersize of {2}".format(cluster,
                     len(cases), self.settings.minclustersize))
                 continue
 
-            self.dataframe.trainset = cases
+            clusters.append((cluster, cases))
+
+        if rmodel.rmodeltype == 'RLM' and self.settings.optimizer == 'iterative' and not self.settings.acceleration:
+            if not clusters:
+                return
+
+            self.settings['param_labels'] = [GREEK_ALPHABET[i] for i, p in enumerate(self.settings.def_params)]
+            assert self.dataframe['ref_affinity'].sum() != 0, "Unable to model, no reference affinity data available"
+
+            exog = [self._pivot_cases(column) for column in self.settings.model_cols]
+            ref = self._pivot_cases('ref_affinity').mean(axis=1).values
+            case_index = exog[0].index.values.astype(int)
+            masks = numpy.array([numpy.in1d(case_index, cases) for cluster, cases in clusters])
 
+            self._batch_lie_optimizer([e.values for e in exog], ref, masks, rmodel=rmodel,
+                                      cases=[list(case_index[mask]) for mask in masks],
+                                      labels=[self.settings.get('label', cluster) for cluster, cases in clusters])
+            self.dataframe.reset_trainset()
+            self.dataframe.trainset = clusters[-1][1]
+            return
+
+        if self.settings.nproc > 1 and len(clusters) > 1:
+            self._parallel_batchmodel(clusters, rmodel)
+            self.dataframe.reset_trainset()
+            self.dataframe.trainset = clusters[-1][1]
+            return
+
+        for cluster, cases in clusters:
+            self.dataframe.reset_trainset()
+            self.dataframe.trainset = cases
             model = self.model(rmodel=rmodel, cases=cases, label=self.settings.get('label', cluster))
 
+    def _parallel_batchmodel(self, clusters, rmodel):
+        """
+        Build the models of `batchmodel` using a pool of nproc worker processes.
+
+        Only the pivoted energy and reference affinity arrays of the cases in
+        a cluster are send to the worker processes. Runs available from the
+        shared result cache are not repeated. The models are added to the
+        DataFrame in cluster order as if build one at a time.
+
+        :param clusters: cluster label and case ID's of each cluster
+        :type clusters:  :py:list
+        :param rmodel:   Class representing the regression algorithm to use.
+        """
+
+        self.settings['param_labels'] = [GREEK_ALPHABET[i] for i, p in enumerate(self.settings.def_params)]
+        assert self.dataframe['ref_affinity'].sum() != 0, "Unable to model, no reference affinity data available"
+        assert self.settings.optimizer in LIE_OPTIMIZERS, "Unknown LIE optimizer: {0}".format(self.settings.optimizer)
+
+        if self.settings.optimizer == 'iterative':
+            run, optimizer = _iterative_lie_run, self._iterative_lie_optimizer
+        else:
+            run, optimizer = _nls_lie_run, self._nls_lie_optimizer
+
+        # Pivot once, pose columns without data for the cluster are dropped as
+        # when pivoting the cluster cases alone.
+        exog = [self._pivot_cases(column).values for column in self.settings.model_cols]
+        ref = self._pivot_cases('ref_affinity')
+        case_index = ref.index.values
+        ref = ref.mean(axis=1).values
+
+        tasks = []
+        for cluster, cases in clusters:
+            mask = numpy.in1d(case_index, cases)
+            dataset = [data[mask] for data in exog]
+            tasks.append((run, self.settings, [data[:, ~numpy.isnan(data).all(axis=0)] for data in dataset],
+                          ref[mask], rmodel))
+
+        keys = [None] * len(tasks)
+        runs = [None] * len(tasks)
+        if self.settings.use_cache and pylie_cache.enabled:
+            keys = [self._run_key(run.__name__, task[2], task[3], rmodel) for task in tasks]
+            runs = [pylie_cache.get(key) for key in keys]
+
+        todo = [i for i, result in enumerate(runs) if result is None]
+        if todo:
+            logger.info("Build {0} models using {1} worker processes".format(len(todo), self.settings.nproc))
+            pool = multiprocessing.Pool(min(self.settings.nproc, len(todo)))
+            try:
+                results = pool.map(_optimizer_worker, [tasks[i] for i in todo])
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+            for i, result in zip(todo, results):
+                runs[i] = result
+                if keys[i] is not None:
+                    pylie_cache.set(keys[i], result)
+
+        for (cluster, cases), task, result in zip(clusters, tasks, runs):
+            label = self.settings.get('label', cluster)
+            if not label:
+                label = self.getlabel()
+            optimizer(task[2], task[3], rmodel=rmodel, cases=list(case_index[numpy.in1d(case_index, cases)]),
+                      L0=label, run=result)
+
     def model(self, rmodel=OLSregression(), label=None, cases=[], **kwargs):
         """
         Build a model from the data in the LIEDataFrame contained in the class
@@ -1002,6 +2390,10 @@ class LIEModelBuilder(LIEDataFrameBase):
 
         :param rmodel: Class representing the regression algorithm to use.
                        OLS_regression class by default.
+        :param optimizer: LIE parameter optimizer. 'iterative' alternates
+                       Boltzmann reweighting and regression (default), 'lm'
+                       and 'gn' fit the Boltzmann weighted LIE equation
+                       directly using Levenberg-Marquardt or Gauss-Newton.
         :return:       Class representing the build model.
         :rtype:        LIEModelFrame
         """
@@ -1029,11 +2421,16 @@ class LIEModelBuilder(LIEDataFrameBase):
         logger.info("Use {0} training cases for regression modelling".format(len(cases)))
 
         # Create pivot tables for model data columns and reference affinity data
-        exog = [self._pivot_data(trainset, column) for column in self.settings.model_cols]
-        ref = self._pivot_data(trainset, self._column_names.get('ref_affinity', 'ref_affinity')).mean(axis=1).values
+        exog = [self._pivot_cases(column, cases=cases) for column in self.settings.model_cols]
+        ref_column = self._column_names.get('ref_affinity', 'ref_affinity')
+        ref = self._pivot_cases(ref_column, cases=cases).mean(axis=1).values
 
         # Perform iterative modelling
-        model_index = self._iterative_lie_optimizer(exog, ref, rmodel=rmodel, cases=cases, L0=label)
+        assert self.settings.optimizer in LIE_OPTIMIZERS, "Unknown LIE optimizer: {0}".format(self.settings.optimizer)
+        if self.settings.optimizer == 'iterative':
+            model_index = self._iterative_lie_optimizer(exog, ref, rmodel=rmodel, cases=cases, L0=label)
+        else:
+            model_index = self._nls_lie_optimizer(exog, ref, rmodel=rmodel, cases=cases, L0=label)
 
-        if model_index:
+        if model_index is not None:
             return self.getmodel(model_index)
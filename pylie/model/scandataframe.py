@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+import sys
 import numpy
 
-from pandas import DataFrame, Series, pivot_table
-from scipy.spatial.distance import pdist, squareform
+from multiprocessing.pool import ThreadPool
+
+from pandas import DataFrame, concat, pivot_table
+from scipy.spatial.distance import cdist, pdist, squareform
 from scipy.cluster.hierarchy import *
 from matplotlib import pyplot
 
@@ -14,8 +21,30 @@ from pylie.model.liedataframe import LIEDataFrame, lie_deltag
 from pylie.model.lieseries import LIESeries
 from pylie.model.liebase import LIEDataFrameBase
 
+# Python 2 os.rename replaces existing files on POSIX systems only
+if sys.version_info[0] < 3:
+    from os import rename as replace
+else:
+    from os import replace
+
 logger = logging.getLogger('pylie')
 
+# Number of (alpha x beta x cases x poses) sized float arrays alive during _scan_block
+SCAN_BLOCK_ARRAYS = 5
+
+# Number of (alpha x beta x cases) sized arrays alive while reducing a block of the dG cube
+CUBE_BLOCK_ARRAYS = 8
+
+# Similarity metrics calculated from the Gram matrix of the scan results
+GRAM_METRICS = ('correlation', 'cosine', 'euclidean', 'sqeuclidean')
+
+# Version of the on-disk scan format written by LIEScanDataFrame.save
+SCAN_FORMAT_VERSION = 1
+
+# Settings that define the content of a scan
+SCAN_CONTENT_SETTINGS = ('alpha', 'beta', 'gamma', 'kBt', 'store_probabilities', 'adaptive', 'adaptive_step',
+                         'adaptive_tol')
+
 DEFAULT_SCAN_COLUMN_NAMES = {'case': 'case',
                              'poses': 'poses',
                              'alpha': 'alpha',
@@ -27,13 +56,167 @@ DEFAULT_SCAN_COLUMN_NAMES = {'case': 'case',
                              'ref_affinity': 'ref_affinity', }
 
 
+def _scan_block(vdw, coul, alpha, beta, kBt=2.49):
+    """
+    Boltzmann weighted LIE deltaG values for a block of alpha/beta grid points.
+
+    :param vdw:   Van der Waals energies as (cases x poses) array, NaN for
+                  missing poses
+    :type vdw:    :numpy:ndarray
+    :param coul:  Coulomb energies as (cases x poses) array
+    :type coul:   :numpy:ndarray
+    :param alpha: alpha values in the block
+    :type alpha:  :numpy:ndarray
+    :param beta:  beta values in the block
+    :type beta:   :numpy:ndarray
+    :param kBt:   Boltzmann constant at given temperature
+    :type kBt:    :py:float
+
+    :return:      deltaG values without gamma as (alpha x beta x cases) array
+                  and pose probabilities as (alpha x beta x cases x poses) array
+    :rtype:       :py:tuple
+    """
+
+    energy = alpha[:, numpy.newaxis, numpy.newaxis, numpy.newaxis] * vdw + \
+             beta[numpy.newaxis, :, numpy.newaxis, numpy.newaxis] * coul
+
+    return _boltzmann_dg(energy, kBt=kBt)
+
+
+def _scan_points(vdw, coul, alpha, beta, kBt=2.49):
+    """
+    Boltzmann weighted LIE deltaG values for a list of alpha/beta grid point
+    and case combinations.
+
+    :param vdw:   Van der Waals energies of the case for each point as
+                  (points x poses) array, NaN for missing poses
+    :type vdw:    :numpy:ndarray
+    :param coul:  Coulomb energies of the case for each point as
+                  (points x poses) array
+    :type coul:   :numpy:ndarray
+    :param alpha: alpha value of each point
+    :type alpha:  :numpy:ndarray
+    :param beta:  beta value of each point
+    :type beta:   :numpy:ndarray
+    :param kBt:   Boltzmann constant at given temperature
+    :type kBt:    :py:float
+
+    :return:      deltaG values without gamma for each point and the pose
+                  probabilities as (points x poses) array
+    :rtype:       :py:tuple
+    """
+
+    return _boltzmann_dg(alpha[:, numpy.newaxis] * vdw + beta[:, numpy.newaxis] * coul, kBt=kBt)
+
+
+def _boltzmann_dg(energy, kBt=2.49):
+    """
+    Boltzmann weighted deltaG and pose probabilities from pose energies
+    along the last axis. NaN energies are treated as missing poses.
+    """
+
+    # Pose probabilities, shift energies to the lowest pose for numerical stability
+    exponent = numpy.exp(-(energy - numpy.nanmin(energy, axis=-1)[..., numpy.newaxis]) / kBt)
+    probabilities = exponent / numpy.nansum(exponent, axis=-1)[..., numpy.newaxis]
+    dg_calc = numpy.nansum(probabilities * energy, axis=-1)
+
+    return dg_calc, probabilities
+
+
+def _quantile_below(count, below, low, high, quantile, cutoff):
+    """
+    Test if a quantile of a set of values is lower than cutoff, using linear
+    interpolation between data points as numpy.percentile does, from
+    running statistics of the values rather than the sorted values.
+
+    :param count:    number of values
+    :type count:     :numpy:ndarray
+    :param below:    number of values lower than cutoff
+    :type below:     :numpy:ndarray
+    :param low:      highest value lower than cutoff
+    :type low:       :numpy:ndarray
+    :param high:     lowest value not lower than cutoff
+    :type high:      :numpy:ndarray
+    :param quantile: quantile in range 0 to 1
+    :type quantile:  :py:float
+    :param cutoff:   cutoff value
+    :type cutoff:    :py:float
+
+    :return:         boolean array, False for empty sets
+    :rtype:          :numpy:ndarray
+    """
+
+    # The quantile interpolates between the values ranked floor(position)
+    # and ceil(position), values ranked below the count of lower values are
+    # lower than cutoff.
+    position = numpy.maximum(count - 1, 0) * quantile
+    floor = numpy.floor(position).astype(int)
+    ceil = numpy.ceil(position).astype(int)
+    with numpy.errstate(invalid='ignore'):
+        interpolated = low + (high - low) * (position - floor) < cutoff
+
+    return (count > 0) & ((ceil < below) | ((floor < below) & (ceil == below) & interpolated))
+
+
+def _masked_ends(values, mask, count):
+    """
+    First two and last two elements along the first axis of values for the
+    elements in mask. Undefined where mask has less elements.
+
+    :param values: data array
+    :type values:  :numpy:ndarray
+    :param mask:   boolean array of elements to include
+    :type mask:    :numpy:ndarray
+    :param count:  number of elements in mask along the first axis
+    :type count:   :numpy:ndarray
+
+    :return:       first, second, before last and last element
+    :rtype:        :py:list
+    """
+
+    rank = numpy.cumsum(mask, axis=0)
+
+    def element(k):
+        index = numpy.argmax(mask & (rank == k[numpy.newaxis]), axis=0)
+        return numpy.take_along_axis(values, index[numpy.newaxis], axis=0)[0]
+
+    return [element(numpy.ones_like(count)), element(numpy.full_like(count, 2)), element(count - 1), element(count)]
+
+
+def _scan_worker(task):
+    """
+    Evaluate a block of the alpha/beta grid and write the results to the
+    output dG and probability cubes. Outputs are NumPy arrays, file names of
+    memory-mapped .npy files to open in the worker process or None.
+
+    :param task: vdw and coul energies, alpha and beta values, kBt, gamma,
+                 output cubes, alpha and beta slice of the block
+    :type task:  :py:tuple
+    """
+
+    vdw, coul, alpha, beta, kBt, gamma, outputs, alpha_block, beta_block = task
+    dg_calc, probabilities = _scan_block(vdw, coul, alpha, beta, kBt=kBt)
+
+    for output, values in zip(outputs, (dg_calc + gamma, probabilities)):
+        if output is None:
+            continue
+        if isinstance(output, str):
+            output = numpy.lib.format.open_memmap(output, mode='r+')
+            output[alpha_block, beta_block] = values
+            output.flush()
+        else:
+            output[alpha_block, beta_block] = values
+
+
 class LIEScanDataFrame(LIEDataFrameBase):
     """
     Perform an alpha/beta grid scan for provided cases.
 
     This function will systematically scan alpha/beta parameter space.
     The range of values for alpha and beta can be set to arbitrary start, stop and
-    step size values. the gamma parameter is set to a fixed value.
+    step size values. The gamma parameter is set to a fixed value or scanned
+    as third dimension. Gamma enters dG linearly, a gamma scan only adds an
+    offset to the dG values calculated for the alpha/beta grid.
     By default, an alpha/beta range between 0 and 1 with a step size of 0.01 is
     sampled.
 
@@ -46,9 +229,12 @@ class LIEScanDataFrame(LIEDataFrameBase):
     (a DataFrame) in wich the latter may be multiple cases single pose or multiple
     cases multiple poses.
 
-    The scan results are returned as a LIEScanDataFrame with the calculated dG
-    values for each alpha/beta scan combination (columns) for each case (rows).
-    Columns headers are tuples of alpha/beta values.
+    The scan results are returned as a LIEScanDataFrame with a row for each case.
+    The calculated dG values for each alpha/beta scan combination are stored as
+    dense (alpha x beta x cases) NumPy array available using the `get_cube`
+    method. Errors with respect to the reference affinity and pose probabilities
+    are calculated from these on demand. Use `get_matrix` to obtain the results
+    as matrix with cases as rows and alpha/beta scan combinations as columns.
     """
 
     _class_name = 'scan'
@@ -70,6 +256,8 @@ class LIEScanDataFrame(LIEDataFrameBase):
           that are allowed to be sampled. A safety measure to prevent long
           computation times.
         :ptype max_combinations: int, default 100000000.
+          Only applies to scans held in memory, not to scans written to a
+          memory-mapped scan_file.
         """
 
         super(LIEScanDataFrame, self).__init__(*args, **kwargs)
@@ -124,12 +312,18 @@ class LIEScanDataFrame(LIEDataFrameBase):
             self.N = len(cases)
             self.R = (self.Sa * self.Sb) * self.N
 
-            if gamma is not None:
-                self.gamma_scan_range = numpy.array([gamma] * self.R)
+            if isinstance(gamma, (list, tuple)):
+                self.gamma_scan_range = numpy.arange(*gamma)
+                self.Sg = self.gamma_scan_range.size
+                logger.info("Gamma parameter scan in range: {0} to {1}, step size {2}".format(*gamma))
+            elif gamma is not None:
+                self.gamma_scan_range = numpy.array([gamma])
+                self.Sg = 1
                 logger.info("Gamma parameter: value fixed to {0}".format(gamma))
 
             # Check if total number of scan points does not exceed max_combinations
-            if self.R > self.settings['max_combinations']:
+            # for scans held in memory
+            if self.R > self.settings['max_combinations'] and not self.settings['scan_file']:
                 logger.error("Number of scan points ({0}) exceeds max_combinations ({1})\
             This is a safety threshold to prevent long computation times. Adjust with caution".format(self.R,
                 self.settings['max_combinations']))
@@ -142,45 +336,423 @@ class LIEScanDataFrame(LIEDataFrameBase):
 
         return True
 
-    def _calc_similarity_matrix(self):
+    def _scan_blocks(self, poses, workers=1):
+        """
+        Partition the alpha/beta grid in blocks that can be evaluated within the
+        memory budget (memory_budget setting in MB) shared by all workers.
+        Blocks consist of one or more complete alpha rows (alpha bands) or of
+        part of a single alpha row for very large beta ranges or datasets.
+        There are at least as many blocks as workers if the grid allows.
+
+        :param poses:   maximum number of poses per case
+        :ptype poses:   int
+        :param workers: number of workers evaluating blocks in parallel
+        :ptype workers: int
+        :return:        generator yielding alpha and beta slice for each block
+        """
+
+        point_size = SCAN_BLOCK_ARRAYS * 8 * self.N * poses
+        points = max(1, int(self.settings['memory_budget'] * 1024 ** 2 // (point_size * workers)))
+
+        if points >= self.Sb:
+            rows = min(points // self.Sb, -(-self.Sa // workers))
+            for start in range(0, self.Sa, rows):
+                yield slice(start, min(start + rows, self.Sa)), slice(0, self.Sb)
+        else:
+            for row in range(self.Sa):
+                for start in range(0, self.Sb, points):
+                    yield slice(row, row + 1), slice(start, min(start + points, self.Sb))
+
+    def _gamma_distance(self, error):
+        """
+        Lowest absolute error over the gamma scan range for errors at the first
+        gamma value. Used to track the case optimum by the adaptive scan.
+        """
+
+        offset = self.gamma_scan_range - self.gamma_scan_range[0]
+
+        return numpy.abs(error[..., numpy.newaxis] + offset).min(axis=-1)
+
+    def _evaluate_grid(self, vdw, coul, dg_cube, prob_cube=None):
+        """
+        Evaluate the full alpha/beta grid for the cases in vdw and coul.
+
+        Blocks are evaluated in a thread pool or, for memory-mapped output,
+        optionally in a process pool with each worker writing directly to the
+        memory-mapped .npy file(s).
+
+        :param vdw:       Van der Waals energies as (cases x poses) array
+        :param coul:      Coulomb energies as (cases x poses) array
+        :param dg_cube:   (alpha x beta x cases) output array for dG
+        :param prob_cube: (alpha x beta x cases x poses) output array for pose
+                          probabilities or None
+        """
+
+        nproc = self.settings['nproc']
+        outputs = (dg_cube, prob_cube)
+        pool = None
+        if nproc > 1:
+            if self.settings['parallel'] == 'process' and isinstance(dg_cube, numpy.memmap):
+                dg_cube.flush()
+                outputs = (dg_cube.filename, getattr(prob_cube, 'filename', None))
+                pool = multiprocessing.Pool(nproc)
+            else:
+                pool = ThreadPool(nproc)
+            logger.info("Run alpha/beta scan using {0} {1} workers".format(nproc, 'process' if isinstance(
+                outputs[0], str) else 'thread'))
+
+        tasks = [(vdw, coul, self.alpha_scan_range[alpha_block], self.beta_scan_range[beta_block],
+                  self.settings['kBt'], self.gamma_scan_range[0], outputs, alpha_block, beta_block)
+                 for alpha_block, beta_block in self._scan_blocks(vdw.shape[1], workers=nproc)]
+        if pool:
+            try:
+                pool.map(_scan_worker, tasks)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for task in tasks:
+                _scan_worker(task)
+
+    def _adaptive_scan(self, vdw, coul):
+        """
+        Coarse-to-fine evaluation of the alpha/beta grid.
+
+        The grid is first evaluated every adaptive_step grid points. For every
+        case, grid cells are recursively split in four (quadtree) as long as
+        the cell may contain errors within adaptive_tol of the lowest absolute
+        error found so far for the case. The Boltzmann weighted dG is an
+        average of pose energies that are linear in alpha and beta, the dG
+        within a cell is therefore bound by the lowest and highest pose energy
+        at its corners. All grid points with an absolute error (at the optimal
+        gamma) within adaptive_tol of the case optimum are evaluated. Other
+        grid point and case combinations are NaN in the dG cube and are
+        evaluated on demand by _complete_scan.
+
+        :param vdw:  Van der Waals energies as (cases x poses) array
+        :param coul: Coulomb energies as (cases x poses) array
+        :return:     number of evaluated grid point and case combinations
+        :rtype:      int
+        """
+
+        step = self.settings['adaptive_step']
+        tol = self.settings['adaptive_tol']
+        gamma = self.gamma_scan_range[0]
+
+        # Errors at other gamma values are shifted by the gamma offset
+        shift_low = self.gamma_scan_range.min() - gamma
+        shift_high = self.gamma_scan_range.max() - gamma
+        self.dg_cube[:] = numpy.nan
+
+        # Coarse grid, always including the last alpha and beta value
+        coarse_a = numpy.unique(numpy.append(numpy.arange(0, self.Sa, step), self.Sa - 1))
+        coarse_b = numpy.unique(numpy.append(numpy.arange(0, self.Sb, step), self.Sb - 1))
+        self.dg_cube[numpy.ix_(coarse_a, coarse_b)] = _scan_block(vdw, coul, self.alpha_scan_range[coarse_a],
+            self.beta_scan_range[coarse_b], kBt=self.settings['kBt'])[0] + gamma
+        evaluated = coarse_a.size * coarse_b.size * self.N
+
+        # Cells of each case as (alpha start, alpha end, beta start, beta end, case) indices
+        a0, b0, case = numpy.meshgrid(coarse_a[:-1], coarse_b[:-1], numpy.arange(self.N), indexing='ij')
+        a1, b1 = numpy.meshgrid(coarse_a[1:], coarse_b[1:], indexing='ij')
+        cells = numpy.column_stack((a0.ravel(), numpy.repeat(a1.ravel(), self.N), b0.ravel(),
+                                    numpy.repeat(b1.ravel(), self.N), case.ravel()))
+        corner_index = ((0, 2), (0, 3), (1, 2), (1, 3))
+
+        # Lowest absolute error of each case so far
+        best = self._gamma_distance(self.dg_cube[numpy.ix_(coarse_a, coarse_b)] - self.ref)
+        best = best.reshape(-1, self.N).min(axis=0) + tol
+
+        while len(cells):
+
+            # Bounds of the dG error in each cell from the pose energy extremes
+            v = vdw[cells[:, 4]]
+            c = coul[cells[:, 4]]
+            alpha_v = (self.alpha_scan_range[cells[:, 0], numpy.newaxis] * v,
+                       self.alpha_scan_range[cells[:, 1], numpy.newaxis] * v)
+            beta_c = (self.beta_scan_range[cells[:, 2], numpy.newaxis] * c,
+                      self.beta_scan_range[cells[:, 3], numpy.newaxis] * c)
+            offset = gamma - self.ref[cells[:, 4]]
+            low = numpy.nanmin(numpy.minimum(*alpha_v) + numpy.minimum(*beta_c), axis=1) + offset
+            high = numpy.nanmax(numpy.maximum(*alpha_v) + numpy.maximum(*beta_c), axis=1) + offset
+
+            # Refine cells that may contain errors close to the case optimum
+            distance = numpy.maximum(numpy.maximum(low + shift_low, -(high + shift_high)), 0)
+            refine = distance <= best[cells[:, 4]]
+            cells = cells[refine & ((cells[:, 1] - cells[:, 0] > 1) | (cells[:, 3] - cells[:, 2] > 1))]
+            if not len(cells):
+                break
+
+            # Split cells in two along dimensions larger than one grid step
+            split_a = (cells[:, 1] - cells[:, 0]) > 1
+            split_b = (cells[:, 3] - cells[:, 2]) > 1
+            mid_a = numpy.where(split_a, (cells[:, 0] + cells[:, 1]) // 2, cells[:, 1])
+            mid_b = numpy.where(split_b, (cells[:, 2] + cells[:, 3]) // 2, cells[:, 3])
+            children = numpy.concatenate((
+                numpy.column_stack((cells[:, 0], mid_a, cells[:, 2], mid_b, cells[:, 4])),
+                numpy.column_stack((mid_a, cells[:, 1], cells[:, 2], mid_b, cells[:, 4]))[split_a],
+                numpy.column_stack((cells[:, 0], mid_a, mid_b, cells[:, 3], cells[:, 4]))[split_b],
+                numpy.column_stack((mid_a, cells[:, 1], mid_b, cells[:, 3], cells[:, 4]))[split_a & split_b]))
+
+            # Evaluate new cell corners, use flat cube indices to find unique points
+            points = numpy.unique(numpy.concatenate([numpy.ravel_multi_index((children[:, i], children[:, j],
+                children[:, 4]), self.dg_cube.shape) for i, j in corner_index]))
+            points = points[numpy.isnan(self.dg_cube.ravel()[points])]
+            if len(points):
+                ia, ib, case = numpy.unravel_index(points, self.dg_cube.shape)
+                dg_calc = _scan_points(vdw[case], coul[case], self.alpha_scan_range[ia], self.beta_scan_range[ib],
+                                       kBt=self.settings['kBt'])[0] + gamma
+                self.dg_cube[ia, ib, case] = dg_calc
+                numpy.minimum.at(best, case, self._gamma_distance(dg_calc - self.ref[case]) + tol)
+                evaluated += len(points)
+
+            cells = children
+
+        return evaluated
+
+    def _complete_scan(self):
+        """
+        Evaluate the grid point and case combinations skipped by an adaptive
+        scan, one alpha row at a time. Afterwards the dG cube equals that of
+        a full scan.
+        """
+
+        if not self._metadata.get('adaptive_pending'):
+            return
+
+        vdw = numpy.asarray(self.v_vdw, dtype=float)
+        coul = numpy.asarray(self.v_coul, dtype=float)
+        points = max(1, int(self.settings['memory_budget'] * 1024 ** 2 // (SCAN_BLOCK_ARRAYS * 8 * vdw.shape[1])))
+
+        evaluated = 0
+        for row in range(self.Sa):
+            ib, case = numpy.nonzero(numpy.isnan(self.dg_cube[row]))
+            for start in range(0, len(ib), points):
+                block_b, block_case = ib[start:start + points], case[start:start + points]
+                self.dg_cube[row, block_b, block_case] = _scan_points(vdw[block_case], coul[block_case],
+                    numpy.full(len(block_b), self.alpha_scan_range[row]), self.beta_scan_range[block_b],
+                    kBt=self.settings['kBt'])[0] + self.gamma_scan_range[0]
+            evaluated += len(ib)
+
+        if isinstance(self.dg_cube, numpy.memmap):
+            self.dg_cube.flush()
+        self._metadata['adaptive_pending'] = False
+        logger.info("Evaluated {0} grid point and case combinations skipped by the adaptive scan".format(evaluated))
+
+    def _cube_blocks(self, column='error', complete=True):
+        """
+        Iterate over the stored scan results at the first gamma value in
+        alpha bands fitting the memory budget (memory_budget setting in MB).
+
+        :param column:   'dg_calc' or 'error'
+        :ptype column:   string
+        :param complete: first evaluate grid points skipped by an adaptive scan
+        :ptype complete: bool
+        :return:         generator yielding the alpha slice and the
+                         (alpha x beta x cases) values of each band
+        """
+
+        if complete:
+            self._complete_scan()
+        if column not in ('dg_calc', 'error'):
+            raise KeyError("no such column name: {0}".format(column))
+
+        rows = max(1, int(self.settings['memory_budget'] * 1024 ** 2 // (CUBE_BLOCK_ARRAYS * 8 * self.Sb * self.N)))
+        for start in range(0, self.Sa, rows):
+            band = slice(start, min(start + rows, self.Sa))
+            block = numpy.asarray(self.dg_cube[band])
+            yield band, block - self.ref if column == 'error' else block
+
+    def _gamma_offsets(self, gamma=None):
+        """
+        Gamma scan range indices and offsets with respect to the first gamma
+        value. All gamma values of the scan range by default, else the one
+        closest to gamma.
+        """
+
+        offset = self.gamma_scan_range - self.gamma_scan_range[0]
+        if gamma is None:
+            return list(enumerate(offset))
+
+        index = numpy.argmin(numpy.abs(self.gamma_scan_range - gamma))
+        return [(index, offset[index])]
+
+    def _gamma_profile(self, cube):
+        """
+        Values of a block of the scan cube at the gamma value closest to zero
+        error for every alpha/beta grid point and case.
+
+        Gamma enters dG linearly, the error at gamma g equals the error at the
+        first gamma of the scan range plus the gamma offset. The optimal gamma
+        is therefore the gamma scan value closest to minus that error and the
+        gamma dimension does not have to be materialized.
+
+        :param cube: (alpha x beta x cases) values at the first gamma value
+        :ptype cube: :numpy:ndarray
+        :return:     (alpha x beta x cases) arrays with the values at the
+                     optimal gamma and the gamma scan range index thereof
+        :rtype:      :py:tuple
+        """
+
+        if self.Sg == 1:
+            return cube, numpy.zeros(cube.shape, dtype=int)
+
+        offset = self.gamma_scan_range - self.gamma_scan_range[0]
+        order = numpy.argsort(offset)
+        offset = offset[order]
+
+        right = numpy.clip(numpy.searchsorted(offset, -cube), 1, self.Sg - 1)
+        left_values = cube + offset[right - 1]
+        right_values = cube + offset[right]
+        use_right = numpy.abs(right_values) < numpy.abs(left_values)
+
+        return numpy.where(use_right, right_values, left_values), order[numpy.where(use_right, right, right - 1)]
+
+    def _optimum(self, column='error'):
+        """
+        Value closest to 0 at the optimal gamma for every case, evaluated per
+        alpha band. Grid points not evaluated by an adaptive scan are skipped.
+
+        :param column: 'dg_calc' or 'error'
+        :ptype column: string
+        :return:       optimal values, flat alpha/beta grid index and gamma
+                       scan range index of the optimum for every case
+        :rtype:        :py:tuple
+        """
+
+        cases = numpy.arange(self.N)
+        optimal = numpy.full(self.N, numpy.nan)
+        distance = numpy.full(self.N, numpy.inf)
+        grid_index = numpy.zeros(self.N, dtype=int)
+        gamma_index = numpy.zeros(self.N, dtype=int)
+
+        for band, block in self._cube_blocks(column, complete=False):
+            values, gammas = self._gamma_profile(block)
+            values = values.reshape(-1, self.N)
+            absolute = numpy.abs(values)
+            absolute[numpy.isnan(absolute)] = numpy.inf
+            index = numpy.argmin(absolute, axis=0)
+
+            # Keep the first optimum in alpha/beta scan order
+            better = absolute[index, cases] < distance
+            distance[better] = absolute[index, cases][better]
+            optimal[better] = values[index, cases][better]
+            grid_index[better] = band.start * self.Sb + index[better]
+            gamma_index[better] = gammas.reshape(-1, self.N)[index, cases][better]
+
+        return optimal, grid_index, gamma_index
+
+    def _calc_similarity_matrix(self, metric=None):
+        """
+        Pairwise distances between cases over the full alpha/beta scan.
+
+        Gamma shifts the dG values of all cases equally, the gamma dimension
+        is not needed for pairwise distances. Correlation, cosine and
+        (squared) euclidean distances are calculated from the Gram matrix
+        of the standardised dG vectors (see _case_distances), other metrics
+        use scipy pdist. Results are cached per metric and precision
+        (similarity_dtype setting) until the next scan, a copy is returned.
+        The cache is updated incrementally by add_cases and drop_cases.
+
+        :param metric: distance metric, pdist_metric setting by default
+        :ptype metric: string
+        :return:       condensed distance matrix as returned by pdist
+        :rtype:        :numpy:ndarray
+        """
+
+        metric = metric or self.settings['pdist_metric']
+        dtype = numpy.dtype(self.settings['similarity_dtype'])
+        cache = self._metadata.setdefault('similarity_cache', {})
+        if (metric, dtype.name) in cache:
+            return cache[(metric, dtype.name)].copy()
+
+        if metric in GRAM_METRICS:
+            distances = squareform(self._case_distances(numpy.arange(self.N), metric, dtype), checks=False)
+        else:
+            dgcalc = self.get_cube(gamma=self.gamma_scan_range[0]).reshape((self.Sa * self.Sb, self.N))
+            distances = pdist(dgcalc.T, metric=metric)
 
-        # Extract column with calculated delta G values from the scandataframe and
-        # reshape to form a matrix with cases for rows and columns for each scan
-        # (alpha/beta) parameter combination.
-        dgcalc = self['dg_calc'].values
-        dgcalc = dgcalc.reshape((self.Sa * self.Sb, self.N))
+        cache[(metric, dtype.name)] = distances
+
+        return distances.copy()
+
+    def _case_distances(self, index, metric, dtype=numpy.float64):
+        """
+        Distances of the cases at index to all cases over the full alpha/beta
+        scan as (index x cases) array.
+
+        Correlation, cosine and (squared) euclidean distances are calculated
+        from the Gram matrix of the standardised dG vectors accumulated over
+        blocks of grid points within the memory_budget. Other metrics use
+        scipy cdist.
+
+        :param index:  case indices
+        :ptype index:  :numpy:ndarray
+        :param metric: distance metric
+        :ptype metric: string
+        :param dtype:  precision of the calculation
+        :ptype dtype:  :numpy:dtype
+        :rtype:        :numpy:ndarray
+        """
+
+        # Matrix with columns for each case and rows for each scan (alpha/beta)
+        # parameter combination.
+        dgcalc = self.get_cube(gamma=self.gamma_scan_range[0]).reshape((self.Sa * self.Sb, self.N))
+        if metric not in GRAM_METRICS:
+            return cdist(dgcalc.T[index], dgcalc.T, metric=metric)
+
+        # Correlation: center each case. Euclidean: center each grid point,
+        # distances are invariant to it and it limits round-off.
+        dtype = numpy.dtype(dtype)
+        if metric == 'correlation':
+            mean = dgcalc.mean(axis=0).astype(dtype)
+
+        gram = numpy.zeros((len(index), self.N), dtype=dtype)
+        norms = numpy.zeros(self.N, dtype=dtype)
+        rows = max(1, int(self.settings['memory_budget'] * 1024 ** 2 // (2 * self.N * dtype.itemsize)))
+        for start in range(0, dgcalc.shape[0], rows):
+            block = numpy.asarray(dgcalc[start:start + rows], dtype=dtype)
+            if metric == 'correlation':
+                block = block - mean
+            elif metric != 'cosine':
+                block = block - block.mean(axis=1, keepdims=True)
+            gram += numpy.dot(block[:, index].T, block)
+            norms += numpy.einsum('ij,ij->j', block, block)
+
+        if metric in ('correlation', 'cosine'):
+            distances = 1 - gram / numpy.outer(numpy.sqrt(norms[index]), numpy.sqrt(norms))
+        else:
+            distances = numpy.maximum(norms[index, numpy.newaxis] + norms - 2 * gram, 0)
+            if metric == 'euclidean':
+                distances = numpy.sqrt(distances)
+        distances[numpy.arange(len(index)), index] = 0
 
-        # Calculate pairwise distance matrix for each column using a given metric
-        return pdist(dgcalc.T, metric=self.settings['pdist_metric'])
+        return distances
 
-    def _filter_by_similarity(self, cutoff=0.75):
+    def _filter_by_similarity(self, cutoff=0.75, metric='correlation'):
         # Calculate correlation variance for each ligand with respect to all
         # other ligands.
 
-        simmatrix = 1 - squareform(self._calc_similarity_matrix())
+        simmatrix = 1 - squareform(self._calc_similarity_matrix(metric=metric))
         mean = numpy.mean(simmatrix, axis=0)
         std = numpy.std(simmatrix, axis=0)
         cases = self.cases
         outlier = [1 if c <= cutoff else 0 for c in mean]
 
         logger.info("Identified {0} outliers in a {1} based similarity matrix with a cutoff of {2}".format(sum(outlier),
-            self.settings['pdist_metric'], cutoff))
+            metric, cutoff))
 
         return DataFrame({'case': cases, 'mean': mean, 'std': std, 'filter_mask': outlier})
 
     @property
     def outliers(self):
-        self.settings.pdist_metric = 'correlation'
-        resultsframe = self._filter_by_similarity(cutoff=self.settings['outlier_cutoff'])
-        self.settings.revert('pdist_metric')
+        resultsframe = self._filter_by_similarity(cutoff=self.settings['outlier_cutoff'], metric='correlation')
 
         return resultsframe[resultsframe['filter_mask'] > 0]
 
     @property
     def inliers(self):
-        self.settings.pdist_metric = 'correlation'
-        resultsframe = self._filter_by_similarity(cutoff=self.settings['inlier_cutoff'])
-        self.settings.revert('pdist_metric')
+        resultsframe = self._filter_by_similarity(cutoff=self.settings['inlier_cutoff'], metric='correlation')
 
         return resultsframe[resultsframe['filter_mask'] == 0]
 
@@ -207,7 +779,7 @@ class LIEScanDataFrame(LIEDataFrameBase):
         self.settings.update(kwargs)
 
         if self.settings['cluster_method'] == 'full':
-            simmatrix = self._calc_similarity_matrix(**kwargs)
+            simmatrix = self._calc_similarity_matrix()
             logger.info(
                 'Cluster scan results using full scan matrix. pdist metric: {0}, linkage method: {1}, linkage metric: {2}'.format(
                     self.settings['pdist_metric'], self.settings['linkage_method'], self.settings['linkage_metric']))
@@ -235,34 +807,41 @@ class LIEScanDataFrame(LIEDataFrameBase):
         return dataframe
 
     def get_optimal_range(self, column='error'):
+        """
+        Get the range of alpha and beta values around the optimum of each case
 
-        matrix = self.get_matrix(column=column)
+        For each case find the value closest to 0 and select all alpha/beta
+        combinations with a value within 0.1 of the optimum rounded to one
+        decimal. The first (low) and last (high) of these combinations in
+        alpha/beta scan order define the range.
 
-        cases = []
-        optimal = []
-        lowa = []
-        lowb = []
-        higha = []
-        highb = []
-        for i, case in enumerate(matrix.index):
-            opt_idx = (numpy.abs(matrix.iloc[i, :].values)).argmin()
-            opt = matrix.iloc[i, opt_idx]
-            one_dec = numpy.round(opt, 1)
-
-            r = matrix.iloc[i, :]
-            r = r[(r > one_dec - 0.1) & (r < one_dec + 0.1)].reset_index()
-
-            low_ab = r.head(1).values[0]
-            high_ab = r.tail(1).values[0]
-
-            cases.append(case)
-            optimal.append(opt)
-            lowa.append(low_ab[0])
-            lowb.append(low_ab[1])
-            higha.append(high_ab[0])
-            highb.append(high_ab[1])
-
-        df = DataFrame({'case': cases, 'optimal': optimal, 'la': lowa, 'lb': lowb, 'ha': higha, 'hb': highb})
+        :param column: column name for which to return values close to 0
+        :type column:  :py:str
+        :return:       Pandas DataFrame with optimal value and low (la, lb)
+                       and high (ha, hb) alpha and beta values for each case
+        """
+
+        optimal = self._optimum(column)[0]
+        one_dec = numpy.round(optimal, 1)
+
+        # First and last grid point within the band around the optimum at
+        # the optimal gamma of every grid point
+        low = numpy.full(self.N, -1)
+        high = numpy.full(self.N, -1)
+        for band, block in self._cube_blocks(column, complete=False):
+            matrix = self._gamma_profile(block)[0].reshape(-1, self.N)
+            within = (matrix > one_dec - 0.1) & (matrix < one_dec + 0.1)
+            found = within.any(axis=0)
+            first = band.start * self.Sb + numpy.argmax(within, axis=0)
+            last = band.start * self.Sb + within.shape[0] - 1 - numpy.argmax(within[::-1], axis=0)
+            low = numpy.where(found & (low < 0), first, low)
+            high = numpy.where(found, last, high)
+        low[low < 0] = 0
+        high[high < 0] = self.Sa * self.Sb - 1
+
+        df = DataFrame({'case': self['case'].values, 'optimal': optimal,
+                        'la': self.alpha_scan_range[low // self.Sb], 'lb': self.beta_scan_range[low % self.Sb],
+                        'ha': self.alpha_scan_range[high // self.Sb], 'hb': self.beta_scan_range[high % self.Sb]})
         return df
 
     def get_optimal(self, column='error'):
@@ -270,24 +849,22 @@ class LIEScanDataFrame(LIEDataFrameBase):
         Get optimal alpha and beta value for each case
 
         For each case find the dG RMSE value closest to 0 and return RMSe, alpha
-        and beta value als Pandas DataFrame
+        and beta value als Pandas DataFrame. For a gamma scan the optimal gamma
+        value is returned as well.
 
         :param column: column name for which to return values close to 0
         :type column:  :py:str
         :return:       Pandas DataFrame
         """
 
-        matrix = self.get_matrix(column=column)
-        optimal_idx = (numpy.abs(matrix.values)).argmin(1)
-        dataframe = {column: [], 'alpha': [], 'beta': []}
-
-        for case, idx in enumerate(optimal_idx):
-            dataframe[column].append(matrix.iloc[case, idx])
-            dataframe['alpha'].append(matrix.columns[idx][0])
-            dataframe['beta'].append(matrix.columns[idx][1])
+        optimal, optimal_idx, gamma_index = self._optimum(column)
 
         # Gather results in new Pandas DataFrame.
-        results = DataFrame(dataframe, index=set(self['case']))
+        results = DataFrame({column: optimal,
+                             'alpha': self.alpha_scan_range[optimal_idx // self.Sb],
+                             'beta': self.beta_scan_range[optimal_idx % self.Sb]}, index=self['case'].values)
+        if self.Sg > 1:
+            results['gamma'] = self.gamma_scan_range[gamma_index]
         results.index.name = 'case'
 
         return results
@@ -307,27 +884,15 @@ class LIEScanDataFrame(LIEDataFrameBase):
         :ptype utol: float
         :param absolute: Treat dG error values as absolute errors.
         :ptype absolute: bool
+        :param gamma: Gamma value to calculate the density for. By default the
+                      highest density over the gamma scan range is reported
+                      for every alpha/beta combination.
+        :ptype gamma: float
         :return:     pandas DataFrame
         """
 
-        # Reshape in (N,Sa*Sb) matrix
-        data = self['error'].values.reshape(self.Sa * self.Sb, self.N)
-        if kwargs.get('absolute', False):
-            data = numpy.absolute(dGdiff)
-
-        # Set upper and lower tolerance limit if not set. Use cutoff of 5% between
-        # minimum and maximum value in dataet
-        ltol = kwargs.get('ltol', numpy.min(data) * 0.05)
-        utol = kwargs.get('utol', numpy.max(data) * 0.05)
-
-        # Make new matrix of size (alpha range x beta range) and add reshaped
-        # identity matrixes for each case. Identity matrix is determined as 1 for
-        # all cases with gamma residual in range ltol <= x <= utol, and 0 outside.
-        identmatr = ((data >= ltol) & (data <= utol)).astype(int)
-        ident_matrix_cases = identmatr * numpy.arange(1, self.N + 1).reshape(1, self.N)
-        scanmatrix = numpy.zeros((self.Sa, self.Sb))
-        for i in range(1, self.N + 1):
-            scanmatrix = scanmatrix + numpy.sum((ident_matrix_cases == i).astype(int), axis=1).reshape(self.Sa, self.Sb)
+        scanmatrix = self._density(ltol=kwargs.get('ltol'), utol=kwargs.get('utol'),
+                                   absolute=kwargs.get('absolute', False), gamma=kwargs.get('gamma'))[0]
 
         # Wrap scanmatrix in a Pandas DataFrame. Flip it up first to have both parameters start as 0 origin
         df = DataFrame(numpy.flipud(scanmatrix))
@@ -336,7 +901,47 @@ class LIEScanDataFrame(LIEDataFrameBase):
 
         return df
 
-    def get_cases(self, alpha, beta, error=5):
+    def _density(self, ltol=None, utol=None, absolute=False, gamma=None):
+        """
+        Number of cases with a dG error in range ltol <= x <= utol for every
+        alpha/beta grid point, highest count over the gamma scan range.
+        Counted per alpha band and gamma value.
+
+        :param ltol:     lower tolerance, 5% of the lowest error by default
+        :ptype ltol:     float
+        :param utol:     upper tolerance, 5% of the highest error by default
+        :ptype utol:     float
+        :param absolute: use absolute dG errors
+        :ptype absolute: bool
+        :param gamma:    count for the gamma scan value closest to gamma only
+        :ptype gamma:    float
+        :return:         (alpha x beta) count matrix in alpha/beta scan order,
+                         lower and upper tolerance
+        :rtype:          :py:tuple
+        """
+
+        offsets = self._gamma_offsets(gamma)
+
+        def errors():
+            for band, block in self._cube_blocks('error'):
+                for index, offset in offsets:
+                    data = block + offset
+                    yield band, numpy.absolute(data) if absolute else data
+
+        # Use a cutoff of 5% of the minimum and maximum value in the dataset
+        # if the tolerance limits are not set
+        if ltol is None or utol is None:
+            limits = [(numpy.nanmin(data), numpy.nanmax(data)) for band, data in errors()]
+            ltol = numpy.min(limits, axis=0)[0] * 0.05 if ltol is None else ltol
+            utol = numpy.max(limits, axis=0)[1] * 0.05 if utol is None else utol
+
+        scanmatrix = numpy.zeros((self.Sa, self.Sb), dtype=int)
+        for band, data in errors():
+            numpy.maximum(scanmatrix[band], numpy.sum((data >= ltol) & (data <= utol), axis=2), out=scanmatrix[band])
+
+        return scanmatrix, ltol, utol
+
+    def get_cases(self, alpha, beta, error=5, gamma=None):
         """
         Get cases in alpha/beta range lower than error.
 
@@ -351,13 +956,29 @@ class LIEScanDataFrame(LIEDataFrameBase):
         :ptype beta:  :py:list
         :param error: Absolute error cutoff
         :ptype error: :py:float
+        :param gamma: Gamma parameter range (start,stop) for a gamma scan.
+                      The full gamma scan range by default.
+        :ptype gamma: :py:list
 
         :rtype:       :py:list
         """
 
-        cases = self[(self['alpha'] > alpha[0]) & (self['alpha'] < alpha[1]) & (self['beta'] > beta[0]) &
-                     (self['beta'] < beta[1]) & (abs(self['error']) < error)]
-        return list(cases['case'].values)
+        alpha_range = (self.alpha_scan_range > alpha[0]) & (self.alpha_scan_range < alpha[1])
+        beta_range = (self.beta_scan_range > beta[0]) & (self.beta_scan_range < beta[1])
+        offset = self.gamma_scan_range - self.gamma_scan_range[0]
+        if self.Sg > 1 and gamma is not None:
+            offset = offset[(self.gamma_scan_range > gamma[0]) & (self.gamma_scan_range < gamma[1])]
+
+        # Cases in alpha/beta/gamma scan order, one alpha row at a time
+        self._complete_scan()
+        cases = []
+        for row in numpy.nonzero(alpha_range)[0]:
+            errors = self.dg_cube[row][beta_range] - self.ref
+            if self.Sg > 1:
+                errors = errors[:, numpy.newaxis, :] + offset[:, numpy.newaxis]
+            cases.extend(self['case'].values[numpy.nonzero(abs(errors) < error)[-1]])
+
+        return cases
 
     def propensity_distribution(self, min_density_frac=0.5):
         """
@@ -367,119 +988,211 @@ class LIEScanDataFrame(LIEDataFrameBase):
           - 1: The Boltzmann weight of this pose is descending in alpha/beta space
           - 2: The Boltzmann weight of this pose is ascending in alpha/beta space
           - 3: The Boltzmann weight of this pose remains stable in alpha/beta space
-        """
 
-        probstats = DataFrame(columns=['case', 'pose', 'tag', 'min', 'max', 'mean', 'slope', 'total', 'overlap'])
+        Pose statistics are calculated for all cases and poses at once in blocks
+        of the alpha/beta grid within the memory budget, restricted to the grid
+        points with a dG error close to the optimum of the case. Minimum,
+        maximum, mean, quartiles and slope are accumulated over the blocks
+        as running statistics.
+        """
 
         insignificant = self.settings.prob_insignif_cutoff
         optima = self.get_optimal()
-        idx = 0
-        for case, data in optima.sort_index().iterrows():
 
-            optimum = abs(data['error'])
-            if optimum == 0.0:
-                search = 0.0
+        # Search range of the absolute error: the optimum rounded to one
+        # significant digit plus 0.1
+        optimum = numpy.abs(optima['error'].values)
+        search = numpy.array([round(x, -int(numpy.floor(numpy.log10(x)))) + 0.1 if x != 0 else 0.0 for x in optimum])
+
+        # Offset of the errors at the optimal gamma of each case
+        shift = numpy.zeros(self.N)
+        if 'gamma' in optima:
+            shift = optima['gamma'].values - self.gamma_scan_range[0]
+
+        # Get the density distribution for the scan and normalize. Select all grid
+        # points with a normalized fraction >= min_density_frac. get_density
+        # returns the matrix flipped up, restore alpha/beta scan order first.
+        density = numpy.flipud(self.get_density().values)
+        scanabrange = density / density.max() >= min_density_frac
+        abdatapoints = float(scanabrange.sum())
+
+        vdw = numpy.asarray(self.v_vdw, dtype=float)
+        coul = numpy.asarray(self.v_coul, dtype=float)
+        shape = vdw.shape
+        count = numpy.zeros(shape, dtype=int)
+        total = numpy.zeros(shape)
+        minimum = numpy.full(shape, numpy.inf)
+        maximum = numpy.full(shape, -numpy.inf)
+        below = numpy.zeros(shape, dtype=int)
+        max_below = numpy.full(shape, -numpy.inf)
+        min_above = numpy.full(shape, numpy.inf)
+        ends = [numpy.zeros(shape) for i in range(4)]
+        union = numpy.zeros(shape, dtype=int)
+        intersection = numpy.zeros(shape, dtype=int)
+        complete = numpy.ones(shape, dtype=bool)
+
+        # Blocks follow the alpha/beta scan order
+        for alpha_block, beta_block in self._scan_blocks(shape[1]):
+
+            # Pose probabilities as (grid x cases x poses) and grid points close
+            # to the optimum of each case
+            if getattr(self, 'prob_cube', None) is not None:
+                probabilities = numpy.array(self.prob_cube[alpha_block, beta_block])
             else:
-                search = (round(optimum, -int(numpy.floor(numpy.log10(optimum)))) + 0.1)
-
-            selection = self.loc[(abs(self['error']) < search) & (self['case'] == case)]
-            selection = selection.dropna(how='all', axis=1)
-
-            columns = selection.get_columns('prob-*')
-            stats = selection[selection.get_columns('prob-*')].describe()
-            for prob in columns:
-                p = stats[prob]
-                slope = numpy.mean(numpy.gradient(selection[prob].values))
-
-                # Insignificant pose
-                if p['mean'] < insignificant and p['25%'] < insignificant and p['50%'] < insignificant and p[
-                    '75%'] < insignificant:
-                    tag = 3
-                    if self.settings.prob_report_insignif:
-                        tag = 0
-
-                # Descending gradient
-                elif (p['max'] - p['min']) > 0.1 and slope < self.settings.grad_desc_cutoff:
-                    tag = 1
-
-                # Ascending gradient
-                elif (p['max'] - p['min']) > 0.1 and slope > self.settings.grad_ascn_cutoff:
-                    tag = 2
-
-                # Pose near constant
-                else:
-                    tag = 3
-
-                pose_data = Series({'case': case,
-                                    'pose': int(prob.split('-')[1]),
-                                    'tag': tag,
-                                    'min': p['min'],
-                                    'max': p['max'],
-                                    'mean': p['mean'],
-                                    'slope': slope})
-                probstats.loc[idx] = pose_data
-                idx += 1
-
-        # Get the density distribution for the scan and normalize
-        density = self.get_density()
-        maxval = max(density.values.flatten())
-        density_norm = density / maxval
-
-        # Select all grid points with a normalized fraction >= min_density_frac
-        scanabrange = density_norm[density_norm >= min_density_frac]
-        scanabrange = (scanabrange.fillna(0) != 0).astype(int)
-
-        # Get number of grid points with value 1
-        abgridcount = scanabrange.stack().value_counts()
-        abdatapoints = float(abgridcount[1])
-
-        for case in probstats['case'].unique():
-            p = self[self['case'] == case]
-            for i in p.get_columns('prob-*'):
-                f = numpy.flipud(p[i].values.reshape(self.Sa, self.Sb))
-                if not numpy.isnan(f.sum()):
-                    pose = int(i.split('-')[-1])
-                    f = DataFrame(f)
-                    cutoff = f[f >= 0.1].fillna(0)
-                    cutoff = (cutoff != 0).astype(int)
-
-                    # Determine overlap propensity matrix and scanabrange
-                    overlap = DataFrame(cutoff.values + scanabrange.values)
-                    gridcount = overlap.stack().value_counts()
-
-                    if 2 in gridcount.index.values:
-                        totalcount = gridcount[1] + gridcount[2]
-                        overlapcount = gridcount[2] / abdatapoints
-                    else:
-                        totalcount = gridcount[1]
-                        overlapcount = 0
-
-                    probstats.loc[(probstats['case'] == case) & (probstats['pose'] == pose), 'total'] = totalcount
-                    probstats.loc[(probstats['case'] == case) & (probstats['pose'] == pose), 'overlap'] = overlapcount
+                probabilities = _scan_block(vdw, coul, self.alpha_scan_range[alpha_block],
+                                            self.beta_scan_range[beta_block], kBt=self.settings['kBt'])[1]
+            probabilities = probabilities.reshape((-1,) + shape)
+            errors = numpy.asarray(self.dg_cube[alpha_block, beta_block]).reshape(-1, self.N) - self.ref + shift
+
+            missing = numpy.isnan(probabilities)
+            valid = (numpy.abs(errors) < search)[:, :, numpy.newaxis] & ~missing
+            block_count = valid.sum(axis=0)
+
+            probabilities[missing] = 0
+            total += numpy.sum(probabilities, axis=0, where=valid)
+            numpy.minimum(minimum, numpy.min(probabilities, axis=0, where=valid, initial=numpy.inf), out=minimum)
+            numpy.maximum(maximum, numpy.max(probabilities, axis=0, where=valid, initial=-numpy.inf), out=maximum)
+
+            low = valid & (probabilities < insignificant)
+            below += low.sum(axis=0)
+            numpy.maximum(max_below, numpy.max(probabilities, axis=0, where=low, initial=-numpy.inf), out=max_below)
+            numpy.minimum(min_above, numpy.min(probabilities, axis=0, where=valid & ~low, initial=numpy.inf),
+                          out=min_above)
+
+            # First two and last two selected values
+            first, second, before_last, last = _masked_ends(probabilities, valid, block_count)
+            ends[1] = numpy.where(count == 0, second, numpy.where(count == 1, first, ends[1]))
+            ends[0] = numpy.where(count == 0, first, ends[0])
+            ends[2] = numpy.where(block_count > 1, before_last, numpy.where(block_count == 1, ends[3], ends[2]))
+            ends[3] = numpy.where(block_count > 0, last, ends[3])
+            count += block_count
+
+            # Overlap of the grid points with a pose probability >= 0.1 with
+            # scanabrange for poses available over the full grid
+            cutoff = probabilities >= 0.1
+            inrange = scanabrange[alpha_block, beta_block].reshape(-1, 1, 1)
+            union += (cutoff | inrange).sum(axis=0)
+            intersection += (cutoff & inrange).sum(axis=0)
+            complete &= ~missing.any(axis=0)
+
+        mean = total / numpy.maximum(count, 1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            slope = (0.5 * ends[1] - 1.5 * ends[0] + 1.5 * ends[3] - 0.5 * ends[2]) / count
+        slope = numpy.where(count > 1, slope, 0.0)
+        total = numpy.where(complete, union, numpy.nan)
+        overlap = numpy.where(complete, intersection / abdatapoints, numpy.nan)
+
+        # Tag poses
+        spread = (maximum - minimum) > 0.1
+        tag = numpy.full(count.shape, 3)
+        tag[spread & (slope > self.settings.grad_ascn_cutoff)] = 2
+        tag[spread & (slope < self.settings.grad_desc_cutoff)] = 1
+        insignif = mean < insignificant
+        for quantile in (0.25, 0.5, 0.75):
+            insignif &= _quantile_below(count, below, max_below, min_above, quantile, insignificant)
+        tag[insignif] = 0 if self.settings.prob_report_insignif else 3
+
+        # Report poses with selected grid points, ordered by case and pose
+        cases = self['case'].values
+        order = numpy.argsort(cases, kind='stable')
+        case_idx, pose_idx = numpy.nonzero(count[order] > 0)
+        case_idx = order[case_idx]
+
+        probstats = DataFrame({'case': cases[case_idx], 'pose': pose_idx + 1, 'tag': tag[case_idx, pose_idx],
+                               'min': minimum[case_idx, pose_idx], 'max': maximum[case_idx, pose_idx],
+                               'mean': mean[case_idx, pose_idx], 'slope': slope[case_idx, pose_idx],
+                               'total': total[case_idx, pose_idx], 'overlap': overlap[case_idx, pose_idx]},
+                              columns=['case', 'pose', 'tag', 'min', 'max', 'mean', 'slope', 'total', 'overlap'])
 
         return probstats
 
     def get_matrix(self, column='dg_calc'):
         """
         Reformat the DataFrame with cases as rows and alpha/beta scan combinations
-        as columns.
+        as columns. For a gamma scan the columns are alpha/beta/gamma
+        combinations.
 
         :param column: LIEScanDataFrame column name to reformat the data for.
                        dg_calc by default.
         :ptype column: string
         """
 
-        if column in self.columns:
-            results = DataFrame(numpy.transpose(self[column].values.reshape(self.Sa * self.Sb, self.N)),
-                                index=set(self['case']),
-                                columns=[self.alpha_scan_range.repeat(self.Smin[0]),
-                                         numpy.tile(self.beta_scan_range, self.Smin[1])])
-            results.index.name = 'case'
+        columns = [self.alpha_scan_range.repeat(self.Sb * self.Sg),
+                   numpy.tile(self.beta_scan_range.repeat(self.Sg), self.Sa)]
+        if self.Sg > 1:
+            columns.append(numpy.tile(self.gamma_scan_range, self.Sa * self.Sb))
+
+        # Fill the (cases x alpha x beta x gamma) matrix per alpha band and gamma
+        matrix = numpy.empty((self.N, self.Sa, self.Sb, self.Sg))
+        for band, block in self._cube_blocks(column):
+            block = block.transpose(2, 0, 1)
+            for index, offset in self._gamma_offsets():
+                matrix[:, band, :, index] = block + offset
+
+        results = DataFrame(matrix.reshape(self.N, -1), index=self['case'].values, columns=columns)
+        results.index.name = 'case'
+
+        return results
+
+    def get_cube(self, column='dg_calc', gamma=None):
+        """
+        Return the scan results as (alpha x beta x cases) array
+
+        The dG cube is stored for the first value of the gamma scan range only.
+        Results for other gamma values are obtained by adding the gamma offset.
+        For a gamma scan without a gamma value defined, the results are returned
+        as (alpha x beta x gamma x cases) array.
+
+        Only the stored dG values at the first gamma value are returned without
+        a copy (memory-mapped for scans written to a scan_file). Errors and
+        the results at other gamma values are new arrays of the full size.
 
-            return results
+        :param column: 'dg_calc' for the calculated dG values or 'error' for
+                       the difference between calculated and reference dG
+        :ptype column: string
+        :param gamma:  return results for the gamma scan value closest to gamma
+        :ptype gamma:  float
+        :rtype:        :numpy:ndarray
+        """
+
+        self._complete_scan()
+        if column == 'dg_calc':
+            cube = self.dg_cube
+        elif column == 'error':
+            cube = self.dg_cube - self.ref
         else:
             raise KeyError("no such column name: {0}".format(column))
 
+        offset = self.gamma_scan_range - self.gamma_scan_range[0]
+        if gamma is not None:
+            offset = offset[numpy.argmin(numpy.abs(self.gamma_scan_range - gamma))]
+            return cube + offset if offset else cube
+        if self.Sg == 1:
+            return cube
+
+        return cube[:, :, numpy.newaxis, :] + offset[:, numpy.newaxis]
+
+    def get_probabilities(self, case):
+        """
+        Return the Boltzmann probabilities of the poses of a case at every
+        alpha/beta scan combination. Taken from the stored probabilities if the
+        scan was run with the store_probabilities setting, else recalculated.
+
+        :param case: case ID
+        :ptype case: int
+        :return:     (alpha x beta x poses) array, NaN for missing poses
+        :rtype:      :numpy:ndarray
+        """
+
+        index = self.cases.index(case)
+        if getattr(self, 'prob_cube', None) is not None:
+            return self.prob_cube[:, :, index, :]
+
+        probabilities = _scan_block(numpy.asarray(self.v_vdw, dtype=float)[index:index + 1],
+                                    numpy.asarray(self.v_coul, dtype=float)[index:index + 1],
+                                    self.alpha_scan_range, self.beta_scan_range, kBt=self.settings['kBt'])[1]
+        return probabilities[:, :, 0, :]
+
     def plot(self, *args, **kwargs):
         """
         Support a number of class specific plot 'kinds'.
@@ -529,10 +1242,46 @@ class LIEScanDataFrame(LIEDataFrameBase):
         :param beta:      Beta scan range parameters as list with start, stop and
                           step size values. Default [0,1,0.01].
         :ptype beta:      list
-        :param gamma:     Gamma value to use. Default = 0
-        :ptype gamma:     float
+        :param gamma:     Gamma value to use or gamma scan range parameters as
+                          list with start, stop and step size values. Default = 0
+        :ptype gamma:     float or list
         :param kBt:       Boltzmann constant at given temperature. Default = 2.49
         :ptype kBt:       float
+        :param store_probabilities: Keep the pose probabilities for every scan
+                          combination instead of recalculating them on demand.
+                          Not used by adaptive scans.
+        :ptype store_probabilities: bool
+        :param memory_budget: Working memory in MB used to evaluate a block of
+                          the alpha/beta grid. Default = 1024
+        :ptype memory_budget: float
+        :param scan_file: Write the dG cube to this memory-mapped .npy file rather
+                          than keeping it in memory. Probabilities are written to
+                          a <scan_file>_prob.npy file. Default None
+        :ptype scan_file: str
+        :param nproc:     Number of workers evaluating alpha bands of the grid in
+                          parallel. Default = 1
+        :ptype nproc:     int
+        :param parallel:  Worker type, 'thread' (default) or 'process'. Process
+                          workers require a scan_file, threads are used otherwise.
+        :ptype parallel:  str
+        :param adaptive:  Coarse-to-fine scan only refining grid regions close
+                          to the optimum of each case. get_optimal and, for an
+                          adaptive_tol of at least 0.15, get_optimal_range use
+                          the evaluated grid points only. All other methods
+                          first evaluate the skipped grid points and return
+                          the results of a full scan. Default False
+        :ptype adaptive:  bool
+        :param adaptive_step: Coarse grid step in number of grid points. Default 8
+        :ptype adaptive_step: int
+        :param adaptive_tol: Refine grid cells that may contain an absolute dG
+                          error within adaptive_tol of the best error of a case.
+                          Default 0.25
+        :ptype adaptive_tol: float
+        :param scan_store: Directory of saved scans. Scan results for the same
+                          input data and scan settings are loaded from it (memory
+                          mapped) rather than recalculated, new results are saved
+                          to it. Default None
+        :ptype scan_store: str
         """
 
         # Update class settings from kwargs dict
@@ -548,9 +1297,17 @@ class LIEScanDataFrame(LIEDataFrameBase):
                 ",".join(list(required_columns.difference(dataframe.columns.values)))))
             return None
 
+        # Reuse a saved scan for the same input data and scan settings
+        scan_store = self.settings['scan_store']
+        if scan_store:
+            stored = os.path.join(scan_store, self._scan_hash(dataframe))
+            if os.path.isfile(os.path.join(stored, 'scan.json')):
+                logger.info("Load alpha/beta scan results from: {0}".format(stored))
+                self.load(stored)
+                return None
+
         # Register dataframe and create pivot tables for vdw, coul and reference
-        # affinity data, update settings
-        self.settings.update(kwargs)
+        # affinity data
         self.data = dataframe
         self.v_vdw = self._pivot_data(self._column_names['vdw'])
         self.v_coul = self._pivot_data(self._column_names['coul'])
@@ -560,38 +1317,301 @@ class LIEScanDataFrame(LIEDataFrameBase):
         if not self._declare_scan_parameters(self.settings['alpha'], self.settings['beta'], self.settings['gamma']):
             return None
 
-        # Create vector of alpha values.
-        # First determine alpha/beta vector multiplication factor to deal with
-        # non-square matrices (larger alpha then beta scan-range or vice-versa).
-        self.Smin = sorted([self.Sa, self.Sb])
-        if self.Sa == self.Smin[0]:
-            self.Smin = sorted(self.Smin, reverse=True)
-
-        # Multiply vector of VdW and Coul components Sa*Sb number of times
-        vdw_mult = numpy.tile(self.v_vdw, (self.Sa * self.Sb, 1))
-        coul_mult = numpy.tile(self.v_coul, (self.Sa * self.Sb, 1))
-        ref_mult = numpy.tile(self.ref, self.Sa * self.Sb)
-
-        # Calculate dG values. Returns DataFrame
-        # Alpha: Every value in scan_range vector repeated N*Smin[0] times.
-        # Beta:  Full scan_range vector repeated Smin[1] times, every value in
-        #        vector repeated N times.
-        # Gamma: All equal to initial guess repeated R times
-        dg_calc = lie_deltag([vdw_mult, coul_mult],
-                             params=[self.alpha_scan_range.repeat(self.N * self.Smin[0]),
-                                     numpy.tile(self.beta_scan_range.repeat(self.N), self.Smin[1]),
-                                     self.gamma_scan_range], kBt=self.settings['kBt'])
-
-        self[self._column_names['case']] = numpy.tile(self.data.cases, self.Sa * self.Sb)
-
-        # Copy only the values of the dg_calc DataFrame columns to self to avoid
-        # misaligned indexes. We do assume equal length columns though but that
-        # should be valid.
-        for column in dg_calc.columns:
-            self[column] = dg_calc[column].values
-        self['ref_affinity'] = ref_mult
-        self['vdw'] = vdw_mult
-        self['coul'] = coul_mult
-
-        # Calculate delta-dG values
-        self['error'] = self['dg_calc'] - ref_mult
+        # Calculate dG values as (alpha x beta x cases) cube in blocks fitting the
+        # memory budget. Write to memory-mapped .npy file(s) if scan_file defined.
+        vdw = numpy.asarray(self.v_vdw, dtype=float)
+        coul = numpy.asarray(self.v_coul, dtype=float)
+        shape = (self.Sa, self.Sb, self.N)
+        scan_file = self.settings['scan_file']
+        if scan_file:
+            self.dg_cube = numpy.lib.format.open_memmap(scan_file, mode='w+', dtype=float, shape=shape)
+            logger.info("Write alpha/beta scan results to memory-mapped file: {0}".format(scan_file))
+        else:
+            self.dg_cube = numpy.empty(shape)
+
+        self.prob_cube = None
+        if self.settings['store_probabilities'] and self.settings['adaptive']:
+            logger.info("Adaptive alpha/beta scan: pose probabilities are not stored but calculated on demand")
+        elif self.settings['store_probabilities']:
+            if scan_file:
+                self.prob_cube = numpy.lib.format.open_memmap('{0}_prob.npy'.format(os.path.splitext(scan_file)[0]),
+                                                             mode='w+', dtype=float, shape=shape + (vdw.shape[1],))
+            else:
+                self.prob_cube = numpy.empty(shape + (vdw.shape[1],))
+
+        # Adaptive coarse-to-fine scan, evaluated serially. Probabilities and
+        # skipped grid points are calculated on demand.
+        self._metadata['adaptive_pending'] = bool(self.settings['adaptive'])
+        if self.settings['adaptive']:
+            evaluated = self._adaptive_scan(vdw, coul)
+            logger.info("Adaptive alpha/beta scan evaluated {0} of {1} grid point and case combinations".format(
+                evaluated, self.R))
+        else:
+            self._evaluate_grid(vdw, coul, self.dg_cube, self.prob_cube)
+
+        for cube in (self.dg_cube, self.prob_cube):
+            if isinstance(cube, numpy.memmap):
+                cube.flush()
+        self._metadata['similarity_cache'] = {}
+
+        self[self._column_names['case']] = self.data.cases
+        self['ref_affinity'] = self.ref
+
+        if scan_store:
+            self.save(stored)
+
+    def _scan_hash(self, dataframe):
+        """
+        Hash of the scan input data and the settings defining the scan content.
+        Identifies saved scans for reuse (scan_store setting).
+
+        :param dataframe: scan input data
+        :ptype dataframe: LIEdataFrame or LIESeries
+        :return:          SHA1 hex digest
+        :rtype:           str
+        """
+
+        digest = hashlib.sha1()
+        for column in ('case', 'poses', 'vdw', 'coul', 'ref_affinity'):
+            values = numpy.atleast_1d(numpy.asarray(dataframe[self._column_names[column]], dtype=float))
+            digest.update(numpy.ascontiguousarray(values).tobytes())
+        content = dict([(key, self.settings[key]) for key in SCAN_CONTENT_SETTINGS])
+        digest.update(json.dumps(content, sort_keys=True).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def save(self, path):
+        """
+        Save the scan results to a directory
+
+        The directory contains the dG cube (dg_cube.npy), the pose probability
+        cube if stored (prob_cube.npy), the scan input energies (data.npz) and
+        the grid definition, case IDs, settings and scan hash (scan.json).
+        Saved scans are loaded using the `load` method.
+
+        :param path: directory to save the scan to, created if needed
+        :ptype path: str
+        """
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        numpy.save(os.path.join(path, 'dg_cube.npy'), self.dg_cube)
+        if getattr(self, 'prob_cube', None) is not None:
+            numpy.save(os.path.join(path, 'prob_cube.npy'), self.prob_cube)
+
+        columns = [self._column_names[column] for column in ('case', 'poses', 'vdw', 'coul', 'ref_affinity')]
+        numpy.savez(os.path.join(path, 'data.npz'),
+                    **dict([(column, numpy.atleast_1d(numpy.asarray(self.data[column]))) for column in columns]))
+
+        metadata = {'version': SCAN_FORMAT_VERSION,
+                    'hash': self._scan_hash(self.data),
+                    'cases': [int(case) for case in self.cases],
+                    'alpha': self.alpha_scan_range.tolist(),
+                    'beta': self.beta_scan_range.tolist(),
+                    'gamma': self.gamma_scan_range.tolist(),
+                    'settings': self.settings.dict()}
+        with open(os.path.join(path, 'scan.json'), 'w') as fileobject:
+            json.dump(metadata, fileobject, indent=2)
+
+        logger.info("Saved alpha/beta scan results to: {0}".format(path))
+
+    def load(self, path, mmap=True):
+        """
+        Load scan results saved using the `save` method
+
+        :param path: directory with saved scan results
+        :ptype path: str
+        :param mmap: load the dG and probability cubes as copy-on-write
+                     memory-mapped arrays rather than reading them into memory.
+                     Changes to the cubes, including those made by add_cases
+                     and drop_cases, are kept in memory and never written back
+                     to the saved scan.
+        :ptype mmap: bool
+        """
+
+        with open(os.path.join(path, 'scan.json')) as fileobject:
+            metadata = json.load(fileobject)
+        assert metadata.get('version') == SCAN_FORMAT_VERSION, \
+            "Unsupported scan format version: {0}".format(metadata.get('version'))
+
+        self.settings.update(dict([(key, metadata['settings'][key]) for key in SCAN_CONTENT_SETTINGS]))
+
+        self.alpha_scan_range = numpy.array(metadata['alpha'])
+        self.beta_scan_range = numpy.array(metadata['beta'])
+        self.gamma_scan_range = numpy.array(metadata['gamma'])
+        self.Sa = self.alpha_scan_range.size
+        self.Sb = self.beta_scan_range.size
+        self.Sg = self.gamma_scan_range.size
+
+        data = numpy.load(os.path.join(path, 'data.npz'))
+        self._update_cases(LIEDataFrame(DataFrame(dict([(column, data[column]) for column in data.files]))))
+        assert self.cases == metadata['cases'], "Saved scan cases do not match saved input data"
+
+        mmap_mode = 'c' if mmap else None
+        self.dg_cube = numpy.load(os.path.join(path, 'dg_cube.npy'), mmap_mode=mmap_mode)
+        self._metadata['adaptive_pending'] = bool(self.settings['adaptive'])
+        self.prob_cube = None
+        if os.path.isfile(os.path.join(path, 'prob_cube.npy')):
+            self.prob_cube = numpy.load(os.path.join(path, 'prob_cube.npy'), mmap_mode=mmap_mode)
+        self._metadata['similarity_cache'] = {}
+
+    @staticmethod
+    def _cube_file(cube):
+        """
+        File name of a scan cube memory-mapped for writing, None for cubes held
+        in memory and for read-only or copy-on-write cubes of a loaded scan.
+        """
+
+        if isinstance(cube, numpy.memmap) and cube.mode in ('r+', 'w+'):
+            return cube.filename
+
+        return None
+
+    def _resize_cases(self, cube, source, target, shape, filename=None):
+        """
+        Copy the cases at index source of a scan cube to index target of a new
+        cube, other values are NaN. Memory-mapped cubes are copied per alpha
+        row to a new .npy file that replaces filename.
+
+        :param cube:     (alpha x beta x cases [x poses]) array
+        :ptype cube:     :numpy:ndarray
+        :param source:   case indices in cube
+        :ptype source:   :numpy:ndarray
+        :param target:   case indices in the new cube
+        :ptype target:   :numpy:ndarray
+        :param shape:    shape of the new cube
+        :ptype shape:    tuple
+        :param filename: memory-mapped .npy file of the cube
+        :ptype filename: str
+        :return:         new cube
+        :rtype:          :numpy:ndarray
+        """
+
+        if filename:
+            tmpfile = '{0}.tmp.npy'.format(os.path.splitext(filename)[0])
+            resized = numpy.lib.format.open_memmap(tmpfile, mode='w+', dtype=float, shape=shape)
+        else:
+            resized = numpy.empty(shape)
+
+        poses = tuple(slice(0, min(old, new)) for old, new in zip(cube.shape[3:], shape[3:]))
+        for row in range(self.Sa):
+            band = resized[row]
+            band[:] = numpy.nan
+            band[(slice(None), target) + poses] = cube[row][(slice(None), source) + poses]
+
+        if filename:
+            resized.flush()
+            del resized
+            replace(tmpfile, filename)
+            resized = numpy.lib.format.open_memmap(filename, mode='r+')
+
+        return resized
+
+    def _update_cases(self, data):
+        """
+        Register new scan input data and update the pivot tables, case
+        count and case rows of the scan results frame.
+
+        :param data: 'vdw' and 'coul' data of all cases in the scan
+        :ptype data: LIEDataFrame
+        """
+
+        self.data = data
+        self.v_vdw = self._pivot_data(self._column_names['vdw'])
+        self.v_coul = self._pivot_data(self._column_names['coul'])
+        self.ref = self._pivot_data(self._column_names['ref_affinity']).mean(axis=1).values
+        self.N = len(data.cases)
+        self.R = (self.Sa * self.Sb) * self.N
+
+        if len(self) != self.N:
+            self._update_inplace(self.reindex(range(self.N)))
+        self[self._column_names['case']] = data.cases
+        self['ref_affinity'] = self.ref
+
+    def add_cases(self, dataframe):
+        """
+        Add cases to the scan results
+
+        Only the alpha/beta grid of the new cases is evaluated. Stored pose
+        probabilities and cached similarity matrices are extended with the new
+        cases reusing the distances between existing cases. Density, optimal
+        values and pose propensities are calculated on demand from the scan
+        cube and reflect the new cases directly.
+
+        :param dataframe: Van der Waals and Coulomb data of the new cases
+        :ptype dataframe: LIEDataFrame
+        """
+
+        assert isinstance(dataframe, LIEDataFrame) and isinstance(self.data, LIEDataFrame), \
+            "add_cases requires LIEDataFrame scan input"
+        assert not set(dataframe.cases).intersection(self.cases), \
+            "Cases already in scan: {0}".format(sorted(set(dataframe.cases).intersection(self.cases)))
+
+        old_cases = self.cases
+        self._update_cases(LIEDataFrame(concat([self.data, dataframe], ignore_index=True)))
+        source = numpy.searchsorted(self.cases, old_cases)
+        target = numpy.searchsorted(self.cases, dataframe.cases)
+        logger.info("Add {0} cases to alpha/beta scan of {1} cases".format(len(target), len(source)))
+
+        # Evaluate the alpha/beta grid for the new cases only
+        vdw = numpy.asarray(self.v_vdw, dtype=float)[target]
+        coul = numpy.asarray(self.v_coul, dtype=float)[target]
+        dg_cube = numpy.empty((self.Sa, self.Sb, len(target)))
+        prob_cube = None
+        if getattr(self, 'prob_cube', None) is not None:
+            prob_cube = numpy.empty(dg_cube.shape + (vdw.shape[1],))
+        self._evaluate_grid(vdw, coul, dg_cube, prob_cube)
+
+        # Insert the new cases into the scan cubes
+        self.dg_cube = self._resize_cases(self.dg_cube, numpy.arange(len(source)), source,
+                                          (self.Sa, self.Sb, self.N), self._cube_file(self.dg_cube))
+        self.dg_cube[:, :, target] = dg_cube
+        if prob_cube is not None:
+            self.prob_cube = self._resize_cases(self.prob_cube, numpy.arange(len(source)), source,
+                                                (self.Sa, self.Sb, self.N, vdw.shape[1]),
+                                                self._cube_file(self.prob_cube))
+            self.prob_cube[:, :, target] = prob_cube
+
+        # Extend cached similarity matrices with the distances of the new cases
+        cache = self._metadata.get('similarity_cache', {})
+        for (metric, dtype), distances in cache.items():
+            square = numpy.zeros((self.N, self.N), dtype=distances.dtype)
+            square[numpy.ix_(source, source)] = squareform(distances, checks=False)
+            rows = self._case_distances(target, metric, dtype)
+            square[target] = rows
+            square[:, target] = rows.T
+            cache[(metric, dtype)] = squareform(square, checks=False)
+
+    def drop_cases(self, cases):
+        """
+        Remove cases from the scan results
+
+        The scan cubes and cached similarity matrices are reduced to the
+        remaining cases without recalculation.
+
+        :param cases: case IDs to remove
+        :ptype cases: :py:list
+        """
+
+        assert isinstance(self.data, LIEDataFrame), "drop_cases requires LIEDataFrame scan input"
+        assert set(cases).issubset(self.cases), \
+            "Cases not in scan: {0}".format(sorted(set(cases).difference(self.cases)))
+
+        old_cases = self.cases
+        data = self.data[~self.data[self._column_names['case']].isin(cases)]
+        self._update_cases(LIEDataFrame(data))
+        source = numpy.searchsorted(old_cases, self.cases)
+        target = numpy.arange(self.N)
+        logger.info("Remove {0} cases from alpha/beta scan".format(len(old_cases) - self.N))
+
+        self.dg_cube = self._resize_cases(self.dg_cube, source, target, (self.Sa, self.Sb, self.N),
+                                          self._cube_file(self.dg_cube))
+        if getattr(self, 'prob_cube', None) is not None:
+            self.prob_cube = self._resize_cases(self.prob_cube, source, target,
+                                                (self.Sa, self.Sb, self.N, self.v_vdw.shape[1]),
+                                                self._cube_file(self.prob_cube))
+
+        cache = self._metadata.get('similarity_cache', {})
+        for key, distances in cache.items():
+            cache[key] = squareform(squareform(distances, checks=False)[numpy.ix_(source, source)], checks=False)
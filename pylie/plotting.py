@@ -149,21 +149,23 @@ def plot_scan_error(dataframe, **kwargs):
     # Determine number of cases
     nr = len(set(dataframe[dataframe._column_names['case']].values))
 
-    # Reshape in (N,Sa*Sb) matrix
-    if kwargs.get('absolute', True):
-        data = abs(dataframe['error']).values.reshape(dataframe.Sa * dataframe.Sb, nr)
-    else:
-        data = dataframe['error'].values.reshape(dataframe.Sa * dataframe.Sb, nr)
+    # Calculate Root Mean Squared Error, lowest over the gamma scan range, per
+    # alpha band and gamma value of the scan cube
+    offsets = dataframe._gamma_offsets(kwargs.pop('gamma', None))
+    scanmatrix = numpy.full((dataframe.Sa, dataframe.Sb), numpy.inf)
+    limits = []
+    for band, block in dataframe._cube_blocks('error'):
+        for index, offset in offsets:
+            data = block + offset
+            if kwargs.get('absolute', True):
+                data = abs(data)
+            limits.append((numpy.min(data), numpy.max(data)))
+            numpy.minimum(scanmatrix[band], numpy.sqrt(numpy.mean(data ** 2, axis=2)), out=scanmatrix[band])
 
     # Set upper and lower tolerance limit if not set
-    ltol = kwargs.get('ltol', numpy.min(data))
-    utol = kwargs.get('utol', numpy.max(data))
-
-    # Calculate Root Mean Squared Error
-    scanmatrix = numpy.zeros((dataframe.Sa, dataframe.Sb))
-    for i in range(0, nr):
-        scanmatrix = scanmatrix + numpy.power(data[:, i].reshape(dataframe.Sa, dataframe.Sb), 2)
-    scanmatrix = numpy.sqrt(scanmatrix / nr)
+    ltol = kwargs.get('ltol', numpy.min(limits, axis=0)[0])
+    utol = kwargs.get('utol', numpy.max(limits, axis=0)[1])
+
     scanmatrix[scanmatrix <= ltol] = ltol
     scanmatrix[scanmatrix >= utol] = utol
 
@@ -225,25 +227,12 @@ def plot_scan_density(dataframe, **kwargs):
     # Determine number of cases
     nr = len(set(dataframe[dataframe._column_names['case']].values))
 
-    # Reshape in (N,Sa*Sb) matrix
-    data = dataframe['error'].values.reshape(dataframe.Sa * dataframe.Sb, nr)
-    if kwargs.get('absolute', False):
-        data = numpy.absolute(dGdiff)
-
-    # Set upper and lower tolerance limit if not set. Use cutoff of 5% between
-    # minimum and maximum value in dataet
-    ltol = kwargs.get('ltol', numpy.min(data) * 0.05)
-    utol = kwargs.get('utol', numpy.max(data) * 0.05)
-
-    # Make new matrix of size (alpha range x beta range) and add reshaped
-    # identity matrixes for each case. Identity matrix is determined as 1 for
-    # all cases with gamma residual in range ltol <= x <= utol, and 0 outside.
-    identmatr = ((data >= ltol) & (data <= utol)).astype(int)
-    ident_matrix_cases = identmatr * numpy.arange(1, nr + 1).reshape(1, nr)
-    scanmatrix = numpy.zeros((dataframe.Sa, dataframe.Sb))
-    for i in range(1, nr + 1):
-        scanmatrix = scanmatrix + numpy.sum((ident_matrix_cases == i).astype(int), axis=1).reshape(dataframe.Sa,
-                                                                                                   dataframe.Sb)
+    # Count the cases with gamma residual in range ltol <= x <= utol for every
+    # alpha/beta(/gamma) combination, highest count over the gamma range.
+    # Tolerance limits default to 5% of the minimum and maximum value in the dataset
+    scanmatrix, ltol, utol = dataframe._density(ltol=kwargs.get('ltol'), utol=kwargs.get('utol'),
+                                                absolute=kwargs.get('absolute', False), gamma=kwargs.pop('gamma', None))
+    scanmatrix = scanmatrix.astype(float)
 
     # Transform counts into percentages
     scanmatrix = (scanmatrix / nr) * 100
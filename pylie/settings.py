@@ -9,12 +9,27 @@ PYLIE_MASTER_CONFIG = {
     'Global.plotFileType': 'pdf',  # Filetype for plots saved to disk
     'Global.rlm_outlier_cutoff': 0.8,  # Outlier detection limit for Robust Linear Regression weights
 
+    # ResultCache:
+    'ResultCache.maxsize': 0,  # Memory tier size in MB of the shared result cache, 0 disables the memory tier
+    'ResultCache.directory': None,  # Directory of the on-disk tier of the shared result cache, None disables it
+    'ResultCache.disk_maxsize': 4096,  # Disk tier size in MB of the shared result cache
+
     # LIEScanDataFrame:
     'LIEScanDataFrame.max_combinations': 100000000,
     'LIEScanDataFrame.alpha': [0, 1.01, 0.01],
     'LIEScanDataFrame.beta': [0, 1.01, 0.01],
-    'LIEScanDataFrame.gamma': 0,
+    'LIEScanDataFrame.gamma': 0,  # Fixed gamma value or [start, stop, step] gamma scan range
+    'LIEScanDataFrame.store_probabilities': False,  # Keep pose probabilities of all scan points, else recalculated on demand
+    'LIEScanDataFrame.memory_budget': 1024,  # Working memory in MB for evaluating a block of the scan grid
+    'LIEScanDataFrame.scan_file': None,  # Memory-mapped .npy file to write the scan cube to, None keeps it in memory
+    'LIEScanDataFrame.scan_store': None,  # Directory of saved scans reused for identical input data and scan settings
+    'LIEScanDataFrame.nproc': 1,  # Number of parallel scan workers
+    'LIEScanDataFrame.parallel': 'thread',  # Scan worker type: 'thread' or 'process' (requires scan_file)
+    'LIEScanDataFrame.adaptive': False,  # Coarse-to-fine scan refining only near the optimum of each case
+    'LIEScanDataFrame.adaptive_step': 8,  # Coarse grid step of the adaptive scan in grid points
+    'LIEScanDataFrame.adaptive_tol': 0.25,  # Refine where the dG error may be within this tolerance of the case optimum
     'LIEScanDataFrame.pdist_metric': 'euclidean',
+    'LIEScanDataFrame.similarity_dtype': 'float64',  # Precision of the full scan similarity matrix, 'float32' for large scans
     'LIEScanDataFrame.linkage_metric': 'euclidean',
     'LIEScanDataFrame.linkage_method': 'complete',
     'LIEScanDataFrame.cluster_method': 'vector',
@@ -32,12 +47,22 @@ PYLIE_MASTER_CONFIG = {
     'LIEModelBuilder.minclustersize': 8,
     'LIEModelBuilder.model_cols': ['vdw', 'coul'],
     'LIEModelBuilder.window_size': 4,
+    'LIEModelBuilder.optimizer': 'iterative',  # 'iterative' fixed-point, 'lm' Levenberg-Marquardt or 'gn' Gauss-Newton
+    'LIEModelBuilder.lm_damping': 1.0e-3,  # Initial Levenberg-Marquardt damping factor
+    'LIEModelBuilder.acceleration': None,  # Iterative optimizer convergence acceleration: None, 'anderson' or 'aitken'
+    'LIEModelBuilder.acceleration_depth': 3,  # Anderson mixing history depth
+    'LIEModelBuilder.keep_trace': False,  # Keep optimizer iteration history of every model, see gettrace
+    'LIEModelBuilder.use_cache': True,  # Reuse optimizer runs and deltaG values from the shared pylie_cache if enabled
+    'LIEModelBuilder.nproc': 1,  # Number of worker processes building the models of batchmodel and mcresample chains
+    'LIEModelBuilder.warm_start': False,  # Start cross-validation folds and mcresample moves from the parent model parameters
     'LIEModelBuilder.param_scale': 0.1,
     'LIEModelBuilder.max_error_steps': 50,
     'LIEModelBuilder.max_dw_cutoff': 0.1,
     'LIEModelBuilder.max_iter_steps': 500,
     'LIEModelBuilder.mc_rand_sample_draw': 0.2,
     'LIEModelBuilder.mc_filter_tol': 0.9,
+    'LIEModelBuilder.mc_chains': 1,  # Number of independent mcresample chains
+    'LIEModelBuilder.mc_seed': None,  # Random seed for the mcresample chains
     'LIEModelBuilder.random_add': True,
     'LIEModelBuilder.max_deviation': 0.8,
     'LIEModelBuilder.usefilter': True,
@@ -6,7 +6,7 @@ file: wamp_services.py
 WAMP service methods the module exposes.
 """
 
-import dill
+import base64
 import os
 import sys
 
@@ -14,7 +14,7 @@ from pandas import (read_csv, read_json, read_excel, read_table, concat, DataFra
 from pylie import (LIEMDFrame, LIEDataFrame, pylie_config)
 from pylie.filters.filtersplines import FilterSplines
 from pylie.filters.filtergaussian import FilterGaussian
-from pylie.methods.adan import (ad_residue_decomp, ad_dene, ad_dene_yrange, parse_gromacs_decomp)
+from pylie.methods.adan import (ad_residue_decomp, ad_dene, ad_dene_yrange, parse_gromacs_decomp, load_adan_model)
 
 from autobahn.wamp import RegisterOptions
 from mdstudio.api.endpoint import endpoint
@@ -55,6 +55,41 @@ class PylieWampApi(ComponentSession):
 
         return file_content
 
+    @staticmethod
+    def get_model(request):
+        """
+        Load the eTOX ALLIES model artifact of a request, inline or memory
+        mapped from file. Inline content is decoded according to the
+        path_file encoding, base64 or a text encoding of the raw bytes.
+
+        Pickled models, formerly passed as 'model_pkl', are refused.
+        """
+
+        if request.get(u'model_pkl') is not None:
+            raise ValueError("Pickled 'model_pkl' models are no longer supported, convert the model using "
+                             "pylie.methods.adan.save_adan_model and pass the artifact as 'model'")
+
+        path_file = request.get(u'model')
+        if path_file is None:
+            raise IOError('Model file not defined')
+
+        model_content = path_file['content']
+        if model_content is not None:
+            encoding = path_file.get('encoding') or 'utf8'
+            if encoding == 'base64':
+                model_content = base64.b64decode(model_content)
+            elif not isinstance(model_content, bytes):
+                model_content = model_content.encode(encoding)
+            return load_adan_model(model_content)
+
+        if path_file['path']:
+            if os.path.isfile(path_file['path']):
+                return load_adan_model(path_file['path'], mmap_file=True)
+            else:
+                raise IOError('Model file not found: {0}'.format(path_file['path']))
+
+        raise IOError('Model file not defined')
+
     def _get_config(self, config, name):
 
         ref_config = pylie_config.get(name).dict()
@@ -350,8 +385,7 @@ class PylieWampApi(ComponentSession):
         """
 
         # Load the model
-        binary = self.get_file_content(request[u'model_pkl'])
-        model = dill.loads(binary)
+        model = self.get_model(request)
 
         # Parse gromacs residue decomposition energy files to DataFrame
         decomp_dfs = []
@@ -361,7 +395,7 @@ class PylieWampApi(ComponentSession):
 
         # Run AD test
         ene = ad_residue_decomp(
-            decomp_dfs, model['AD']['decVdw'], model['AD']['decEle'], cases=request[u'cases'])
+            decomp_dfs, model['decVdw'], model['decEle'], cases=request[u'cases'])
 
         # Use absolute path to save file
         workdir = os.path.abspath(request[u'workdir'])
@@ -382,15 +416,14 @@ class PylieWampApi(ComponentSession):
         """
 
         # Load the model
-        binary = self.get_file_content(request[u'model_pkl'])
-        model = dill.loads(binary)
+        model = self.get_model(request)
 
         # Parse gromacs residue decomposition energy files to DataFrame
         file_string = StringIO(self.get_file_content(request[u'dataframe']))
         dfobject = self._import_to_dataframe(file_string)
 
         # Run AD test
-        ene = ad_dene(dfobject, model['AD']['Dene']['CovMatrix'],
+        ene = ad_dene(dfobject, model['Dene'],
             center=request[u'center'], ci_cutoff=request[u'ci_cutoff'])
 
         # Use absolute path to save file
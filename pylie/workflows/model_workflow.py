@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import numpy
-import pandas
 
 from pylie import pylie_config
 from pylie import LIEModelBuilder, LIEScanDataFrame
@@ -125,67 +123,10 @@ class ModelWorkflow(object):
         """
 
         # Remove duplicate regression models
-        duplicate_set = []
-        indexes = []
-        for idx, row in models.iterrows():
-            if not row['set'] in duplicate_set:
-                duplicate_set.append(row['set'])
-                indexes.append(idx)
-        filtered = models.loc[indexes]
+        duplicates = models.duplicates()
+        filtered = models.drop(duplicates)
 
         print("removed {0} identical regression models from a dataset with {1} models".format(
-            len(models) - len(indexes), len(models)))
-
-        # Get occurrence weights for each case
-        # - Frequency of occurrence of case in all of the models divided by model count
-        total_models = len(filtered)
-        case_weight = [b for i in filtered['set'] for b in i]
-        case_weight = dict([(x, float(case_weight.count(x)) / total_models) for x in case_weight])
-
-        # Get alpha / beta value for the largest model
-        abmax = filtered.sort('N', ascending=[0]).head(1)
-        abmax = abmax[['alpha', 'beta']]
-
-        # Get path
-        matrix = {}
-        count = 1
-        index = []
-        for idx1, row1 in filtered.sort('rmsd').iterrows():
-
-            a = set(row1['set'])
-            gdiff1 = abs(abmax - row1[['alpha', 'beta']])
-            scores = []
-            for idx2, row2 in filtered.sort('rmsd').iterrows():
-
-                # Calculate symmetric difference between two sets and divide by total set.
-                # Represent each case according to there frequency of occurance and sum the lists.
-                # NOTE: Frequency of occurrence assumes that the base set was constructed using
-                # a homogeneous sampling.
-                b = set(row2['set'])
-                diff = [1 - case_weight[n] for n in a.symmetric_difference(b)]
-                if diff:
-                    diff = sum(diff) / sum([1 - case_weight[n] for n in a.union(b)])
-                else:
-                    diff = 0
-
-                # Calculate difference in alpha/beta parameters.
-                gdiff2 = abs(abmax - row2[['alpha', 'beta']])
-                if (gdiff1 + gdiff2).sum(axis=1).values > 0:
-                    abdiff = (abs(row1[['alpha', 'beta']] - row2[['alpha', 'beta']]) / (gdiff1 + gdiff2)).sum(axis=1)
-                    abdiff = abdiff.values
-                else:
-                    abdiff = numpy.array([0.0, 0.0])
-
-                # Sum normalized differences
-                score = abdiff + diff
-                scores.append((score / 3)[0])
-
-            matrix[count] = scores
-            index.append(idx1)
-            count += 1
-
-        df = pandas.DataFrame(matrix)
-        df.columns = index
-        df.index = index
-
-        return df
+            len(duplicates), len(models)))
+
+        return filtered.model_similarity()
@@ -42,7 +42,7 @@ setup(
     py_modules=[distribution_name],
     test_suite="tests",
     install_requires=[
-        'dill', 'numpy', 'pandas', 'statsmodels', 'jsonschema', 'matplotlib',
+        'numpy', 'pandas', 'statsmodels', 'jsonschema', 'matplotlib',
         'scikit-learn', 'openpyxl'],
     include_package_data=True,
     zip_safe=True,
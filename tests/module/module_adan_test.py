@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_adan_test.py
+
+Test the pylie eTOX ALLIES applicability domain analysis model artifact
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from pandas import DataFrame
+from sklearn.covariance import EmpiricalCovariance
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from pylie.methods.adan import save_adan_model, load_adan_model, ad_residue_decomp, ad_dene
+
+
+class TestADANModel(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Train PCA and covariance models on random energy profiles
+        """
+
+        rng = numpy.random.RandomState(1)
+        self.decomp = [DataFrame({'vdw': rng.normal(-1, 0.5, 20), 'ele': rng.normal(-2, 1, 20)}) for i in range(30)]
+
+        self.model = {'LIE': {'params': [0.59, 0.31, 0.0]}, 'AD': {}}
+        for key, column, n_pc in (('decVdw', 'vdw', 3), ('decEle', 'ele', 4)):
+            train = numpy.array([df[column].values for df in self.decomp])
+            scaler = StandardScaler().fit(train)
+            pca = PCA().fit(scaler.transform(train))
+            self.model['AD'][key] = {'scaler': scaler, 'pca': pca, 'n_pc': n_pc,
+                                     'sdev': numpy.sqrt(pca.explained_variance_[:n_pc]),
+                                     'critSD': 2.0, 'critOD': 2.5}
+
+        self.energies = DataFrame({'w_vdw': rng.normal(-40, 5, 10), 'w_coul': rng.normal(10, 3, 10)})
+        self.model['AD']['Dene'] = {'CovMatrix': EmpiricalCovariance().fit(self.energies.values)}
+
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def test_adan_model_artifact(self):
+        """
+        Test AD analysis using a stored model artifact, read and memory mapped
+        """
+
+        path = os.path.join(self.workdir, 'model.npz')
+        save_adan_model(self.model, path)
+
+        expected = ad_residue_decomp(self.decomp, self.model['AD']['decVdw'], self.model['AD']['decEle'])
+        mahal = self.model['AD']['Dene']['CovMatrix'].mahalanobis(self.energies.values)
+
+        with open(path, 'rb') as stream:
+            content = stream.read()
+        for model in (load_adan_model(path), load_adan_model(path, mmap_file=True), load_adan_model(content)):
+            self.assertEqual(model['version'], 1)
+            self.assertEqual(list(model['params']), [0.59, 0.31, 0.0])
+            self.assertFalse(model['decVdw']['components'].flags.writeable)
+
+            results = ad_residue_decomp(self.decomp, model['decVdw'], model['decEle'])
+            self.assertTrue(numpy.allclose(results.values, expected.values))
+
+            dene = ad_dene(self.energies.copy(), model['Dene'], ci_cutoff=3)
+            self.assertTrue(numpy.allclose(dene['mahal'], mahal))
+            self.assertEqual(list(dene['CI']), list((mahal >= 3).astype(int)))
+
+    def test_adan_model_artifact_untrusted(self):
+        """
+        Test refusal of pickled objects and unknown artifact formats
+        """
+
+        stream = io.BytesIO()
+        numpy.savez(stream, format=numpy.array('pylie.adan'), version=numpy.array(1),
+                    params=numpy.array([{'unsafe': True}], dtype=object))
+        self.assertRaises(ValueError, load_adan_model, stream.getvalue())
+
+        stream = io.BytesIO()
+        numpy.savez(stream, params=numpy.array([0.5, 0.5]))
+        self.assertRaises(ValueError, load_adan_model, stream.getvalue())
+
+        # Artifacts of newer format versions
+        stream = io.BytesIO()
+        save_adan_model(self.model, stream)
+        stream.seek(0)
+        arrays = dict(numpy.load(stream, allow_pickle=False).items())
+        arrays['version'] = numpy.array(2)
+        stream = io.BytesIO()
+        numpy.savez(stream, **arrays)
+        self.assertRaises(ValueError, load_adan_model, stream.getvalue())
+
+        # Artifacts missing arrays
+        arrays['version'] = numpy.array(1)
+        del arrays['dene_precision']
+        stream = io.BytesIO()
+        numpy.savez(stream, **arrays)
+        with self.assertRaises(ValueError) as context:
+            load_adan_model(stream.getvalue())
+        self.assertIn('dene_precision', str(context.exception))
+
+        # Crafted array headers: unknown .npy version, data beyond the member
+        stream = io.BytesIO()
+        save_adan_model(self.model, stream)
+        content = stream.getvalue()
+        for old, new, message in ((b'\x93NUMPY\x01\x00', b'\x93NUMPY\x03\x00', 'format version'),
+                                  (b"'shape': (3,)", b"'shape': (9,)", 'beyond')):
+            with self.assertRaises(ValueError) as context:
+                load_adan_model(content.replace(old, new))
+            self.assertIn(message, str(context.exception))
+
+        # Artifact content is not taken for a file path
+        self.assertRaises(ValueError, load_adan_model, content, mmap_file=True)
@@ -7,9 +7,13 @@ Test the pylie LIEScanDataFrame methods
 """
 
 import os
+import shutil
+import tempfile
 import unittest
+import numpy
 
 from pandas import DataFrame, read_csv
+from scipy.spatial.distance import pdist
 
 from pylie import LIEScanDataFrame, LIEDataFrame
 
@@ -29,6 +33,7 @@ class TestLIEScanDataFrame(unittest.TestCase):
         if 'Unnamed: 0' in liedata:
             del liedata['Unnamed: 0']
 
+        self.liedata = liedata
         self.abscan = LIEScanDataFrame()
         self.abscan.scan(liedata)
 
@@ -66,6 +71,211 @@ class TestLIEScanDataFrame(unittest.TestCase):
         matrix = self.abscan.get_matrix()
         self.assertEqual(matrix.shape, (len(self.abscan.cases), self.abscan.Sa * self.abscan.Sb))
 
+    def test_scanframe_get_cube(self):
+        """
+        Test the alpha x beta x cases scan result cube and the pose
+        probabilities calculated on demand.
+        """
+
+        cube = self.abscan.get_cube()
+        self.assertEqual(cube.shape, (self.abscan.Sa, self.abscan.Sb, len(self.abscan.cases)))
+        self.assertEqual(len(self.abscan), len(self.abscan.cases))
+        self.assertTrue(numpy.allclose(self.abscan.get_cube('error'), cube - self.abscan['ref_affinity'].values))
+        self.assertTrue(numpy.allclose(self.abscan.get_matrix().values, cube.reshape(-1, cube.shape[2]).T))
+
+        probabilities = self.abscan.get_probabilities(self.abscan.cases[0])
+        self.assertEqual(probabilities.shape[:2], (self.abscan.Sa, self.abscan.Sb))
+        self.assertTrue(numpy.allclose(numpy.nansum(probabilities, axis=2), 1))
+
+    def test_scanframe_memmap_scan(self):
+        """
+        Test a scan evaluated in blocks within a small memory budget and
+        written to a memory-mapped .npy file.
+        """
+
+        scan_file = os.path.join(self.filepath, 'alphabetascan.npy')
+        self.tempfiles.extend([scan_file, os.path.join(self.filepath, 'alphabetascan_prob.npy')])
+
+        for budget in (1, 0.01):
+            abscan = LIEScanDataFrame()
+            abscan.scan(self.liedata, memory_budget=budget, scan_file=scan_file, store_probabilities=True)
+
+            self.assertIsInstance(abscan.get_cube(), numpy.memmap)
+            self.assertTrue(numpy.allclose(numpy.load(scan_file), self.abscan.get_cube()))
+            self.assertTrue(numpy.allclose(abscan.get_probabilities(abscan.cases[0]),
+                                           self.abscan.get_probabilities(abscan.cases[0]), equal_nan=True))
+
+    def test_scanframe_parallel_scan(self):
+        """
+        Test alpha/beta scans evaluated by thread and process workers
+        """
+
+        scan_file = os.path.join(self.filepath, 'alphabetascan.npy')
+        self.tempfiles.append(scan_file)
+
+        for parallel in ('thread', 'process'):
+            abscan = LIEScanDataFrame()
+            abscan.scan(self.liedata, nproc=2, parallel=parallel, scan_file=scan_file if parallel == 'process' else None)
+
+            self.assertTrue(numpy.allclose(abscan.get_cube(), self.abscan.get_cube()))
+
+    def test_scanframe_adaptive_scan(self):
+        """
+        Test that the adaptive coarse-to-fine scan finds the same optimal
+        alpha/beta values and ranges as the full scan and that methods using
+        the full grid return the full scan results.
+        """
+
+        abscan = LIEScanDataFrame()
+        abscan.scan(self.liedata, adaptive=True)
+
+        self.assertTrue(numpy.isnan(abscan.dg_cube).any())
+        self.assertTrue(numpy.allclose(abscan.get_optimal().values, self.abscan.get_optimal().values))
+        self.assertTrue(numpy.allclose(abscan.get_optimal_range().values, self.abscan.get_optimal_range().values))
+        self.assertTrue(numpy.isnan(abscan.dg_cube).any())
+
+        self.assertTrue(numpy.array_equal(abscan.get_density().values, self.abscan.get_density().values))
+        self.assertFalse(numpy.isnan(abscan.dg_cube).any())
+        self.assertTrue(numpy.allclose(abscan.get_cube(), self.abscan.get_cube()))
+
+        propd = abscan.propensity_distribution()
+        reference = self.abscan.propensity_distribution()
+        columns = ['case', 'pose', 'tag']
+        self.assertTrue(numpy.array_equal(propd[columns].values, reference[columns].values))
+        self.assertTrue(numpy.allclose(propd[['total', 'overlap']].values, reference[['total', 'overlap']].values,
+                                       equal_nan=True))
+
+        clusters = abscan.cluster(cluster_method='full')
+        self.assertTrue(numpy.array_equal(clusters.values, self.abscan.cluster(cluster_method='full').values))
+
+        # Probabilities are not stored for adaptive scans, no probability file
+        scan_file = os.path.join(self.filepath, 'alphabetascan.npy')
+        prob_file = os.path.join(self.filepath, 'alphabetascan_prob.npy')
+        self.tempfiles.extend([scan_file, prob_file])
+        abscan = LIEScanDataFrame()
+        abscan.scan(self.liedata, adaptive=True, store_probabilities=True, scan_file=scan_file)
+        self.assertIsNone(abscan.prob_cube)
+        self.assertFalse(os.path.exists(prob_file))
+
+    def test_scanframe_gamma_scan(self):
+        """
+        Test alpha/beta/gamma scan results against scans with a fixed gamma
+        value and against a brute force search of the optimal parameters.
+        """
+
+        abscan = LIEScanDataFrame()
+        abscan.scan(self.liedata, gamma=[-2, 2.01, 0.5])
+
+        cube = abscan.get_cube('error')
+        self.assertEqual(cube.shape, (abscan.Sa, abscan.Sb, abscan.Sg, len(abscan.cases)))
+        self.assertEqual(abscan.get_matrix().shape, (len(abscan.cases), abscan.Sa * abscan.Sb * abscan.Sg))
+
+        fixed = LIEScanDataFrame()
+        fixed.scan(self.liedata, gamma=1.5)
+        self.assertTrue(numpy.allclose(abscan.get_cube('error', gamma=1.5), fixed.get_cube('error')))
+
+        optimal = abscan.get_optimal()
+        self.assertEqual(sorted(optimal.columns), ['alpha', 'beta', 'error', 'gamma'])
+        brute = numpy.nanmin(numpy.abs(cube.reshape(-1, len(abscan.cases))), axis=0)
+        self.assertTrue(numpy.allclose(optimal['error'].abs().values, brute))
+
+        # Reductions over gamma slices and alpha bands of the cube
+        abscan.settings.memory_budget = 0.05
+        density = ((cube >= -1) & (cube <= 1)).sum(axis=3).max(axis=2)
+        self.assertTrue(numpy.array_equal(numpy.flipud(abscan.get_density(ltol=-1, utol=1).values), density))
+        self.assertTrue(numpy.array_equal(abscan.get_matrix('error').values, cube.reshape(-1, len(abscan.cases)).T))
+
+    def test_scanframe_similarity_matrix(self):
+        """
+        Test the cached similarity matrix against scipy pdist for the full
+        scan, in memory blocks and single precision.
+        """
+
+        dgcalc = self.abscan.get_cube().reshape(-1, len(self.abscan.cases)).T
+        for metric in ('correlation', 'euclidean', 'cityblock'):
+            reference = pdist(dgcalc, metric=metric)
+            self.assertTrue(numpy.allclose(self.abscan._calc_similarity_matrix(metric=metric), reference))
+
+            abscan = LIEScanDataFrame()
+            abscan.scan(self.liedata, memory_budget=0.01, similarity_dtype='float32')
+            self.assertTrue(numpy.allclose(abscan._calc_similarity_matrix(metric=metric), reference, rtol=1e-4, atol=1e-4))
+
+        self.assertIn(('correlation', 'float64'), self.abscan.similarity_cache)
+        self.assertEqual(len(self.abscan.outliers) + len(self.abscan.inliers), len(self.abscan.cases))
+        self.assertEqual(self.abscan.settings.pdist_metric, 'euclidean')
+
+    def test_scanframe_add_drop_cases(self):
+        """
+        Test incremental addition and removal of cases against full scans
+        """
+
+        added = self.abscan.cases[::5]
+        data = self.liedata[~self.liedata['case'].isin(added)]
+
+        abscan = LIEScanDataFrame()
+        abscan.scan(LIEDataFrame(data))
+        abscan._calc_similarity_matrix(metric='correlation')
+        abscan.add_cases(LIEDataFrame(self.liedata[self.liedata['case'].isin(added)]))
+
+        self.assertEqual(abscan.cases, self.abscan.cases)
+        self.assertTrue(numpy.allclose(abscan.get_cube(), self.abscan.get_cube()))
+        self.assertTrue(numpy.allclose(abscan._calc_similarity_matrix(metric='correlation'),
+                                       self.abscan._calc_similarity_matrix(metric='correlation')))
+
+        abscan.drop_cases(added)
+        reference = LIEScanDataFrame()
+        reference.scan(LIEDataFrame(data))
+
+        self.assertEqual(len(abscan), len(reference.cases))
+        self.assertTrue(numpy.allclose(abscan.get_cube(), reference.get_cube()))
+        self.assertTrue(numpy.array_equal(abscan.get_density().values, reference.get_density().values))
+
+    def test_scanframe_save_load(self):
+        """
+        Test saving and memory-mapped loading of scan results and reuse of
+        saved scans from a scan store directory
+        """
+
+        scan_store = tempfile.mkdtemp()
+        try:
+            abscan = LIEScanDataFrame()
+            abscan.scan(self.liedata, scan_store=scan_store)
+            saved = os.path.join(scan_store, os.listdir(scan_store)[0])
+
+            loaded = LIEScanDataFrame()
+            loaded.load(saved)
+            self.assertIsInstance(loaded.get_cube(), numpy.memmap)
+            self.assertEqual(loaded.cases, self.abscan.cases)
+            self.assertTrue(numpy.allclose(loaded.get_cube(), self.abscan.get_cube()))
+            self.assertTrue(numpy.allclose(loaded.get_optimal().values, self.abscan.get_optimal().values))
+
+            reused = LIEScanDataFrame()
+            reused.scan(self.liedata, scan_store=scan_store)
+            self.assertIsInstance(reused.get_cube(), numpy.memmap)
+            self.assertEqual(len(os.listdir(scan_store)), 1)
+
+            # Changes to a loaded scan are not written back to the saved scan
+            dropped = self.abscan.cases[:3]
+            reused.drop_cases(dropped)
+            reused.add_cases(LIEDataFrame(self.liedata[self.liedata['case'].isin(dropped)]))
+            self.assertTrue(numpy.allclose(reused.get_cube(), self.abscan.get_cube()))
+            self.assertTrue(numpy.array_equal(numpy.load(os.path.join(saved, 'dg_cube.npy')), loaded.get_cube()))
+
+            # Scans storing pose probabilities are saved separately
+            probabilities = LIEScanDataFrame()
+            probabilities.scan(self.liedata, scan_store=scan_store, store_probabilities=True)
+            self.assertEqual(len(os.listdir(scan_store)), 2)
+
+            # Nor to the scan_file of an earlier scan of the same instance
+            scan_file = os.path.join(scan_store, 'alphabetascan.npy')
+            scanned = LIEScanDataFrame()
+            scanned.scan(self.liedata, scan_file=scan_file)
+            scanned.load(saved)
+            scanned.drop_cases(dropped)
+            self.assertTrue(numpy.allclose(numpy.load(scan_file), self.abscan.get_cube()))
+        finally:
+            shutil.rmtree(scan_store)
+
     def test_scanframe_get_optimal(self):
         """
         Test LIEScanDataFrame 'get_optimal' method
@@ -77,6 +287,21 @@ class TestLIEScanDataFrame(unittest.TestCase):
         self.assertEqual(sorted(optimal.index), self.abscan.cases)
         self.assertEqual(sorted(optimal.columns), ['alpha', 'beta', 'error'])
 
+    def test_scanframe_get_density(self):
+        """
+        Test LIEScanDataFrame 'get_density' case counts for signed and
+        absolute dG errors
+        """
+
+        error = self.abscan.get_cube('error')
+        for absolute in (False, True):
+            density = self.abscan.get_density(ltol=-1, utol=1, absolute=absolute)
+            data = numpy.abs(error) if absolute else error
+
+            self.assertEqual(density.shape, (self.abscan.Sa, self.abscan.Sb))
+            self.assertTrue(numpy.array_equal(numpy.flipud(density.values),
+                                              ((data >= -1) & (data <= 1)).sum(axis=2)))
+
     def test_scanframe_get_cases(self):
         """
         Get all cases that are within 3 dg error within a defined
@@ -92,4 +317,32 @@ class TestLIEScanDataFrame(unittest.TestCase):
         self.assertIsInstance(propd, DataFrame)
         self.assertEqual(list(propd['case'].unique().astype(int)), self.abscan.cases)
         self.assertEqual(list(propd.columns), ['case', 'pose', 'tag', 'min', 'max',
-                                               'mean', 'slope', 'total', 'overlap'])
\ No newline at end of file
+                                               'mean', 'slope', 'total', 'overlap'])
+
+        # Statistics accumulated over alpha bands within a small memory budget
+        abscan = LIEScanDataFrame()
+        abscan.scan(self.liedata, memory_budget=0.05)
+        self.assertTrue(numpy.allclose(abscan.propensity_distribution().values.astype(float),
+                                       propd.values.astype(float), equal_nan=True))
+
+    def test_scanframe_propensity_statistics(self):
+        """
+        Test pose probability statistics of the propensity distribution
+        against a direct calculation for a single case
+        """
+
+        propd = self.abscan.propensity_distribution()
+        optimal = self.abscan.get_optimal()
+
+        case = self.abscan.cases[0]
+        optimum = abs(optimal.loc[case, 'error'])
+        search = round(optimum, -int(numpy.floor(numpy.log10(optimum)))) + 0.1
+        errors = abs(self.abscan.get_cube('error')[:, :, 0]).flatten()
+        probabilities = self.abscan.get_probabilities(case).reshape(self.abscan.Sa * self.abscan.Sb, -1)
+
+        for pose, row in propd[propd['case'] == case].set_index('pose').iterrows():
+            selection = probabilities[errors < search, pose - 1]
+            self.assertAlmostEqual(row['min'], selection.min())
+            self.assertAlmostEqual(row['max'], selection.max())
+            self.assertAlmostEqual(row['mean'], selection.mean())
+            self.assertAlmostEqual(row['slope'], numpy.mean(numpy.gradient(selection)))
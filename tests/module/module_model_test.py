@@ -7,11 +7,18 @@ Test the pylie LIEModelBuilder methods
 """
 
 import os
+import shutil
+import tempfile
 import unittest
+import numpy
 
-from pandas import read_csv
+from pandas import read_csv, DataFrame
 
-from pylie import LIEDataFrame, LIEModelBuilder
+from pylie import LIEDataFrame, LIEModelBuilder, pylie_cache
+from pylie.cache import ResultCache
+from pylie.model.liemodelframe import OLSregression, WLSregression, RLMregression
+from pylie.methods.methods import cv_partitions, cv_partition_matrix, cv_set_partitioner
+from pylie.methods.stats import sdec
 
 
 class TestLIEModelBuilder(unittest.TestCase):
@@ -57,4 +64,439 @@ class TestLIEModelBuilder(unittest.TestCase):
         """
         Test LIEModelBuilder model method
         """
-        m = self.model.model()
\ No newline at end of file
+        m = self.model.model()
+
+    def test_modelbuilder_model_lm(self):
+        """
+        Test LIEModelBuilder model method using the Levenberg-Marquardt
+        optimizer. The direct nonlinear least-squares fit should converge
+        to a sum of squared residuals no larger than the iterative optimizer.
+        """
+
+        iterative = self.model.model()
+        m = self.model.model(optimizer='lm')
+
+        self.assertEqual(m.converge, 1)
+        self.assertLess(m.iteration, 10)
+        self.assertLessEqual(m.rmsd, iterative.rmsd)
+        self.assertAlmostEqual(m.rmsd, sdec(m.trainset['ref_affinity'].values, m.trainset['dg_calc'].values))
+
+        # Robust variant reports the converged parameters of the last iteration
+        m = self.model.model(optimizer='lm', rmodel=RLMregression(), keep_trace=True, use_cache=False)
+        trace = self.model.gettrace(m.mid)
+        self.assertEqual(m.converge, 1)
+        self.assertTrue(numpy.allclose(trace.iloc[-1][self.model.settings.param_labels].astype(float),
+                                       m.model.params))
+
+    def test_modelbuilder_model_acceleration(self):
+        """
+        Test Anderson and Aitken acceleration of the iterative optimizer.
+        Accelerated runs should converge to the same fixed-point in no more
+        iterations than the plain fixed-point iteration.
+        """
+
+        m = self.model.model(conv_cutoff=1e-12)
+        for acceleration in ('anderson', 'aitken'):
+            a = self.model.model(conv_cutoff=1e-12, acceleration=acceleration)
+
+            self.assertEqual(a.converge, 1)
+            self.assertLessEqual(a.iteration, m.iteration)
+            for p1, p2 in zip(a.model.params, m.model.params):
+                self.assertAlmostEqual(p1, p2, places=4)
+
+    def test_modelbuilder_model_trace(self):
+        """
+        Test that only the selected model of an optimizer run is added to the
+        LIEModelBuilder and that the iteration history is available as trace.
+        """
+
+        m = self.model.model(keep_trace=True)
+        trace = self.model.gettrace(m.mid)
+
+        self.assertEqual(len(self.model), 1)
+        self.assertEqual(list(trace['iteration']), list(range(len(trace))))
+        self.assertGreaterEqual(len(trace) - 1, m.iteration)
+        self.assertAlmostEqual(trace.loc[m.iteration, 'rmsd'], m.rmsd)
+        for p1, p2 in zip(trace.loc[m.iteration, ['alpha', 'beta']], m.model.params):
+            self.assertAlmostEqual(p1, p2)
+
+        # A model reusing the index of a dropped one has no trace without keep_trace
+        self.model.drop(m.mid, inplace=True)
+        refit = self.model.model(keep_trace=False)
+        self.assertEqual(refit.mid, m.mid)
+        self.assertIsNone(self.model.gettrace(refit.mid))
+
+    def test_modelbuilder_lstsq_results(self):
+        """
+        Test the closed-form least-squares results used by the OLS and WLS
+        regressors against the statsmodels results build on demand.
+        """
+
+        m = self.model.model()
+        ols = OLSregression()
+        ols.set(m.model.endog, m.model.exog)
+        results = ols.fit()
+
+        self.assertIsNone(results._results)
+        self.assertTrue(numpy.allclose(results.params, m.model.params))
+        self.assertTrue(numpy.allclose(results.bse, ols.model.fit().bse))
+        self.assertIsNotNone(results._results)
+        self.assertTrue(numpy.allclose(results.predict(), results._results.fittedvalues))
+        self.assertTrue(numpy.allclose(results.resid, results._results.resid))
+
+        wls = WLSregression(weights=numpy.linspace(0.5, 1.5, len(results.endog)))
+        wls.set(results.endog, results.exog)
+        self.assertTrue(numpy.allclose(wls.fit().params, wls.model.fit().params))
+
+    def test_modelbuilder_batchmodel_rlm(self):
+        """
+        Test batch modelling of case subsets using stacked robust regression
+        against models build one subset at a time.
+        """
+
+        cases = self.model.dataframe.cases
+        clusterset = DataFrame({'case': cases})
+        for cluster in range(5):
+            clusterset[cluster] = [int((case + cluster) % 4 != 0) for case in cases]
+
+        self.model.batchmodel(clusterset, rmodel=RLMregression(), usefilter=False)
+
+        single = LIEModelBuilder(dataframe=self.model.dataframe)
+        for cluster in range(5):
+            self.model.dataframe.reset_trainset()
+            single.model(rmodel=RLMregression(), cases=clusterset.loc[clusterset[cluster] == 1, 'case'].tolist(),
+                         label=cluster, usefilter=False)
+
+        # Cluster 0 is not a label, the next free label is used as for model
+        self.assertEqual(len(self.model), 5)
+        self.assertEqual(list(self.model['L0']), [2, 1, 2, 3, 4])
+        self.assertEqual(list(self.model['L0']), list(single['L0']))
+        for index in self.model.index:
+            self.assertEqual(list(self.model.loc[index, 'set']), list(single.loc[index, 'set']))
+            self.assertEqual(self.model.loc[index, 'iteration'], single.loc[index, 'iteration'])
+            for param in ('alpha', 'beta', 'rmsd'):
+                self.assertAlmostEqual(self.model.loc[index, param], single.loc[index, param], places=6)
+
+    def test_modelbuilder_result_cache(self):
+        """
+        Test reuse of optimizer runs from the shared result cache in memory
+        and on disk.
+        """
+
+        self.assertFalse(ResultCache().enabled)
+
+        cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cachedir)
+        self.addCleanup(pylie_cache.settings.revert, 'disk_maxsize')
+        self.addCleanup(pylie_cache.settings.revert, 'directory')
+        self.addCleanup(pylie_cache.settings.revert, 'maxsize')
+        pylie_cache.clear()
+        pylie_cache.configure(maxsize=256, directory=cachedir)
+
+        first = self.model.model(rmodel=RLMregression(), usefilter=False)
+        misses = pylie_cache.misses
+        self.assertEqual(len(os.listdir(cachedir)), 2)
+
+        # Identical data and settings in a new model builder reuse the run
+        builder = LIEModelBuilder(dataframe=self.model.dataframe)
+        second = builder.model(rmodel=RLMregression(), usefilter=False)
+        self.assertEqual(pylie_cache.misses, misses)
+        self.assertTrue(numpy.allclose(first.model.params, second.model.params))
+        self.assertTrue(numpy.allclose(first['dg_calc'], second['dg_calc']))
+        self.assertEqual(builder.loc[builder.index[0], 'iteration'],
+                         self.model.loc[self.model.index[0], 'iteration'])
+
+        # Cached results are returned as copies
+        params = numpy.array(first.model.params)
+        second.model.params[:] = 0
+        second.model.intercept = 'changed'
+        fourth = LIEModelBuilder(dataframe=self.model.dataframe).model(rmodel=RLMregression(), usefilter=False)
+        self.assertTrue(numpy.allclose(fourth.model.params, params))
+        self.assertNotEqual(fourth.model.intercept, 'changed')
+
+        # Reload from disk after clearing the memory tier
+        pylie_cache.clear()
+        third = LIEModelBuilder(dataframe=self.model.dataframe).model(rmodel=RLMregression(), usefilter=False)
+        self.assertEqual(pylie_cache.misses, misses)
+        self.assertTrue(numpy.allclose(first.model.params, third.model.params))
+
+        # Other settings are a new run, disk tier evicted to size
+        LIEModelBuilder(dataframe=self.model.dataframe).model(rmodel=RLMregression(), usefilter=False,
+                                                              def_params=[0.4, 0.6])
+        self.assertGreater(pylie_cache.misses, misses)
+        pylie_cache.configure(disk_maxsize=0)
+        self.assertEqual(os.listdir(cachedir), [])
+
+    def test_modelbuilder_batchmodel_parallel(self):
+        """
+        Test batch modelling of case subsets by worker processes against
+        models build one subset at a time.
+        """
+
+        cases = self.model.dataframe.cases
+        clusterset = DataFrame({'case': cases})
+        for cluster in range(4):
+            clusterset[cluster] = [int((case + cluster) % 3 != 0) for case in cases]
+
+        for optimizer in ('iterative', 'lm'):
+            parallel = LIEModelBuilder(dataframe=self.model.dataframe.copy())
+            parallel.batchmodel(clusterset, usefilter=False, use_cache=False, nproc=2, optimizer=optimizer)
+
+            single = LIEModelBuilder(dataframe=self.model.dataframe.copy())
+            single.batchmodel(clusterset, usefilter=False, use_cache=False, optimizer=optimizer)
+
+            self.assertEqual(list(parallel['L0']), list(single['L0']))
+            self.assertEqual(list(parallel.dataframe.trainset.cases), list(single.dataframe.trainset.cases))
+            for index in single.index:
+                self.assertEqual(list(parallel.loc[index, 'set']), list(single.loc[index, 'set']))
+                self.assertEqual(parallel.loc[index, 'iteration'], single.loc[index, 'iteration'])
+                for param in ('alpha', 'beta', 'rmsd', 'rsquared'):
+                    self.assertAlmostEqual(parallel.loc[index, param], single.loc[index, param], places=8)
+
+    def test_modelbuilder_crossvalidate_warm_start(self):
+        """
+        Test cross-validation folds started from the parameters of the full
+        model against folds started from the default parameters.
+        """
+
+        model = self.model.model()
+        cold = model.crossvalidate(warm_start=False, use_cache=False)
+        warm = model.crossvalidate(warm_start=True, use_cache=False)
+
+        self.assertEqual(len(warm), len(cold))
+        self.assertAlmostEqual(warm._metadata['q2'], cold._metadata['q2'], places=4)
+        self.assertAlmostEqual(warm._metadata['sdep'], cold._metadata['sdep'], places=3)
+        self.assertLess(warm['iteration'].mean(), cold['iteration'].mean())
+        self.assertEqual(list(warm.settings.def_params), [float(param) for param in model.model.params])
+
+    def test_modelbuilder_crossvalidate_fast_loo(self):
+        """
+        Test hat matrix leave-one-out against refitting the regression with
+        fixed Boltzmann weights for every left out case.
+        """
+
+        model = self.model.model()
+        cv = model.crossvalidate(fast=True, exact=True)
+
+        exog = model.model.exog
+        response = model.model.endog
+        test_observed = []
+        for case in range(len(response)):
+            train = numpy.arange(len(response)) != case
+            params = numpy.linalg.lstsq(exog[train], response[train], rcond=None)[0]
+            test_observed.append(exog[case].dot(params))
+
+        test_observed = numpy.array(test_observed)
+        self.assertTrue(cv._metadata['fast'])
+        self.assertAlmostEqual(cv._metadata['sdep_fast'], sdec(response, test_observed), places=8)
+
+        # Refitted statistics are kept with exact, fast ones stored separately
+        refit = model.crossvalidate()._metadata
+        self.assertAlmostEqual(cv._metadata['q2'], refit['q2'], places=8)
+        self.assertAlmostEqual(cv._metadata['sdep'], refit['sdep'], places=8)
+        self.assertAlmostEqual(cv._metadata['q2_fast'] - cv._metadata['q2'], cv._metadata['q2_deviation'], places=8)
+        self.assertLess(abs(cv._metadata['q2_deviation']), 0.05)
+
+        fast = model.crossvalidate(fast=True)._metadata
+        self.assertEqual(fast['q2'], cv._metadata['q2_fast'])
+        self.assertEqual(fast['sdep'], cv._metadata['sdep_fast'])
+        self.assertRaises(AssertionError, model.crossvalidate, cvtype='RAND', fast=True)
+
+    def test_modelbuilder_cv_partitions(self):
+        """
+        Test the cross-validation partition generator and its use by
+        crossvalidate.
+        """
+
+        cases = list(range(10, 40))
+        affinity = numpy.linspace(-12, -2, 30)
+        for cvtype, p, count in (('LOO', 1, 30), ('LPO', 2, 50), ('RAND', 0.8, 50), ('KFOLD', 5, 5)):
+            partitions = list(cv_partitions(cases, cvtype=cvtype, p=p, maxpartitions=50, seed=1))
+            self.assertEqual(len(partitions), count)
+            self.assertEqual(len(set(tuple(test) for train, test in partitions)), count)
+            for train, test in partitions:
+                self.assertEqual(sorted(numpy.concatenate((train, test))), list(range(30)))
+
+            # Reproducible given the seed
+            again = list(cv_partitions(cases, cvtype=cvtype, p=p, maxpartitions=50, seed=1))
+            self.assertTrue(all(numpy.array_equal(a[1], b[1]) for a, b in zip(partitions, again)))
+
+        # Stratified folds draw equally from every affinity bin
+        for train, test in cv_partitions(cases, cvtype='KFOLD', p=3, seed=2, strata=affinity, bins=5):
+            self.assertEqual(list(numpy.bincount(numpy.digitize(affinity[test], [-10, -8, -6, -4]))), [2] * 5)
+
+        matrix = cv_set_partitioner(cases, cvtype='KFOLD', p=3)
+        self.assertEqual(list(matrix[0]), [0] * 10 + [1] * 20)
+
+        model = self.model.model()
+        cv = model.crossvalidate(cvtype='KFOLD', p=5, seed=1, stratify=True)
+        self.assertEqual(len(cv), 5)
+        self.assertEqual(cv._metadata['n'], len(model.trainset))
+
+        # Partition index arrays model the same training sets as the partition matrix
+        cases = self.model.dataframe.cases
+        partitions = list(cv_partitions(cases, cvtype='RAND', p=0.8, maxpartitions=4, seed=1))
+        indexed = LIEModelBuilder(dataframe=self.model.dataframe.copy())
+        indexed.batchmodel(partitions=partitions, cases=cases, usefilter=False)
+        matrix = LIEModelBuilder(dataframe=self.model.dataframe.copy())
+        matrix.batchmodel(cv_partition_matrix(cases, partitions), usefilter=False)
+
+        self.assertEqual(len(indexed), 4)
+        self.assertEqual(list(indexed['L0']), list(matrix['L0']))
+        for index in matrix.index:
+            self.assertEqual(list(indexed.loc[index, 'set']), list(matrix.loc[index, 'set']))
+            self.assertAlmostEqual(indexed.loc[index, 'alpha'], matrix.loc[index, 'alpha'])
+
+    def test_modelbuilder_case_membership(self):
+        """
+        Test bit array case membership based set algebra of models against
+        Python sets.
+        """
+
+        cases = self.model.dataframe.cases
+        clusterset = DataFrame({'case': cases})
+        for cluster in range(1, 5):
+            clusterset[cluster] = [int(case % (cluster + 1) != 0) for case in cases]
+        clusterset[5] = clusterset[2]
+        clusterset[6] = clusterset[2] * clusterset[3]
+        self.model.batchmodel(clusterset, usefilter=False)
+
+        universe, bits = self.model.case_membership()
+        self.assertEqual(list(universe), cases)
+        members = numpy.unpackbits(bits, axis=1)[:, :len(cases)].astype(bool)
+        sets = dict((index, set(self.model.loc[index, 'set'])) for index in self.model.index)
+        for row, index in enumerate(self.model.index):
+            self.assertEqual(set(universe[members[row]]), sets[index])
+
+        first, second = self.model.index[1], self.model.index[-1]
+        self.assertEqual(self.model.intersection(first, second), sorted(sets[first] & sets[second]))
+        self.assertEqual(self.model.difference(first, second), sorted(sets[first] - sets[second]))
+        self.assertEqual(self.model.difference(first, second, symmetric=True), sorted(sets[first] ^ sets[second]))
+        self.assertEqual(self.model.issuperset(first, second), sets[first] >= sets[second])
+        self.assertEqual(self.model.get_cases(second), sorted(sets[second]))
+
+        clusters = self.model.clusters()
+        for i in self.model.index:
+            for j in self.model.index:
+                self.assertEqual(clusters.loc[i, j], int(i != j and sets[i] <= sets[j]))
+        self.assertEqual(self.model.duplicates(), [self.model.index[4]])
+
+    def test_modelbuilder_case_membership_reindex(self):
+        """
+        Test case membership of a new model reusing the index of a dropped one
+        """
+
+        dataframe = self.model.dataframe
+        cases = dataframe.cases
+        dataframe.reset_trainset()
+        self.model.model(cases=cases[:30])
+        dataframe.reset_trainset()
+        self.model.model(cases=cases)
+        self.assertEqual(len(self.model.get_cases(1)), len(cases))
+
+        self.model.drop(1, inplace=True)
+        dataframe.reset_trainset()
+        self.model.model(cases=cases[:30])
+        self.assertEqual(self.model.get_cases(1), sorted(self.model.loc[1, 'set']))
+        self.assertEqual(len(self.model.get_cases(1)), 30)
+        self.assertEqual(self.model.duplicates(), [1])
+
+    def test_modelbuilder_model_similarity(self):
+        """
+        Test the vectorized model distance matrix against the pairwise metric
+        """
+
+        cases = self.model.dataframe.cases
+        clusterset = DataFrame({'case': cases})
+        for cluster in range(1, 6):
+            clusterset[cluster] = [int(case % (cluster + 2) != 0) for case in cases]
+        self.model.batchmodel(clusterset, usefilter=False)
+
+        similarity = self.model.model_similarity()
+        self.assertEqual(list(similarity.index), list(self.model.sort_values('rmsd').index))
+
+        sets = dict((index, set(self.model.loc[index, 'set'])) for index in self.model.index)
+        frequency = dict((case, sum(case in s for s in sets.values()) / float(len(sets))) for case in cases)
+        largest = self.model.loc[self.model['N'].astype(int).idxmax(), ['alpha', 'beta']].values
+        for i in self.model.index:
+            for j in self.model.index:
+                symmetric = sum(1 - frequency[case] for case in sets[i] ^ sets[j])
+                union = sum(1 - frequency[case] for case in sets[i] | sets[j])
+                expected = symmetric / union if symmetric else 0
+                for param, top in zip(('alpha', 'beta'), largest):
+                    total = abs(top - self.model.loc[i, param]) + abs(top - self.model.loc[j, param])
+                    if total:
+                        expected += abs(self.model.loc[i, param] - self.model.loc[j, param]) / total
+                self.assertAlmostEqual(similarity.loc[i, j], expected / 3, places=10)
+
+    def test_modelbuilder_pivot_cache(self):
+        """
+        Test cached case x pose pivots against a pivot table of the data
+        """
+
+        dataframe = self.model.dataframe
+        subset = dataframe.cases[::3]
+        for column in ('vdw', 'coul', 'ref_affinity', 'filter_mask'):
+            expected = self.model._pivot_data(dataframe, column)
+            pivot = self.model._pivot_cases(column)
+            self.assertTrue(numpy.allclose(pivot.values, expected.values, equal_nan=True))
+            self.assertEqual(list(pivot.columns), list(expected.columns))
+
+            dataframe.reset_trainset()
+            dataframe.trainset = subset
+            expected = self.model._pivot_data(dataframe.trainset, column)
+            pivot = self.model._pivot_cases(column, cases=subset)
+            self.assertEqual(list(pivot.index), [int(case) for case in subset])
+            self.assertTrue(numpy.allclose(pivot.values, expected.values, equal_nan=True))
+
+        # Changed column data is pivoted again
+        dataframe.loc[dataframe.index[0], 'vdw'] += 10
+        self.assertTrue(numpy.allclose(self.model._pivot_cases('vdw').values,
+                                       self.model._pivot_data(dataframe, 'vdw').values, equal_nan=True))
+
+        # Unknown cases, also beyond the largest case ID
+        largest = max([int(case) for case in dataframe.cases])
+        self.assertRaises(KeyError, self.model._pivot_cases, 'vdw', cases=[dataframe.cases[0], largest + 1])
+        self.assertRaises(KeyError, self.model._pivot_cases, 'vdw', cases=[-1])
+
+    def test_modelbuilder_mcresample(self):
+        """
+        Test seeded MonteCarlo resampling chains, only the last accepted model
+        of every chain is added to the model builder.
+        """
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(workdir)
+
+        dataframe = self.model.dataframe
+        dataframe.reset_trainset()
+        full = self.model.model(rmodel=RLMregression(), cases=dataframe.cases)
+        dataframe.reset_trainset()
+        source = self.model.model(cases=list(full[full['weights'] > 0.95].cases)[:12])
+        models = len(self.model)
+
+        cases = self.model.mcresample(source.mid, max_iter_steps=15, mc_chains=2, mc_seed=3)
+        self.assertGreater(len(cases), len(source.trainset))
+        self.assertLessEqual(len(self.model), models + 3)
+
+        # Accepted chain models pass the filter and match the tracked moves
+        tracker = read_csv(os.path.join(workdir, 'tracker_model_{0}.csv'.format(source.mid)), index_col=0)
+        accepted = tracker.loc[tracker['mid'].notnull(), 'mid'].astype(int).values[1:]
+        self.assertTrue(len(accepted))
+        self.assertTrue((self.model.loc[accepted, 'filter_mask'] == 0).all())
+        largest = self.model.loc[accepted, 'N'].astype(int).idxmax()
+        self.assertEqual(sorted(self.model.get_cases(largest)), sorted(cases))
+        poses = read_csv(os.path.join(workdir, 'poses_model_{0}.csv'.format(source.mid)), index_col=0)
+        self.assertEqual(poses.shape, (len(dataframe.cases), len(tracker) - tracker['chain'].nunique()))
+
+        # Identical seed, identical chains
+        self.assertEqual(self.model.mcresample(source.mid, max_iter_steps=15, mc_chains=2, mc_seed=3), cases)
+
+        # Warm started moves, start parameters and filter rules are restored
+        def_params = list(self.model.settings.def_params)
+        rmsd_filter = list(self.model.settings.filter['rmsd'])
+        self.model.mcresample(source.mid, max_iter_steps=15, mc_chains=2, mc_seed=3, warm_start=True)
+        self.assertEqual(list(self.model.settings.def_params), def_params)
+        self.assertEqual(list(self.model.settings.filter['rmsd']), rmsd_filter)
@@ -3,6 +3,7 @@ from mdstudio.component.session import ComponentSession
 from mdstudio.runner import main
 from os.path import join
 
+import base64
 import numpy as np
 import os
 import pandas as pd
@@ -23,8 +24,12 @@ def create_path_file_obj(path, encoding='utf8'):
     Encode the input files
     """
     extension = os.path.splitext(path)[1]
-    with open(path, 'r') as f:
-        content = f.read()
+    if encoding == 'base64':
+        with open(path, 'rb') as f:
+            content = base64.b64encode(f.read()).decode('ascii')
+    else:
+        with open(path, 'r') as f:
+            content = f.read()
 
     return {
         u'path': path, u'encoding': encoding,
@@ -83,11 +88,11 @@ dict_deltag = {
     u"dataframe": create_path_file_obj(path_averaged)}
 
 path_decompose = join(root, "files/adan_residue_deco/decompose_dataframe.ene")
-path_params = join(root, "files/adan_residue_deco/params.pkl")
+path_params = join(root, "files/adan_residue_deco/params.npz")
 dict_adan_residue = {
     u"workdir": u"/tmp",
     u"decompose_files": [create_path_file_obj(path_decompose)],
-    u"model_pkl": create_path_file_obj(path_params)}
+    u"model": create_path_file_obj(path_params, encoding='base64')}
 
 path_liedeltag = join(root, "files/adan_dene_yrange/liedeltag.csv")
 dict_adan_yrange = {
@@ -151,7 +156,7 @@ dict_adan_dene = {
     u"ci_cutoff": 13.690708685318436,
     u"workdir": u"/tmp",
     u"liedeltag": dict_adan_yrange["liedeltag"],
-    u"model_pkl": dict_adan_residue["model_pkl"],
+    u"model": dict_adan_residue["model"],
     u"dataframe": dict_adan_yrange["dataframe"],
     u"center": [-53.11058012546337, 21.656883661248937]}
 